@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# alignment.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Partition and physical volume alignment from the I/O topology.
+
+The kernel reports in /sys/block/<disk>/queue the physical block size
+and the minimum and optimal I/O sizes of a disk, e.g. the chunk and
+stripe width of a RAID LUN, and in alignment_offset how far sector 0
+is off the natural alignment.  A Topology turns these into a grain:
+the smallest multiple of 1MiB that is also a multiple of the optimal
+I/O size, so partitions and LVM data areas starting on it never
+straddle a stripe.
+
+    topology = alignment.topology("/dev/sda")
+    layout = partplan.Layout("gpt", topology.logical, topology.grain,
+                             topology.offset)
+"""
+
+import logging
+import ovirtnode.blockinventory as blockinventory
+
+logger = logging.getLogger("ovirtnode.alignment")
+
+KIB = 1024
+MIB = 1024 * KIB
+SECTOR_SIZE = 512
+# some bridges report absurd optimal I/O sizes, e.g. 32767 sectors
+MAX_GRAIN = 64 * MIB
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def _lcm(a, b):
+    return a / _gcd(a, b) * b
+
+
+class Topology(object):
+    """I/O sizes of one disk, in bytes; 0 if not reported."""
+
+    def __init__(self, logical=SECTOR_SIZE, physical=0, minimum_io=0,
+                 optimal_io=0, offset=0):
+        self.logical = logical or SECTOR_SIZE
+        self.physical = max(physical, self.logical)
+        self.minimum_io = minimum_io
+        self.optimal_io = optimal_io
+        self.offset = offset
+        self.grain = _lcm(MIB, self.io_size)
+        if self.grain > MAX_GRAIN:
+            logger.warning("Ignoring I/O size %d, aligning to 1MiB" %
+                           self.io_size)
+            self.grain = MIB
+
+    def __repr__(self):
+        return "<Topology %s grain %dKiB>" % (self.describe(),
+                                             self.grain / KIB)
+
+    @property
+    def io_size(self):
+        """The largest reported I/O size the others divide."""
+        size = self.physical
+        for io in (self.minimum_io, self.optimal_io):
+            if io and io % size == 0:
+                size = io
+        return size
+
+    def aligned(self, offset):
+        """True if a partition starting at byte offset is aligned to
+        all reported I/O sizes."""
+        for size in (self.physical, self.minimum_io, self.optimal_io):
+            if size and (offset - self.offset) % size:
+                return False
+        return True
+
+    def describe(self):
+        return "logical %d, physical %d, io min %d opt %d, offset %d" % (
+            self.logical, self.physical, self.minimum_io, self.optimal_io,
+            self.offset)
+
+
+def from_device(device):
+    """Returns the Topology of a BlockDevice; partitions share the
+    queue of their disk."""
+    queue = device.queue
+    return Topology(queue.get("logical_block_size", SECTOR_SIZE),
+                    queue.get("physical_block_size", 0),
+                    queue.get("minimum_io_size", 0),
+                    queue.get("optimal_io_size", 0),
+                    device.alignment_offset)
+
+
+def topology(dev):
+    """Returns the Topology of a disk or partition from the block
+    inventory, or 512 byte sectors and 1MiB alignment if unknown."""
+    device = blockinventory.current().get(dev)
+    if device is None:
+        return Topology()
+    return from_device(device)
+
+
+def pvcreate_options(grain):
+    """Returns the pvcreate options starting the data area of a
+    physical volume on an aligned partition at a multiple of grain."""
+    return ["--dataalignment", "%dk" % (grain / KIB)]
+
+
+def report(drive, found, partitions, sector_size):
+    """Returns lines describing the alignment of partitions, given as
+    [(number, name, start sector)], on drive with Topology found."""
+    lines = ["%s: %s; grain %dKiB" % (drive, found.describe(),
+                                      found.grain / KIB)]
+    for number, name, start in partitions:
+        offset = start * sector_size
+        if found.aligned(offset):
+            status = "aligned"
+        else:
+            status = "MISALIGNED"
+        lines.append("  %d %s at %dKiB: %s" % (number, name, offset / KIB,
+                                               status))
+    return lines
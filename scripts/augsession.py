@@ -0,0 +1,269 @@
+#!/usr/bin/python
+# augsession.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Augeas sessions which load only the files they are asked for.
+
+A default Augeas handle parses every lens module and every file those
+lenses cover below /etc.  The sessions created here start with NO_LOAD
+and NO_MODL_AUTOLOAD and get one transform per lens for just the files
+in play, so a load() touches a handful of files.
+
+The files ovirtnode edits are grouped into scopes.  Each scope has one
+shared session; since the scopes do not overlap, every file is edited
+through exactly one tree.
+
+A transaction() groups edits across sessions and saves every session it
+touched once, instead of once per set or remove.
+"""
+
+import fnmatch
+import threading
+
+# lens and file pattern of every file ovirtnode edits through augeas
+FILES = [
+    ("Shellvars.lns", "/etc/default/ovirt"),
+    ("Shellvars.lns", "/etc/sysconfig/network"),
+    ("Shellvars.lns", "/etc/sysconfig/network-scripts/ifcfg-*"),
+    ("Hosts.lns", "/etc/hosts"),
+    ("Resolv.lns", "/etc/resolv.conf"),
+    ("Ntp.lns", "/etc/ntp.conf"),
+    ("Sshd.lns", "/etc/ssh/sshd_config"),
+    ("Shellvars.lns", "/etc/sysconfig/netconsole"),
+    ("Logrotate.lns", "/etc/logrotate.d/ovirt-node"),
+]
+
+SCOPES = {
+    "defaults": ["/etc/default/ovirt"],
+    "network": ["/etc/sysconfig/network",
+                "/etc/sysconfig/network-scripts/ifcfg-*",
+                "/etc/hosts",
+                "/etc/resolv.conf",
+                "/etc/ntp.conf"],
+    "ssh": ["/etc/ssh/sshd_config"],
+    "logging": ["/etc/sysconfig/netconsole",
+                "/etc/logrotate.d/ovirt-node"],
+}
+
+_lock = threading.Lock()
+_sessions = {}
+_full = None
+_local = threading.local()
+
+
+def lens_for(pattern):
+    for lens, incl in FILES:
+        if incl == pattern:
+            return lens
+    raise KeyError("no lens known for %s" % pattern)
+
+
+def _prepare(aug):
+    #   workaround for bind-mounted files
+    #   see https://fedorahosted.org/augeas/ticket/32
+    aug.set("/augeas/save/copy_if_rename_fails", "")
+
+
+def new_session(files, root=None, lenses=None):
+    """Returns a new Augeas handle with only files loaded.
+
+    files -- file patterns from FILES, or scope names
+    lenses -- optional {pattern: lens} for files not listed in FILES
+    """
+    import augeas
+    patterns = []
+    for f in files:
+        if f in SCOPES:
+            patterns.extend(SCOPES[f])
+        else:
+            patterns.append(f)
+    by_lens = {}
+    order = []
+    for pattern in patterns:
+        if lenses is not None and pattern in lenses:
+            lens = lenses[pattern]
+        else:
+            lens = lens_for(pattern)
+        if lens not in by_lens:
+            by_lens[lens] = []
+            order.append(lens)
+        by_lens[lens].append(pattern)
+    aug = augeas.Augeas(root=root, flags=augeas.Augeas.NO_LOAD |
+                        augeas.Augeas.NO_MODL_AUTOLOAD)
+    aug.clear_transforms()
+    for lens in order:
+        aug.add_transform(lens, by_lens[lens])
+    _prepare(aug)
+    aug.load()
+    return aug
+
+
+def session(scope):
+    """Returns the shared session of a scope from SCOPES."""
+    _lock.acquire()
+    try:
+        if scope not in _sessions:
+            _sessions[scope] = new_session([scope])
+        return _sessions[scope]
+    finally:
+        _lock.release()
+
+
+def full():
+    """Returns the shared handle loading every lens, for files outside
+    FILES."""
+    global _full
+    _lock.acquire()
+    try:
+        if _full is None:
+            import augeas
+            _full = augeas.Augeas()
+            _prepare(_full)
+        return _full
+    finally:
+        _lock.release()
+
+
+def scope_for(path):
+    """Returns the scope covering an augeas path like /files/etc/hosts/1,
+    or None."""
+    if path.startswith("/files/"):
+        path = path[len("/files"):]
+    # OVIRT_DEFAULTS is often written as "/files/" + "/etc/default/ovirt"
+    while "//" in path:
+        path = path.replace("//", "/")
+    for scope, patterns in SCOPES.items():
+        for pattern in patterns:
+            if fnmatch.fnmatch(path, pattern) or \
+               fnmatch.fnmatch(path, pattern + "/*"):
+                return scope
+    return None
+
+
+def for_path(path):
+    """Returns the shared session to edit path through."""
+    scope = scope_for(path)
+    if scope is None:
+        return full()
+    return session(scope)
+
+
+def reload():
+    """Reloads every shared session created so far."""
+    _lock.acquire()
+    try:
+        sessions = _sessions.values()
+        if _full is not None:
+            sessions.append(_full)
+    finally:
+        _lock.release()
+    for aug in sessions:
+        aug.load()
+
+
+class Transaction(object):
+    """Edits applied to the shared sessions, saved together on commit().
+
+    Edits show up in the trees right away, so get() and match() see
+    them, but nothing is written before commit().  After a commit,
+    changed holds the files which were actually written.
+    """
+
+    def __init__(self):
+        self._sessions = []
+        self.operations = 0
+        self.changed = []
+
+    def _session(self, path):
+        aug = for_path(path)
+        if aug not in self._sessions:
+            self._sessions.append(aug)
+        return aug
+
+    def set(self, path, value):
+        self._session(path).set(path, value)
+        self.operations = self.operations + 1
+
+    def setm(self, base, sub, value):
+        self._session(base).setm(base, sub, value)
+        self.operations = self.operations + 1
+
+    def remove(self, path):
+        self._session(path).remove(path)
+        self.operations = self.operations + 1
+
+    def get(self, path):
+        return for_path(path).get(path)
+
+    def match(self, path):
+        return for_path(path).match(path)
+
+    def commit(self):
+        """Saves every touched session once and returns the paths of the
+        files written."""
+        for aug in self._sessions:
+            aug.save()
+            for event in aug.match("/augeas/events/saved"):
+                path = aug.get(event)
+                if path.startswith("/files/"):
+                    path = path[len("/files"):]
+                if path not in self.changed:
+                    self.changed.append(path)
+        self._sessions = []
+        return self.changed
+
+    def rollback(self):
+        """Drops the uncommitted edits by reloading the touched
+        sessions."""
+        for aug in self._sessions:
+            aug.load()
+        self._sessions = []
+
+
+def current():
+    """Returns the transaction open in this thread, or None."""
+    return getattr(_local, "transaction", None)
+
+
+class transaction(object):
+    """Context manager grouping the augtool() edits of a block.
+
+    with augsession.transaction() as txn:
+        augtool("set", ...)
+    ovirt_store_config(txn.changed)
+
+    The sessions are saved once when the block ends, or reloaded if it
+    raised.  A nested transaction joins the outer one.
+    """
+
+    def __enter__(self):
+        self._outer = current()
+        if self._outer is not None:
+            return self._outer
+        self._txn = Transaction()
+        _local.transaction = self._txn
+        return self._txn
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._outer is not None:
+            return False
+        _local.transaction = None
+        if exc_type is None:
+            self._txn.commit()
+        else:
+            self._txn.rollback()
+        return False
@@ -0,0 +1,616 @@
+#!/usr/bin/python
+# blockinventory.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Inventory of the block devices, read from sysfs and the udev database.
+
+scan() walks /sys/class/block once and returns an Inventory of
+BlockDevice records: size, queue limits, holders and slaves from
+sysfs, and bus, model and serial from the udev database file of each
+device.  Multipath maps are recognized by their dm uuid and linked
+to their paths through slaves/, so dm, path and map lookups need
+neither multipath nor dmsetup.
+
+current() keeps the inventory until a block device uevent arrives.
+
+Both roots can be pointed at a synthetic tree:
+
+    inventory = scan(sysfs="/tmp/sys", udev_db="/tmp/udev")
+"""
+
+import os
+import errno
+import select
+import socket
+import logging
+import threading
+import ovirtnode.process as process
+
+logger = logging.getLogger("ovirtnode.blockinventory")
+
+SYSFS = "/sys"
+# udev >= 174, then the /dev/.udev layouts of older releases
+UDEV_DBS = ["/run/udev/data", "/dev/.udev/data", "/dev/.udev/db"]
+
+SECTOR_SIZE = 512
+
+QUEUE_ATTRS = ("rotational", "logical_block_size", "physical_block_size",
+               "minimum_io_size", "optimal_io_size", "discard_granularity",
+               "discard_max_bytes", "discard_zeroes_data")
+
+# kernel name prefixes that are never install targets
+VIRTUAL_PREFIXES = ("loop", "ram", "zram", "nbd", "md", "sr")
+
+MULTIPATH_UUID_PREFIX = "mpath-"
+
+NETLINK_KOBJECT_UEVENT = 15
+# kernel events, then udev's once it has updated its database
+UEVENT_GROUPS = 0x1 | 0x2
+RECV_SIZE = 65536
+
+
+def _read(path, default=None):
+    try:
+        f = open(path)
+        try:
+            return f.read().strip()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return default
+
+
+def _read_int(path, default=None):
+    value = _read(path)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _listdir(path):
+    try:
+        return sorted(os.listdir(path))
+    except OSError:
+        return []
+
+
+def parse_udev_db(text):
+    """Returns (properties, symlinks) of a udev database file.
+
+    Properties are the "E:KEY=VALUE" lines, symlinks the "S:" lines
+    relative to /dev.
+    """
+    properties = {}
+    symlinks = []
+    for line in text.splitlines():
+        if line.startswith("E:") and "=" in line:
+            key, value = line[2:].split("=", 1)
+            properties[key] = value
+        elif line.startswith("S:"):
+            symlinks.append(line[2:])
+    return properties, symlinks
+
+
+class BlockDevice(object):
+    """One block device as seen by the kernel and udev."""
+
+    def __init__(self, name, devnum, size, partition=False, parent=None,
+                 start=None, alignment_offset=0, removable=False,
+                 read_only=False, queue=None, holders=(), slaves=(),
+                 dm_name=None, dm_uuid=None, properties=None, symlinks=(),
+                 state=None):
+        # kernel name, e.g. "sda" or "cciss!c0d0"
+        self.name = name
+        # "major:minor"
+        self.devnum = devnum
+        self.size = size
+        self.partition = partition
+        # kernel name of the disk of a partition
+        self.parent = parent
+        # byte offset of a partition on its disk
+        self.start = start
+        # bytes the device starts off its natural alignment
+        self.alignment_offset = alignment_offset
+        self.removable = removable
+        self.read_only = read_only
+        self.queue = queue or {}
+        self.holders = list(holders)
+        self.slaves = list(slaves)
+        self.dm_name = dm_name
+        self.dm_uuid = dm_uuid
+        self.properties = properties or {}
+        self.symlinks = list(symlinks)
+        self.state = state
+        # kernel names of the multipath maps using this device
+        self.multipath_maps = []
+
+    def __repr__(self):
+        return "<BlockDevice %s %s %d bytes>" % (self.name, self.path,
+                                                 self.size)
+
+    @property
+    def path(self):
+        if self.dm_name:
+            return "/dev/mapper/" + self.dm_name
+        return "/dev/" + self.name.replace("!", "/")
+
+    @property
+    def size_gb(self):
+        return self.size / 1024 / 1024 / 1024
+
+    @property
+    def rotational(self):
+        return self.queue.get("rotational", 1) == 1
+
+    @property
+    def bus(self):
+        return self.properties.get("ID_BUS")
+
+    @property
+    def model(self):
+        return self.properties.get("ID_MODEL")
+
+    @property
+    def serial(self):
+        return self.properties.get("ID_SERIAL")
+
+    @property
+    def description(self):
+        desc = self.properties.get("ID_SCSI_COMPAT")
+        if desc:
+            return desc
+        if self.name.startswith("vd"):
+            return "virtio disk"
+        return "unknown"
+
+    @property
+    def bus_label(self):
+        """The location shown on the installer disk pages."""
+        bus = self.bus
+        if bus == "usb":
+            return "USB Device          "
+        if bus in ("ata", "scsi", "cciss") or self.name.startswith("vd"):
+            return "Local / FibreChannel"
+        return "                    "
+
+    @property
+    def cdrom(self):
+        return bool(self.properties.get("ID_CDROM"))
+
+    @property
+    def device_mapper(self):
+        return self.name.startswith("dm-")
+
+    @property
+    def multipath(self):
+        """True for a multipath map."""
+        return bool(self.dm_uuid and
+                    self.dm_uuid.startswith(MULTIPATH_UUID_PREFIX))
+
+    @property
+    def multipath_member(self):
+        return len(self.multipath_maps) > 0
+
+    def has_symlink(self, prefix):
+        for link in self.symlinks:
+            if link.startswith(prefix):
+                return True
+        return False
+
+
+class Inventory(object):
+    """The block devices of one scan, by kernel name."""
+
+    def __init__(self, devices):
+        self.devices = devices
+        self._by_path = {}
+        self._by_devnum = {}
+        for device in devices.values():
+            self._by_path[device.path] = device
+            self._by_path["/dev/" + device.name.replace("!", "/")] = device
+            self._by_devnum[device.devnum] = device
+            if device.multipath:
+                for slave in device.slaves:
+                    member = devices.get(slave)
+                    if member is not None:
+                        member.multipath_maps.append(device.name)
+                        # udev keeps the SCSI identity on the paths only
+                        for key in ("ID_BUS", "ID_MODEL", "ID_SERIAL",
+                                    "ID_SCSI_COMPAT"):
+                            if key in member.properties:
+                                device.properties.setdefault(
+                                    key, member.properties[key])
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __iter__(self):
+        names = self.devices.keys()
+        names.sort()
+        for name in names:
+            yield self.devices[name]
+
+    def get(self, dev):
+        """Returns the device for a kernel name, /dev path, /dev/mapper
+        path or "major:minor", or None."""
+        if dev is None or isinstance(dev, BlockDevice):
+            return dev
+        device = self.devices.get(dev)
+        if device is None:
+            device = self._by_devnum.get(dev)
+        if device is None:
+            path = dev
+            if os.path.islink(path):
+                path = os.path.realpath(path)
+            device = self._by_path.get(path)
+        return device
+
+    def by_dm_name(self, name):
+        """Returns the device-mapper device called name, or None."""
+        return self._by_path.get("/dev/mapper/" + name)
+
+    def mapper_path(self, dev):
+        """Returns the /dev/mapper path of a dm device, or None."""
+        device = self.get(dev)
+        if device is None or not device.dm_name:
+            return None
+        return device.path
+
+    def slaves_of(self, dev):
+        """Returns the devices dev is built on, e.g. the paths of a
+        multipath map."""
+        device = self.get(dev)
+        if device is None:
+            return []
+        return [self.devices[s] for s in device.slaves if s in self.devices]
+
+    def holders_of(self, dev):
+        """Returns the devices built on dev."""
+        device = self.get(dev)
+        if device is None:
+            return []
+        return [self.devices[h] for h in device.holders
+                if h in self.devices]
+
+    def partitions_of(self, dev):
+        """Returns the partitions the kernel knows on disk dev, sorted
+        by start; for a multipath map those of its active path."""
+        device = self.active_path(dev)
+        if device is None:
+            return []
+        parts = [d for d in self.devices.values()
+                 if d.partition and d.parent == device.name]
+        parts.sort(key=lambda d: (d.start, d.name))
+        return parts
+
+    def multipath_of(self, dev):
+        """Returns the multipath map dev is, or is a path of, or None."""
+        device = self.get(dev)
+        if device is None:
+            return None
+        if device.multipath:
+            return device
+        if device.multipath_maps:
+            return self.devices[device.multipath_maps[0]]
+        return None
+
+    def active_path(self, dev):
+        """Returns the first running path of a multipath map, or dev
+        itself if it is not multipathed."""
+        device = self.multipath_of(dev)
+        if device is None:
+            return self.get(dev)
+        for path in self.slaves_of(device):
+            if path.state in (None, "running"):
+                return path
+        return None
+
+    def behind_multipath(self, dev):
+        """True for a multipath path and the partitions on it, which
+        are only used through the map."""
+        device = self.get(dev)
+        if device is None:
+            return False
+        if device.multipath_maps:
+            return True
+        parent = self.devices.get(device.parent)
+        return parent is not None and parent.multipath_member
+
+    def translate(self, dev):
+        """Returns the /dev/mapper path of the multipath map dev is, or
+        is a path of, and dev unchanged otherwise."""
+        device = self.get(dev)
+        if device is None:
+            return dev
+        if device.multipath_maps:
+            return self.devices[device.multipath_maps[0]].path
+        if device.multipath:
+            return device.path
+        return dev
+
+    def disks(self):
+        """Whole disks usable as install targets: multipath maps stand
+        in for their paths, partitions, CD-ROMs and virtual devices are
+        left out."""
+        disks = []
+        for device in self:
+            if device.partition or device.cdrom or device.multipath_member:
+                continue
+            # e.g. a card reader without a card
+            if device.size == 0:
+                continue
+            if device.device_mapper:
+                if device.multipath:
+                    disks.append(device)
+                continue
+            if device.name.startswith(VIRTUAL_PREFIXES):
+                continue
+            if device.name[:2] in ("hd", "sd", "vd") or \
+                    device.name.startswith("cciss!"):
+                disks.append(device)
+            elif not device.bus and device.has_symlink("disk/by-id/"):
+                disks.append(device)
+        return disks
+
+
+class Scanner(object):
+    """Reads an Inventory from a sysfs tree and a udev database."""
+
+    def __init__(self, sysfs=SYSFS, udev_db=None):
+        self.sysfs = sysfs
+        self._real_sysfs = os.path.realpath(sysfs)
+        if udev_db is None:
+            for candidate in UDEV_DBS:
+                if os.path.isdir(candidate):
+                    udev_db = candidate
+                    break
+        self.udev_db = udev_db
+
+    def _udev_file(self, name, devnum, entry):
+        db = self.udev_db
+        for path in (os.path.join(db, "b" + devnum),
+                     os.path.join(db, "block:" + name)):
+            text = _read(path)
+            if text is not None:
+                return text
+        # udev 147 names the file after the escaped devpath
+        devpath = self._devpath(entry)
+        if devpath is not None:
+            return _read(os.path.join(db, devpath.replace("/", "\\x2f")))
+        return None
+
+    def _udev(self, name, devnum, entry):
+        if self.udev_db is not None:
+            text = self._udev_file(name, devnum, entry)
+            if text is not None:
+                return parse_udev_db(text)
+            return {}, []
+        # no readable database, ask udevadm for this device
+        devpath = self._devpath(entry)
+        if devpath is None:
+            return {}, []
+        output = process.output(["udevadm", "info", "--query=all",
+                                 "--path=" + devpath])
+        properties = {}
+        symlinks = []
+        for line in output.splitlines():
+            if line.startswith("E: ") and "=" in line:
+                key, value = line[3:].split("=", 1)
+                properties[key] = value
+            elif line.startswith("S: "):
+                symlinks.append(line[3:])
+        return properties, symlinks
+
+    def _devpath(self, entry):
+        try:
+            target = os.path.realpath(entry)
+        except OSError:
+            return None
+        if target.startswith(self._real_sysfs + "/"):
+            return target[len(self._real_sysfs):]
+        return None
+
+    def _device(self, name):
+        entry = os.path.join(self.sysfs, "class/block", name)
+        if not os.path.exists(entry):
+            entry = os.path.join(self.sysfs, "block", name)
+        devnum = _read(os.path.join(entry, "dev"))
+        size = _read_int(os.path.join(entry, "size"))
+        if devnum is None or size is None:
+            return None
+        partition = os.path.exists(os.path.join(entry, "partition"))
+        parent = start = None
+        # a partition shares the queue of its disk
+        if partition:
+            queue_dir = os.path.join(entry, "..", "queue")
+            start = _read_int(os.path.join(entry, "start"))
+            if start is not None:
+                start = start * SECTOR_SIZE
+            if "/" in name:
+                parent = name.split("/")[0]
+            else:
+                try:
+                    parent = os.path.basename(
+                        os.path.dirname(os.readlink(entry)))
+                except OSError:
+                    pass
+        else:
+            queue_dir = os.path.join(entry, "queue")
+        queue = {}
+        for attr in QUEUE_ATTRS:
+            value = _read_int(os.path.join(queue_dir, attr))
+            if value is not None:
+                queue[attr] = value
+        dm_name = dm_uuid = None
+        if os.path.isdir(os.path.join(entry, "dm")):
+            dm_name = _read(os.path.join(entry, "dm", "name")) or None
+            dm_uuid = _read(os.path.join(entry, "dm", "uuid")) or None
+        properties, symlinks = self._udev(name, devnum, entry)
+        # SCSI devices report "running", "offline", ...
+        state = _read(os.path.join(entry, "device", "state"))
+        return BlockDevice(
+            name, devnum, size * SECTOR_SIZE,
+            partition=partition, parent=parent, start=start,
+            alignment_offset=_read_int(
+                os.path.join(entry, "alignment_offset"), 0),
+            removable=_read(os.path.join(entry, "removable")) == "1",
+            read_only=_read(os.path.join(entry, "ro")) == "1",
+            queue=queue,
+            holders=_listdir(os.path.join(entry, "holders")),
+            slaves=_listdir(os.path.join(entry, "slaves")),
+            dm_name=dm_name, dm_uuid=dm_uuid,
+            properties=properties, symlinks=symlinks, state=state)
+
+    def _names(self):
+        names = _listdir(os.path.join(self.sysfs, "class/block"))
+        if names:
+            return names
+        # sysfs without /sys/class/block lists partitions below the disk
+        names = []
+        for disk in _listdir(os.path.join(self.sysfs, "block")):
+            names.append(disk)
+            for sub in _listdir(os.path.join(self.sysfs, "block", disk)):
+                if sub.startswith(disk):
+                    names.append(disk + "/" + sub)
+        return names
+
+    def scan(self):
+        devices = {}
+        for name in self._names():
+            device = self._device(name)
+            if device is not None:
+                device.name = os.path.basename(name)
+                devices[device.name] = device
+        logger.debug("Block inventory: %d devices" % len(devices))
+        return Inventory(devices)
+
+
+def scan(sysfs=SYSFS, udev_db=None):
+    """Returns a new Inventory."""
+    return Scanner(sysfs, udev_db).scan()
+
+
+class UeventSocket(object):
+    """A NETLINK_KOBJECT_UEVENT socket receiving kernel and udev events."""
+
+    def __init__(self, groups=UEVENT_GROUPS):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                  NETLINK_KOBJECT_UEVENT)
+        self.sock.bind((0, groups))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def pending(self, timeout=0):
+        """Reads the queued events and returns the number of block
+        device events among them."""
+        count = 0
+        while select.select([self.sock], [], [], timeout)[0]:
+            try:
+                data = self.sock.recv(RECV_SIZE)
+            except socket.error, e:
+                # ENOBUFS: events were lost, count it as a change
+                if e.args[0] != errno.ENOBUFS:
+                    raise
+                count = count + 1
+                continue
+            # kernel and udev messages both carry the environment
+            # as NUL separated KEY=VALUE strings
+            if "\0SUBSYSTEM=block\0" in data:
+                count = count + 1
+            timeout = 0
+        return count
+
+
+class BlockState(object):
+    """Cached Inventory, replaced when a block device uevent arrives.
+
+    Without uevents the inventory is kept until refresh().
+    """
+
+    def __init__(self, groups=UEVENT_GROUPS):
+        self.groups = groups
+        self._lock = threading.Lock()
+        self._events = None
+        self._subscribed = None
+        self._inventory = None
+
+    def _subscribe(self):
+        if self._subscribed is None:
+            try:
+                self._events = UeventSocket(self.groups)
+                self._subscribed = True
+            except socket.error, e:
+                logger.debug("No block uevents: %s" % e)
+                self._subscribed = False
+        return self._subscribed
+
+    def inventory(self):
+        self._lock.acquire()
+        try:
+            if self._subscribe() and self._events.pending():
+                self._inventory = None
+            if self._inventory is None:
+                self._inventory = scan()
+            return self._inventory
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        self._lock.acquire()
+        try:
+            self._inventory = None
+        finally:
+            self._lock.release()
+
+    def refresh(self):
+        self._lock.acquire()
+        try:
+            if self._subscribe():
+                # the new scan covers everything queued so far
+                self._events.pending()
+            self._inventory = scan()
+            return self._inventory
+        finally:
+            self._lock.release()
+
+    def wait(self, timeout=None):
+        """Blocks until a block device event arrives or timeout seconds
+        passed; returns True on an event."""
+        if not self._subscribe():
+            return False
+        if self._events.pending(timeout):
+            self.invalidate()
+            return True
+        return False
+
+
+state = BlockState()
+
+
+def current():
+    """Returns the inventory, scanning again after block uevents."""
+    return state.inventory()
+
+
+def refresh():
+    """Scans again, e.g. after partitioning or an iSCSI login."""
+    return state.refresh()
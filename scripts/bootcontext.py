@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# bootcontext.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""How this node was booted, worked out once per process.
+
+The kernel command line, runlevel and firmware type do not change
+while a process runs, and the firstboot, stateless and iSCSI flags
+only change with the node config.  A BootContext snapshots all of
+them; the is_* helpers of ovirtfunctions read from the snapshot, which
+is dropped by refresh() or when one of the flags changes in the config.
+"""
+
+import os
+import struct
+import logging
+import threading
+import ovirtnode.process as process
+
+logger = logging.getLogger("ovirtnode.bootcontext")
+
+CMDLINE = "/proc/cmdline"
+UTMP = "/var/run/utmp"
+EFI_DIR = "/sys/firmware/efi"
+
+# config keys the snapshot depends on
+CONFIG_KEYS = ("OVIRT_FIRSTBOOT", "OVIRT_STATELESS", "OVIRT_ISCSI_INSTALL")
+
+# struct utmp: ut_type and ut_pid lead every record; a RUN_LVL record
+# keeps the runlevel character in the low byte of ut_pid
+UTMP_RECORD_SIZE = 384
+UTMP_HEAD = struct.Struct("hxxi")
+RUN_LVL = 1
+
+
+def parse_cmdline(cmdline):
+    """Returns {argument: value} of a kernel command line, with None as
+    the value of arguments without "="."""
+    args = {}
+    for arg in cmdline.split():
+        if "=" in arg:
+            key, value = arg.split("=", 1)
+            args[key] = value
+        else:
+            args[arg] = None
+    return args
+
+
+def read_runlevel(utmp=UTMP):
+    """Returns the current runlevel character, or None if unknown."""
+    try:
+        f = open(utmp, "rb")
+    except IOError:
+        f = None
+    if f is not None:
+        runlevel = None
+        try:
+            record = f.read(UTMP_RECORD_SIZE)
+            while len(record) == UTMP_RECORD_SIZE:
+                ut_type, ut_pid = UTMP_HEAD.unpack_from(record)
+                if ut_type == RUN_LVL:
+                    runlevel = chr(ut_pid & 0xff)
+                record = f.read(UTMP_RECORD_SIZE)
+        finally:
+            f.close()
+        if runlevel is not None:
+            return runlevel
+    # no usable utmp, ask runlevel(8) which prints "previous current"
+    fields = process.output(["runlevel"]).split()
+    if len(fields) == 2:
+        return fields[1]
+    return None
+
+
+class BootContext(object):
+    """Immutable snapshot of the boot state."""
+
+    def __init__(self, cmdline, runlevel, efi, config):
+        values = {}
+        values["cmdline"] = cmdline
+        values["args"] = parse_cmdline(cmdline)
+        values["runlevel"] = runlevel
+        values["efi"] = efi
+        values["booted_from_local_disk"] = "LABEL=Root" in cmdline
+        values["rescue"] = "rescue" in cmdline or runlevel in ("1", "S", "s")
+        firstboot = config.get("OVIRT_FIRSTBOOT")
+        if firstboot == "1":
+            values["firstboot"] = True
+        elif firstboot == "0":
+            values["firstboot"] = False
+        else:
+            # in case there's no key, default to True unless booted from disk
+            values["firstboot"] = not values["booted_from_local_disk"]
+        values["stateless"] = config.get("OVIRT_STATELESS") == "1"
+        values["iscsi_install"] = \
+            config.get("OVIRT_ISCSI_INSTALL", "").upper() == "Y"
+        self.__dict__.update(values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BootContext is immutable")
+
+    def __repr__(self):
+        return "<BootContext runlevel=%s efi=%s firstboot=%s stateless=%s>" % (
+            self.runlevel, self.efi, self.firstboot, self.stateless)
+
+    @classmethod
+    def snapshot(cls, config):
+        try:
+            f = open(CMDLINE)
+            try:
+                cmdline = f.read().strip()
+            finally:
+                f.close()
+        except IOError:
+            cmdline = ""
+        return cls(cmdline, read_runlevel(), os.path.exists(EFI_DIR), config)
+
+
+_lock = threading.RLock()
+_context = None
+
+
+def current(config):
+    """Returns the snapshot, taking it on first use."""
+    global _context
+    # lets a changed config drop the snapshot through watch()
+    config.refresh()
+    _lock.acquire()
+    try:
+        if _context is None:
+            _context = BootContext.snapshot(config)
+            logger.debug("Boot context: %r" % _context)
+        return _context
+    finally:
+        _lock.release()
+
+
+def refresh():
+    """Drops the snapshot, the next current() takes a new one."""
+    global _context
+    _lock.acquire()
+    try:
+        _context = None
+    finally:
+        _lock.release()
+
+
+def watch(config):
+    """Drops the snapshot whenever config changes one of CONFIG_KEYS."""
+    def changed(key, old, new):
+        if key in CONFIG_KEYS:
+            refresh()
+    config.on_change(changed)
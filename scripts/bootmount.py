@@ -0,0 +1,234 @@
+#!/usr/bin/python
+# bootmount.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Restores the /config bind mounts at boot.
+
+Every regular file below /config is bind-mounted over the same path in
+the root filesystem.  The tree is walked once, compared against the
+mount table and only the missing mounts are made, with mount(2) called
+directly from a few worker threads.
+
+Config shipped on the live media in /live/config is merged into /config
+first.  A manifest of the live files' digests is kept in /config, so
+files which have not changed since the last boot are neither read nor
+copied again.
+"""
+
+import os
+import errno
+import shutil
+import logging
+import ovirtnode.process as process
+import ovirtnode.kernel as kernel
+import ovirtnode.mounttab as mounttab
+import ovirtnode.digestcache as digestcache
+from ovirtnode.workers import parallel_map, JobError, DEFAULT_WORKERS
+
+# python-scandir is much faster on large trees, but optional
+try:
+    from scandir import walk
+except ImportError:
+    from os import walk
+
+logger = logging.getLogger("ovirtnode.bootmount")
+
+CONFIG_ROOT = "/config"
+LIVE_CONFIG = "/live/config"
+MANIFEST = ".live-config.manifest"
+
+# top level entries of /config which are not persisted files
+SKIP = set(["files", "lost+found", MANIFEST])
+
+
+class BindStats(object):
+    """Outcome of bind_config()."""
+
+    def __init__(self):
+        self.bound = 0
+        self.skipped = 0
+        self.failed = []
+
+    def __repr__(self):
+        return "<BindStats bound=%d skipped=%d failed=%d>" % (
+            self.bound, self.skipped, len(self.failed))
+
+
+def persisted_files(root=CONFIG_ROOT):
+    """Yields (source, path) for every persisted file below root, where
+    path is the location in the root filesystem."""
+    for dirpath, dirnames, filenames in walk(root):
+        if dirpath == root:
+            dirnames[:] = [d for d in dirnames if d not in SKIP]
+            filenames = [f for f in filenames if f not in SKIP]
+        rel = dirpath[len(root):]
+        for name in filenames:
+            source = os.path.join(dirpath, name)
+            if os.path.isfile(source):
+                yield source, rel + "/" + name
+
+
+def _prepare(target, created):
+    """Creates the mount point for a file bind mount."""
+    parent = os.path.dirname(target)
+    if parent not in created:
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        created.add(parent)
+    if not os.path.exists(target):
+        os.close(os.open(target, os.O_WRONLY | os.O_CREAT, 0644))
+
+
+def _bind(job):
+    source, target = job
+    try:
+        kernel.bind_mount(source, target)
+    except OSError, e:
+        if e.errno != errno.ENOSYS:
+            raise
+        # no usable mount(2), fall back to mount(8)
+        if not process.succeeds(["mount", "-n", "--bind", source, target]):
+            raise OSError(errno.EIO, "mount --bind %s %s failed" %
+                          (source, target))
+
+
+def bind_config(root=CONFIG_ROOT, prefix="", workers=DEFAULT_WORKERS,
+                table=None, dry_run=False):
+    """Bind-mounts every persisted file below root which is not yet
+    mounted.
+
+    prefix is prepended to the targets, the default "" restores the
+    live root filesystem.  dry_run prepares the mount points without
+    mounting.  Returns a BindStats.
+    """
+    if table is None:
+        table = mounttab.table
+    mounted = table.targets()
+    stats = BindStats()
+    jobs = []
+    created = set()
+    for source, path in persisted_files(root):
+        target = prefix + path
+        if target in mounted:
+            # skip if already bind-mounted
+            stats.skipped = stats.skipped + 1
+            continue
+        try:
+            _prepare(target, created)
+        except OSError, e:
+            logger.error("Unable to create %s: %s" % (target, e))
+            stats.failed.append(target)
+            continue
+        jobs.append((source, target))
+    if dry_run:
+        stats.bound = len(jobs)
+        return stats
+    try:
+        parallel_map(_bind, jobs, workers)
+        stats.bound = len(jobs)
+    except JobError, e:
+        for job, exc_info in e.errors:
+            logger.error("Bind mounting %s failed: %s" % (job[1], exc_info[1]))
+            stats.failed.append(job[1])
+        stats.bound = len(jobs) - len(e.errors)
+    logger.debug("Bind mounted %s" % stats)
+    return stats
+
+
+def load_manifest(path):
+    """Returns {relative path: (digest, size, mtime)} from a manifest."""
+    manifest = {}
+    try:
+        f = open(path)
+    except IOError:
+        return manifest
+    try:
+        for line in f:
+            try:
+                digest, size, mtime, rel = line.rstrip("\n").split(" ", 3)
+                manifest[rel] = (digest, int(size), float(mtime))
+            except ValueError:
+                continue
+    finally:
+        f.close()
+    return manifest
+
+
+def save_manifest(path, manifest):
+    tmp = path + ".tmp"
+    f = open(tmp, "w")
+    try:
+        for rel in sorted(manifest.keys()):
+            digest, size, mtime = manifest[rel]
+            f.write("%s %d %r %s\n" % (digest, size, mtime, rel))
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+
+def sync_live_config(live=LIVE_CONFIG, root=CONFIG_ROOT):
+    """Merges the config shipped on the live media into root.
+
+    Like "cp -r --update", a file is copied if it is missing in root,
+    or if it changed on the live media and is newer than the copy in
+    root.  Returns the number of files copied.
+    """
+    if not os.path.isdir(live):
+        return 0
+    manifest_path = os.path.join(root, MANIFEST)
+    manifest = load_manifest(manifest_path)
+    current = {}
+    copied = 0
+    for dirpath, dirnames, filenames in walk(live):
+        rel_dir = dirpath[len(live):]
+        for name in filenames:
+            source = os.path.join(dirpath, name)
+            rel = rel_dir + "/" + name
+            try:
+                st = os.stat(source)
+            except OSError:
+                continue
+            old = manifest.get(rel)
+            if old is not None and old[1:] == (st.st_size, st.st_mtime):
+                digest = old[0]
+            else:
+                digest = digestcache.hash_file(source, st.st_size)
+            current[rel] = (digest, st.st_size, st.st_mtime)
+            changed = old is None or old[0] != digest
+            dest = root + rel
+            try:
+                dest_mtime = os.stat(dest).st_mtime
+            except OSError:
+                dest_mtime = None
+            if dest_mtime is None or (changed and st.st_mtime > dest_mtime):
+                parent = os.path.dirname(dest)
+                if not os.path.isdir(parent):
+                    os.makedirs(parent)
+                shutil.copy2(source, dest)
+                logger.debug("Copied %s" % dest)
+                copied = copied + 1
+    if current != manifest:
+        save_manifest(manifest_path, current)
+    return copied
+
+
+def restore(root=CONFIG_ROOT, live=LIVE_CONFIG):
+    """Boot entry point: merges /live/config and restores all bind
+    mounts.  Returns True if every persisted file got mounted."""
+    sync_live_config(live, root)
+    stats = bind_config(root)
+    return len(stats.failed) == 0
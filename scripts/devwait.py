@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# devwait.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Waiting for device nodes without sleeping.
+
+wait_for_block_device() returns as soon as udev has created a block
+device node, and optionally its symlinks, or False after a timeout.
+The directories the paths live in are watched with inotify, so the
+check is repeated only when something in them changes.  Without
+inotify the paths are polled.
+"""
+
+import os
+import stat
+import time
+import errno
+import select
+import struct
+import logging
+import ctypes
+import ctypes.util
+
+logger = logging.getLogger("ovirtnode.devwait")
+
+DEFAULT_TIMEOUT = 15
+POLL_INTERVAL = 0.1
+
+IN_ATTRIB = 0x4
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = IN_ATTRIB | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+# struct inotify_event without the name
+EVENT = struct.Struct("iIII")
+READ_SIZE = 65536
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                            use_errno=True)
+    return _libc
+
+
+class Inotify(object):
+    """An inotify instance watching directories for new entries."""
+
+    def __init__(self):
+        libc = _load_libc()
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self._watched = set()
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def watch(self, directory):
+        """Watches directory, or its closest existing parent until it
+        exists.  Returns the directory actually watched."""
+        while not os.path.isdir(directory) and directory != "/":
+            directory = os.path.dirname(directory)
+        if directory not in self._watched:
+            wd = _libc.inotify_add_watch(self.fd, directory, WATCH_MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                raise OSError(e, os.strerror(e))
+            self._watched.add(directory)
+        return directory
+
+    def wait(self, timeout):
+        """Waits up to timeout seconds for events and discards them;
+        returns True if there were any."""
+        try:
+            ready = select.select([self.fd], [], [], max(timeout, 0))[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return True
+            raise
+        if not ready:
+            return False
+        os.read(self.fd, READ_SIZE)
+        return True
+
+
+def is_block_device(path):
+    try:
+        return stat.S_ISBLK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def _ready(paths, symlinks):
+    for link in symlinks:
+        if not os.path.exists(link):
+            return None
+    for path in paths:
+        if is_block_device(path):
+            return path
+    return None
+
+
+def wait_for_any(paths, timeout=DEFAULT_TIMEOUT, symlinks=()):
+    """Waits until one of paths is a block device and all symlinks
+    exist; returns that path, or None after timeout seconds."""
+    found = _ready(paths, symlinks)
+    if found is not None:
+        return found
+    deadline = time.time() + timeout
+    try:
+        inotify = Inotify()
+    except (OSError, AttributeError), e:
+        logger.debug("No inotify, polling: %s" % e)
+        inotify = None
+    try:
+        while True:
+            if inotify is not None:
+                # (re)watch before checking, so no change slips through;
+                # parents are watched until the directory itself appears
+                for path in list(paths) + list(symlinks):
+                    inotify.watch(os.path.dirname(path))
+            found = _ready(paths, symlinks)
+            if found is not None:
+                return found
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logger.error("Timed out waiting for %s" %
+                             ", ".join(list(paths) + list(symlinks)))
+                return None
+            if inotify is not None:
+                inotify.wait(remaining)
+            else:
+                time.sleep(min(POLL_INTERVAL, remaining))
+    finally:
+        if inotify is not None:
+            inotify.close()
+
+
+def wait_for_block_device(path, timeout=DEFAULT_TIMEOUT, symlinks=()):
+    """Waits until path is a block device and all symlinks exist;
+    returns False after timeout seconds."""
+    return wait_for_any([path], timeout, symlinks) is not None
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# digestcache.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""MD5 digests of files, cached by stat signature.
+
+A digest is keyed on (st_dev, st_ino, st_size, st_mtime, st_ctime).
+Any write to the file changes ctime, which unlike mtime cannot be set
+back from user space, so a matching key means unchanged content.
+
+The cache is written to /run (or /var/run on older systems).  It is a
+tmpfs, so the cache is dropped on reboot together with the inode
+numbers it is keyed on.
+"""
+
+import os
+import mmap
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger("ovirtnode.digestcache")
+
+if os.path.isdir("/run"):
+    CACHE_FILE = "/run/ovirtnode/digests"
+else:
+    CACHE_FILE = "/var/run/ovirtnode/digests"
+
+# files from this size on are hashed through mmap
+MMAP_THRESHOLD = 1024 * 1024
+BUFFER_SIZE = 1024 * 1024
+MAX_ENTRIES = 4096
+
+
+def _key(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+
+
+def hash_file(path, size=None):
+    """Returns the MD5 hex digest of path, reading it in large chunks."""
+    m = hashlib.md5()
+    f = open(path, "rb")
+    try:
+        if size is None:
+            size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                m.update(mapped)
+            finally:
+                mapped.close()
+        else:
+            data = f.read(BUFFER_SIZE)
+            while data:
+                m.update(data)
+                data = f.read(BUFFER_SIZE)
+    finally:
+        f.close()
+    return m.hexdigest()
+
+
+class DigestCache(object):
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._digests = None
+        self._dirty = False
+
+    def _load(self):
+        if self._digests is not None:
+            return
+        self._digests = {}
+        try:
+            f = open(self.path)
+        except IOError:
+            return
+        try:
+            for line in f:
+                try:
+                    dev, ino, size, mtime, ctime, digest = line.split()
+                    key = (int(dev), int(ino), int(size), float(mtime),
+                           float(ctime))
+                    self._digests[key] = digest
+                except ValueError:
+                    continue
+        finally:
+            f.close()
+
+    def digest(self, path, st=None):
+        """Returns the MD5 hex digest of path, hashing only on a miss."""
+        if st is None:
+            st = os.stat(path)
+        key = _key(st)
+        self._lock.acquire()
+        try:
+            self._load()
+            digest = self._digests.get(key)
+        finally:
+            self._lock.release()
+        if digest is not None:
+            return digest
+        digest = hash_file(path, st.st_size)
+        self._lock.acquire()
+        try:
+            if len(self._digests) >= MAX_ENTRIES:
+                self._digests.clear()
+            self._digests[key] = digest
+            self._dirty = True
+        finally:
+            self._lock.release()
+        return digest
+
+    def same_content(self, a, b):
+        """Returns True if files a and b have the same content.
+
+        Differing sizes and a shared inode (e.g. a file and its bind
+        mount source) are decided without reading either file.
+        """
+        try:
+            sta = os.stat(a)
+            stb = os.stat(b)
+        except OSError:
+            return False
+        if sta.st_size != stb.st_size:
+            return False
+        if (sta.st_dev, sta.st_ino) == (stb.st_dev, stb.st_ino):
+            return True
+        return self.digest(a, sta) == self.digest(b, stb)
+
+    def save(self):
+        """Writes the cache back if it changed; failures are ignored."""
+        self._lock.acquire()
+        try:
+            if not self._dirty:
+                return
+            try:
+                parent = os.path.dirname(self.path)
+                if not os.path.isdir(parent):
+                    os.makedirs(parent)
+                tmp = self.path + ".tmp"
+                f = open(tmp, "w")
+                try:
+                    for key, digest in self._digests.iteritems():
+                        f.write("%d %d %d %r %r %s\n" % (key + (digest,)))
+                finally:
+                    f.close()
+                os.rename(tmp, self.path)
+                self._dirty = False
+            except (IOError, OSError), e:
+                logger.debug("Unable to save digest cache: %s" % e)
+        finally:
+            self._lock.release()
+
+
+cache = DigestCache()
+
+
+def file_digest(path):
+    return cache.digest(path)
+
+
+def same_content(a, b):
+    return cache.same_content(a, b)
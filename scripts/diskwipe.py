@@ -0,0 +1,218 @@
+#!/usr/bin/python
+# diskwipe.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Clearing partition table, LVM, RAID and filesystem signatures.
+
+wipe() opens a disk once and zeroes every place metadata is found:
+
+  - the first MiB: MBR, primary GPT, LVM label, md 1.1/1.2, ext, xfs,
+    vfat, swap, iso9660, btrfs and LUKS superblocks
+  - the last 2MiB: backup GPT, md 0.90/1.0 and the dmraid formats
+    (Intel, DDF, Promise, NVIDIA, ...)
+  - the first and last MiB of every partition the kernel knows on it
+    or its partition table lists, and the first MiB at any further
+    offsets, e.g. where the new partitions will start
+
+Ranges are zeroed with the BLKZEROOUT ioctl, with BLKDISCARD where the
+device guarantees discarded blocks read back as zeroes, and with plain
+writes otherwise, so image files and loop devices work as well.
+"""
+
+import os
+import errno
+import fcntl
+import struct
+import logging
+import ovirtnode.blockinventory as blockinventory
+import ovirtnode.partplan as partplan
+
+logger = logging.getLogger("ovirtnode.diskwipe")
+
+MIB = 1024 * 1024
+HEAD_SIZE = MIB
+# Promise FastTrak keeps its metadata up to 3087 sectors from the end
+TAIL_SIZE = 2 * MIB
+PARTITION_TAIL_SIZE = MIB
+ALIGN = 4096
+
+# _IO(0x12, 127) and _IO(0x12, 119), taking {uint64 start, len}
+BLKZEROOUT = 0x127f
+BLKDISCARD = 0x1277
+RANGE = struct.Struct("QQ")
+
+LVM_LABEL = "LABELONE"
+LVM_LABEL_SECTORS = 4
+SECTOR_SIZE = 512
+
+UNSUPPORTED = (errno.ENOTTY, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS)
+
+
+def _size(fd):
+    return os.lseek(fd, 0, 2)
+
+
+def device_size(path):
+    """Returns the size in bytes of the disk or image at path."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return _size(fd)
+    finally:
+        os.close(fd)
+
+
+def partition_extents(path):
+    """Returns [(start, size)] in bytes of the partitions the kernel
+    knows on the disk at path and of those in its partition table."""
+    extents = set()
+    sector_size = SECTOR_SIZE
+    device = blockinventory.current().get(path)
+    if device is not None:
+        sector_size = device.queue.get("logical_block_size", sector_size)
+        for part in blockinventory.current().partitions_of(device):
+            if part.start is not None:
+                extents.add((part.start, part.size))
+    try:
+        label_type, table = partplan.read(path, sector_size)
+    except (IOError, OSError, ValueError), e:
+        logger.debug("Unable to read partition table of %s: %s" % (path, e))
+        table = []
+    for number, name, kind, start, end, bootable in table:
+        extents.add((start * sector_size, (end - start + 1) * sector_size))
+    return sorted(extents)
+
+
+def _discard_zeroes(path):
+    device = blockinventory.current().get(path)
+    return device is not None and \
+        device.queue.get("discard_zeroes_data") == 1
+
+
+def ranges(size, offsets=(), partitions=()):
+    """Returns the sorted, merged (start, end) byte ranges to clear on
+    a disk of size bytes with partitions [(start, size)]."""
+    wanted = [(0, HEAD_SIZE), (size - TAIL_SIZE, size)]
+    for start, length in partitions:
+        wanted.append((start, start + min(length, HEAD_SIZE)))
+        wanted.append((start + length - min(length, PARTITION_TAIL_SIZE),
+                       start + length))
+    for start in offsets:
+        wanted.append((start, start + HEAD_SIZE))
+    merged = []
+    for start, end in sorted(wanted):
+        start = max(0, start - start % ALIGN)
+        end = min(size, end + (ALIGN - end % ALIGN) % ALIGN)
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class Wiper(object):
+    """Zeroes byte ranges of one open disk, falling back from the
+    ioctls to writes the first time the device rejects them."""
+
+    def __init__(self, fd, discard_zeroes=False):
+        self.fd = fd
+        self.methods = ["zeroout", "write"]
+        if discard_zeroes:
+            self.methods.insert(1, "discard")
+        self.used = {}
+
+    def _ioctl(self, request, start, end):
+        fcntl.ioctl(self.fd, request, RANGE.pack(start, end - start))
+
+    def _write(self, start, end):
+        zeroes = "\0" * min(MIB, end - start)
+        os.lseek(self.fd, start, 0)
+        while start < end:
+            start = start + os.write(self.fd, zeroes[:end - start])
+
+    def clear(self, start, end):
+        while True:
+            method = self.methods[0]
+            try:
+                if method == "zeroout":
+                    self._ioctl(BLKZEROOUT, start, end)
+                elif method == "discard":
+                    self._ioctl(BLKDISCARD, start, end)
+                else:
+                    self._write(start, end)
+            except (IOError, OSError), e:
+                if method == "write" or e.errno not in UNSUPPORTED:
+                    raise
+                logger.debug("%s not supported: %s" % (method, e))
+                self.methods.pop(0)
+                continue
+            self.used[method] = self.used.get(method, 0) + end - start
+            return
+
+
+def wipe(path, offsets=()):
+    """Clears all known signatures on the disk or image at path and
+    the first MiB at each of offsets; returns the bytes cleared.
+    Raises OSError if the disk cannot be written."""
+    partitions = partition_extents(path)
+    fd = os.open(path, os.O_RDWR)
+    try:
+        size = _size(fd)
+        wiper = Wiper(fd, _discard_zeroes(path))
+        cleared = ranges(size, offsets, partitions)
+        for start, end in cleared:
+            wiper.clear(start, end)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    total = sum([end - start for start, end in cleared])
+    logger.info("Wiped %d ranges, %dKiB of %s (%s)" % (
+        len(cleared), total / 1024, path,
+        ", ".join(["%s %dKiB" % (m, n / 1024)
+                   for m, n in sorted(wiper.used.items())])))
+    return total
+
+
+def _has_lvm_label(fd, start):
+    os.lseek(fd, start, 0)
+    data = os.read(fd, LVM_LABEL_SECTORS * SECTOR_SIZE)
+    for sector in range(LVM_LABEL_SECTORS):
+        offset = sector * SECTOR_SIZE
+        if data[offset:offset + len(LVM_LABEL)] == LVM_LABEL:
+            return True
+    return False
+
+
+def lvm_labels(path):
+    """Returns True if the disk at path or any of its partitions
+    carries an LVM physical volume label, or None for a path that is
+    not a known block device."""
+    if blockinventory.current().get(path) is None:
+        return None
+    starts = [0] + [start for start, size in partition_extents(path)]
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        for start in starts:
+            if _has_lvm_label(fd, start):
+                return True
+    finally:
+        os.close(fd)
+    return False
@@ -0,0 +1,317 @@
+#!/usr/bin/python
+# imagecopy.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Copying the boot images off the live media with verification.
+
+copy_files() reads every source exactly once, sequentially and in
+large chunks, hashing the stream with SHA-256 as it is written out.
+The source digest is checked against a sha256sum style manifest when
+the media carries one.  Only once everything is written is each copy
+flushed, then read back from disk past the page cache; it must match
+the digest of what was read from the source.  Mode and times are kept
+as with cp -p.
+
+Copies already at the destination are updated in place: a block is
+only written if it differs.  With a record file the digests of the
+copies are kept next to them, so a later run can leave a file alone
+without reading its source at all, when the source has the same size
+and mtime, and the digest from the manifest if there is one, and the
+staged copy still hashes to the recorded digest.
+
+    imagecopy.copy_files([("/live/LiveOS/squashfs.img",
+                           "/liveos/LiveOS/squashfs.img")],
+                         progress=imagecopy.log_progress(logger))
+"""
+
+import os
+import hashlib
+import logging
+import ctypes
+import ctypes.util
+
+logger = logging.getLogger("ovirtnode.imagecopy")
+
+CHUNK_SIZE = 4 * 1024 * 1024
+# granularity of in place updates
+DELTA_BLOCK = 64 * 1024
+
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_DONTNEED = 4
+
+_fadvise = None
+
+
+class CopyError(Exception):
+    pass
+
+
+def _advise(fd, advice):
+    """posix_fadvise() on the whole file; a hint, errors are ignored."""
+    global _fadvise
+    if _fadvise is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+            _fadvise = libc.posix_fadvise64
+            _fadvise.argtypes = [ctypes.c_int, ctypes.c_int64,
+                                 ctypes.c_int64, ctypes.c_int]
+        except (OSError, AttributeError):
+            _fadvise = False
+    if _fadvise:
+        _fadvise(fd, 0, 0, advice)
+
+
+def read_manifest(path):
+    """Returns {relative path: sha256 hex digest} from a sha256sum
+    style file, or {} if there is none."""
+    digests = {}
+    try:
+        f = open(path)
+    except IOError:
+        return digests
+    try:
+        for line in f:
+            fields = line.split(None, 1)
+            if len(fields) != 2 or len(fields[0]) != 64:
+                continue
+            # "digest  name" or "digest *name" for binary mode
+            name = fields[1].strip()
+            if name.startswith("*"):
+                name = name[1:]
+            if name.startswith("./"):
+                name = name[2:]
+            digests[name] = fields[0].lower()
+    finally:
+        f.close()
+    return digests
+
+
+def log_progress(log, step=10):
+    """Returns a progress callback logging every step percent."""
+    state = {"next": step}
+
+    def progress(done, total, path):
+        percent = total and done * 100 / total or 100
+        if percent >= state["next"]:
+            log.info("Copied %d%% (%dMiB of %dMiB), %s" % (
+                percent, done >> 20, total >> 20, os.path.basename(path)))
+            state["next"] = percent - percent % step + step
+    return progress
+
+
+def _write_all(fd, data):
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def _write_changed(fd, offset, data):
+    """Writes the blocks of data that differ from what fd holds at
+    offset; returns the bytes written."""
+    os.lseek(fd, offset, 0)
+    old = os.read(fd, len(data))
+    if old == data:
+        return 0
+    written = 0
+    for start in range(0, len(data), DELTA_BLOCK):
+        block = data[start:start + DELTA_BLOCK]
+        if old[start:start + DELTA_BLOCK] != block:
+            os.lseek(fd, offset + start, 0)
+            _write_all(fd, block)
+            written = written + len(block)
+    return written
+
+
+def _stream(src, dst_fd, progress, done, total, delta):
+    """Copies src to dst_fd, with delta only the blocks that differ;
+    returns (sha256 hex digest, bytes read, bytes written)."""
+    digest = hashlib.sha256()
+    fd = os.open(src, os.O_RDONLY)
+    try:
+        _advise(fd, POSIX_FADV_SEQUENTIAL)
+        size = written = 0
+        while True:
+            data = os.read(fd, CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+            if delta:
+                written = written + _write_changed(dst_fd, size, data)
+            else:
+                _write_all(dst_fd, data)
+                written = written + len(data)
+            size = size + len(data)
+            if progress is not None:
+                progress(done + size, total, src)
+        os.ftruncate(dst_fd, size)
+    finally:
+        os.close(fd)
+    return digest.hexdigest(), size, written
+
+
+def _read_back(fd):
+    """Returns the sha256 hex digest of fd as stored on disk."""
+    _advise(fd, POSIX_FADV_DONTNEED)
+    os.lseek(fd, 0, 0)
+    digest = hashlib.sha256()
+    data = os.read(fd, CHUNK_SIZE)
+    while data:
+        digest.update(data)
+        data = os.read(fd, CHUNK_SIZE)
+    return digest.hexdigest()
+
+
+def _expected(manifest, src):
+    for name, expected in manifest.items():
+        if src == name or src.endswith("/" + name):
+            return expected
+    return None
+
+
+def read_record(path):
+    """Returns {destination: (sha256, source size, source mtime)} of
+    the copies made by the last copy_files() with this record."""
+    copies = {}
+    try:
+        f = open(path)
+    except IOError:
+        return copies
+    try:
+        for line in f:
+            try:
+                digest, size, mtime, dst = line.rstrip("\n").split(" ", 3)
+                copies[dst] = (digest, int(size), float(mtime))
+            except ValueError:
+                continue
+    finally:
+        f.close()
+    return copies
+
+
+def write_record(path, copies):
+    tmp = path + ".tmp"
+    f = open(tmp, "w")
+    try:
+        for dst, (digest, size, mtime) in sorted(copies.items()):
+            f.write("%s %d %r %s\n" % (digest, size, mtime, dst))
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+
+def _staged(dst, st, entry, expected):
+    """True if dst still holds the copy recorded in entry, of a source
+    that now has stat st and, per the manifest, digest expected."""
+    if entry is None:
+        return False
+    digest, size, mtime = entry
+    if (size, mtime) != (st.st_size, st.st_mtime):
+        return False
+    if expected is not None and expected != digest:
+        return False
+    try:
+        fd = os.open(dst, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        return os.fstat(fd).st_size == size and _read_back(fd) == digest
+    finally:
+        os.close(fd)
+
+
+def copy_files(files, progress=None, manifest=None, verify=True,
+               record=None, reuse=True):
+    """Copies [(source, destination path)] keeping mode and times.
+
+    progress(bytes done, bytes total, source) is called after every
+    chunk.  manifest maps source paths, or their ends, to expected
+    SHA-256 digests.  With a record file, copies are remembered; with
+    reuse a file staged by an earlier call from a source of the same
+    size and mtime (and manifest digest) is kept without reading the
+    source, after checking its digest.  Files already at the
+    destination are updated in place, writing only blocks that differ.
+    Raises CopyError naming the first file that could not be copied or
+    does not verify.
+    """
+    manifest = manifest or {}
+    recorded = {}
+    if record is not None:
+        recorded = read_record(record)
+    try:
+        stats = [os.stat(src) for src, dst in files]
+    except OSError, e:
+        raise CopyError("%s: %s" % (e.filename, e.strerror))
+    total = sum([st.st_size for st in stats])
+    copies = []
+    done = read = written = 0
+    kept = {}
+    try:
+        for (src, dst), st in zip(files, stats):
+            expected = _expected(manifest, src)
+            if reuse and _staged(dst, st, recorded.get(dst), expected):
+                logger.debug("%s is already staged" % dst)
+                kept[dst] = recorded[dst]
+                done = done + st.st_size
+                if progress is not None:
+                    progress(done, total, src)
+                continue
+            delta = os.path.isfile(dst)
+            try:
+                fd = os.open(dst, os.O_RDWR | os.O_CREAT, 0644)
+            except OSError, e:
+                raise CopyError("%s: %s" % (dst, e.strerror))
+            try:
+                digest, size, changed = _stream(src, fd, progress, done,
+                                                total, delta)
+                os.fchmod(fd, st.st_mode & 07777)
+                os.utime(dst, (st.st_atime, st.st_mtime))
+            except (IOError, OSError), e:
+                os.close(fd)
+                raise CopyError("%s to %s: %s" % (src, dst, e.strerror))
+            copies.append((src, dst, fd, digest))
+            kept[dst] = (digest, size, st.st_mtime)
+            done = done + size
+            read = read + size
+            written = written + changed
+            if expected is not None:
+                if digest != expected:
+                    raise CopyError("%s does not match its checksum, "
+                                    "the media may be damaged" % src)
+                logger.debug("%s matches the manifest" % src)
+        # one flush for everything, then check what reached the disk
+        for src, dst, fd, digest in copies:
+            try:
+                os.fsync(fd)
+                if verify and _read_back(fd) != digest:
+                    raise CopyError("%s differs from %s after writing" %
+                                    (dst, src))
+            except (IOError, OSError), e:
+                raise CopyError("%s: %s" % (dst, e.strerror))
+    finally:
+        for src, dst, fd, digest in copies:
+            os.close(fd)
+    if record is not None:
+        try:
+            write_record(record, kept)
+        except (IOError, OSError), e:
+            logger.warning("Unable to write %s: %s" % (record, e))
+    logger.info("Copied %d of %d files, read %dMiB, wrote %dMiB%s" % (
+        len(copies), len(files), read >> 20, written >> 20,
+        verify and ", verified" or ""))
+    return written
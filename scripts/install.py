@@ -19,13 +19,22 @@
 
 from ovirtnode.ovirtfunctions import *
 from ovirtnode.iscsi import *
+from ovirtnode.spans import span
+import ovirtnode.devwait as devwait
+import ovirtnode.imagecopy as imagecopy
+import ovirtnode.progress as progress
 import shutil
 import traceback
 import os
 import stat
+import time
 import subprocess
 import re
-OVIRT_VARS = parse_defaults()
+
+# sha256sum output for the files on the live media, if it carries one
+IMAGE_MANIFEST = "/live/LiveOS/SHA256SUMS"
+# digests of the image staged on the candidate Root partition
+IMAGE_RECORD = "/liveos/LiveOS/imagecopy.sums"
 
 class Install:
 
@@ -36,18 +45,39 @@ class Install:
         self.disk = None
         self.partN = -1
 
+    @span("install.kernel_image_copy")
     def kernel_image_copy(self):
-        if not system("cp -p /live/" + self.syslinux + "/vmlinuz0 " + self.initrd_dest):
-            logger.error("kernel image copy failed.")
-            return False
-        if not system("cp -p /live/" + self.syslinux + "/initrd0.img " + self.initrd_dest):
-            logger.error("initrd image copy failed.")
-            return False
-        if not system("cp -p /live/" + self.syslinux + "/version /liveos"):
-            logger.error("version details copy failed.")
-            return False
-        if not system("cp -p /live/LiveOS/squashfs.img /liveos/LiveOS"):
-            logger.error("squashfs image copy failed.")
+        boot = "/live/" + self.syslinux
+        files = [(boot + "/vmlinuz0", self.initrd_dest + "/vmlinuz0"),
+                 (boot + "/initrd0.img", self.initrd_dest + "/initrd0.img"),
+                 (boot + "/version", "/liveos/version"),
+                 ("/live/LiveOS/squashfs.img", "/liveos/LiveOS/squashfs.img")]
+        manifest = imagecopy.read_manifest(IMAGE_MANIFEST)
+        # the same build may already be staged, e.g. on a reinstall
+        staged = False
+        try:
+            version_file = open("/liveos/version")
+            try:
+                staged = get_version_number(version_file)
+            finally:
+                version_file.close()
+        except IOError:
+            pass
+        reuse = staged and staged == get_media_version_number()
+        if reuse:
+            logger.info("%s-%s is staged already, checking it" %
+                        tuple(staged))
+        log_progress = imagecopy.log_progress(logger)
+
+        def copied(done, total, path):
+            log_progress(done, total, path)
+            progress.advance(done, total)
+        progress.phase("install.image")
+        try:
+            imagecopy.copy_files(files, copied, manifest,
+                                 record=IMAGE_RECORD, reuse=bool(reuse))
+        except imagecopy.CopyError, e:
+            logger.error("Image copy failed: %s" % e)
             return False
         return True
 
@@ -78,6 +108,7 @@ class Install:
         else:
             self.grub_config_file = "%s/grub.conf" % self.grub_dir
 
+    @span("install.grub_install")
     def grub_install(self):
         device_map = "(hd0) %s" % self.disk
         logger.debug(device_map)
@@ -100,11 +131,8 @@ title BACKUP %(oldtitle)s
     kernel /vmlinuz0 root=live:LABEL=RootBackup %(bootparams)s
     initrd /initrd0.img
     """
-        GRUB_SETUP_TEMPLATE = """
-    grub --device-map=%(grub_dir)s/device.map <<EOF
-root (hd0,%(partN)d)
+        GRUB_SETUP_TEMPLATE = """root (hd0,%(partN)d)
 setup --prefix=%(grub_prefix)s (hd0)
-EOF
 """
         if is_efi_boot():
             self.grub_config_file = "/liveos/efi/EFI/ovirt/grub.conf"
@@ -120,17 +148,19 @@ EOF
         grub_conf.close()
         if not is_efi_boot():
             for f in ["stage1", "stage2", "e2fs_stage1_5"]:
-                system("cp /usr/share/grub/x86_64-redhat/%s %s" % (f, self.grub_dir))
+                shutil.copy("/usr/share/grub/x86_64-redhat/%s" % f, self.grub_dir)
             grub_setup_out = GRUB_SETUP_TEMPLATE % self.grub_dict
             logger.debug(grub_setup_out)
-            grub_setup = subprocess.Popen(grub_setup_out, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            grub_results = grub_setup.stdout.read()
+            grub_setup = process.run(["grub", "--device-map=%s/device.map" % self.grub_dir],
+                                     input=grub_setup_out, merge_stderr=True)
+            grub_results = grub_setup.stdout
             logger.debug(grub_results)
-            if grub_setup.wait() != 0 or "Error" in grub_results:
+            if grub_setup.returncode != 0 or "Error" in grub_results:
                 logger.error("GRUB setup failed")
                 return False
         return True
 
+    @span("install.grub2_install")
     def grub2_install(self):
 
         GRUB2_EFI_CONFIG_TEMPLATE = """
@@ -161,12 +191,12 @@ initrd /initrd0.img
                 disk = re.sub("p[1,2,3]$", "", findfs(self.boot_candidate))
             else:
                 disk = self.disk
-            grub_setup_cmd = "/sbin/grub2-install " + disk + " --boot-directory=" + self.initrd_dest + " --force"
-            logger.info(grub_setup_cmd)
-            grub_setup = subprocess.Popen(grub_setup_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            grub_results = grub_setup.stdout.read()
+            grub_setup_cmd = ["/sbin/grub2-install", disk, "--boot-directory=" + self.initrd_dest, "--force"]
+            logger.info(process.format_argv(grub_setup_cmd))
+            grub_setup = process.run(grub_setup_cmd, merge_stderr=True)
+            grub_results = grub_setup.stdout
             logger.info(grub_results)
-            if grub_setup.wait() != 0 or "Error" in grub_results:
+            if grub_setup.returncode != 0 or "Error" in grub_results:
                 logger.error("GRUB efi setup failed")
                 return False
             else:
@@ -194,11 +224,13 @@ initrd /initrd0.img
                     self.grub_dict['partB']=partB
                     efi_grub_conf.write(GRUB2_BACKUP_TEMPLATE % self.grub_dict)
                 efi_grub_conf.close()
-                system("umount /liveos/efi")
+                system(["umount", "/liveos/efi"])
             logger.info("Grub2 Install Completed")
             return True
 
+    @span("install.ovirt_boot_setup")
     def ovirt_boot_setup(self):
+        progress.phase("install.prepare")
         self.generate_paths()
 
         logger.info("Installing the image.")
@@ -209,7 +241,7 @@ initrd /initrd0.img
                 return True
 
         self.oldtitle=None
-        if os.path.ismount("/liveos"):
+        if mounttab.is_mounted("/liveos"):
             if os.path.exists("/liveos/vmlinuz0") and os.path.exists("/liveos/initrd0.img"):
                 f=open(self.grub_config_file)
                 oldgrub=f.read()
@@ -218,13 +250,13 @@ initrd /initrd0.img
                 if m is not None:
                     self.oldtitle=m.group(1)
 
-            system("umount /liveos")
+            system(["umount", "/liveos"])
 
         if findfs("BootBackup"):
             self.boot_candidate = "BootBackup"
         elif findfs("Boot"):
             self.boot_candidate = "Boot"
-            if not os.path.ismount("/boot"):
+            if not mounttab.is_mounted("/boot"):
                 logger.error("Boot partition not available, Install Failed")
                 return False
             # Grab OVIRT_ISCSI VARIABLES from boot partition for upgrading
@@ -243,10 +275,10 @@ initrd /initrd0.img
                         except:
                             pass
                     f.close()
-                    iscsiadm_cmd = "iscsiadm -p %s:%s -m discovery -t sendtargets" % (OVIRT_VARS["OVIRT_ISCSI_TARGET_IP"], OVIRT_VARS["OVIRT_ISCSI_TARGET_PORT"])
+                    iscsiadm_cmd = ["iscsiadm", "-p", "%s:%s" % (OVIRT_VARS["OVIRT_ISCSI_TARGET_IP"], OVIRT_VARS["OVIRT_ISCSI_TARGET_PORT"]), "-m", "discovery", "-t", "sendtargets"]
                     system(iscsiadm_cmd)
                     logger.info("Restarting iscsi service")
-                    system("service iscsi restart")
+                    system(["service", "iscsi", "restart"])
                 except:
                     pass
         if findfs("RootBackup"):
@@ -260,13 +292,13 @@ initrd /initrd0.img
             label_debug = ''
             for label in os.listdir("/dev/disk/by-label"):
                 label_debug += "%s\n" % label
-            label_debug += subprocess.Popen("blkid", shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout.read()
+            label_debug += process.run(["blkid"], merge_stderr=True).stdout
             logger.debug(label_debug)
             return False
         logger.debug("candidate: " + candidate)
 
         if is_iscsi_install():
-            system("mount LABEL=%s /boot" % self.boot_candidate)
+            system(["mount", "LABEL=%s" % self.boot_candidate, "/boot"])
         try:
             candidate_dev = self.disk = findfs(candidate)
             logger.info(candidate_dev)
@@ -284,15 +316,24 @@ initrd /initrd0.img
             return False
         # prepare Root partition update
         if candidate != "RootNew":
-            e2label_cmd = "e2label \"%s\" RootNew" % candidate_dev
+            e2label_cmd = ["e2label", candidate_dev, "RootNew"]
             logger.debug(e2label_cmd)
             if not system(e2label_cmd):
                 logger.error("Failed to label new Root partition")
                 return False
-        mount_cmd = "mount \"%s\" /liveos" % candidate_dev
+            labelindex.invalidate()
+        mount_cmd = ["mount", candidate_dev, "/liveos"]
         system(mount_cmd)
-        system("rm -rf /liveos/LiveOS")
-        system("mkdir -p /liveos/LiveOS")
+        # a staged image is kept, kernel_image_copy() checks it and
+        # updates only what differs
+        makedirs("/liveos/LiveOS")
+        for name in os.listdir("/liveos/LiveOS"):
+            if name not in ("squashfs.img", os.path.basename(IMAGE_RECORD)):
+                path = os.path.join("/liveos/LiveOS", name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path, True)
+                else:
+                    os.unlink(path)
         mount_live()
 
         if os.path.isdir(self.grub_dir):
@@ -302,19 +343,21 @@ initrd /initrd0.img
 
             if is_efi_boot():
                 logger.info("efi detected, installing efi configuration")
-                system("mkdir /liveos/efi")
+                makedirs("/liveos/efi")
                 # determine proper efi partition
                 efi_part = findfs("Root")
                 efi_part = efi_part[:-1]+"1"
-                system("mount " + efi_part +" /liveos/efi")
-                system("mkdir -p /liveos/efi/EFI/ovirt")
-                system("cp /boot/efi/EFI/redhat/grub.efi /liveos/efi/EFI/ovirt/grub.efi")
+                system(["mount", efi_part, "/liveos/efi"])
+                makedirs("/liveos/efi/EFI/ovirt")
+                system(["cp", "/boot/efi/EFI/redhat/grub.efi", "/liveos/efi/EFI/ovirt/grub.efi"])
                 efi_disk = re.sub("p[1,2,3]$", "", self.disk)
                 # generate grub legacy config for efi partition
-                efi_mgr_cmd = "efibootmgr -c -l '\\EFI\\ovirt\\grub.efi' -L '%s' -d %s -v" % (PRODUCT_SHORT,efi_disk)
+                efi_mgr_cmd = ["efibootmgr", "-c", "-l", "\\EFI\\ovirt\\grub.efi", "-L", PRODUCT_SHORT, "-d", efi_disk, "-v"]
                 logger.info(efi_mgr_cmd)
                 system(efi_mgr_cmd)
-        self.kernel_image_copy()
+        if not self.kernel_image_copy():
+            return False
+        progress.phase("install.bootloader")
 
         # reorder tty0 to allow both serial and phys console after installation
         if is_iscsi_install():
@@ -333,17 +376,25 @@ initrd /initrd0.img
             # workaround for grub setup failing with spaces in dev.name:
             # use first active sd* device
             self.disk = re.sub("p[1,2,3]$", "", self.disk)
-            grub_disk_cmd= "multipath -l \"" + os.path.basename(self.disk) + "\" | awk '/ active / {print $3}' | head -n1"
-            logger.debug(grub_disk_cmd)
-            grub_disk = subprocess.Popen(grub_disk_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            self.disk = grub_disk.stdout.read().strip()
+            inventory = blockinventory.current()
+            mpath = inventory.by_dm_name(os.path.basename(self.disk))
+            if mpath is None:
+                mpath = inventory.get(self.disk)
+            path = None
+            if mpath is not None:
+                path = inventory.active_path(mpath)
+            if path is not None:
+                self.disk = path.name
+            else:
+                self.disk = ""
+            logger.debug("grub disk: %s" % self.disk)
             if "cciss" in self.disk:
                 self.disk = self.disk.replace("!","/")
             # flush to sync DM and blockdev, workaround from rhbz#623846#c14
             sysfs=open("/proc/sys/vm/drop_caches","w")
             sysfs.write("3")
             sysfs.close()
-            partprobe_cmd="partprobe \"/dev/%s\"" % self.disk
+            partprobe_cmd = ["partprobe", "/dev/%s" % self.disk]
             logger.debug(partprobe_cmd)
             system(partprobe_cmd)
 
@@ -400,23 +451,26 @@ initrd /initrd0.img
         if is_iscsi_install():
             # copy default for when Root/HostVG is inaccessible(iscsi upgrade)
             shutil.copy(OVIRT_DEFAULTS, "/boot")
-            system("umount /boot")
+            system(["umount", "/boot"])
         else:
-            system("sync")
-            system("sleep 2")
+            system(["sync"])
             if is_efi_boot():
-                system("mv /liveos/efi/EFI /tmp")
-                efi_dev = os.readlink("/dev/disk/by-label/EFI")
-                system("mkfs.vfat %s" % efi_dev)
-                system("mount %s /liveos/efi" % efi_dev)
-                system("cp -a /tmp/EFI /liveos/efi")
-            system("umount /liveos/efi")
-        system("umount /liveos")
+                if not devwait.wait_for_block_device("/dev/disk/by-label/EFI"):
+                    logger.error("EFI partition not available, Install Failed")
+                    return False
+                system(["mv", "/liveos/efi/EFI", "/tmp"])
+                efi_dev = os.path.realpath("/dev/disk/by-label/EFI")
+                system(["mkfs.vfat", efi_dev])
+                system(["mount", efi_dev, "/liveos/efi"])
+                system(["cp", "-a", "/tmp/EFI", "/liveos/efi"])
+            system(["umount", "/liveos/efi"])
+        system(["umount", "/liveos"])
         # mark new Root ready to go, reboot() in ovirt-function switches it to active
-        e2label_cmd = "e2label \"%s\" RootUpdate" % candidate_dev
+        e2label_cmd = ["e2label", candidate_dev, "RootUpdate"]
         if not system(e2label_cmd):
             logger.error("Unable to relabel " + candidate_dev + " to RootUpdate ")
             return False
+        labelindex.invalidate()
         disable_firstboot()
         if finish_install():
             iscsi_auto()
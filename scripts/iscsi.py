@@ -20,6 +20,7 @@
 
 import os
 from ovirtnode.ovirtfunctions import *
+from ovirtnode.spans import span
 import logging
 
 INITIATOR_FILE="/etc/iscsi/initiatorname.iscsi"
@@ -32,7 +33,7 @@ def set_iscsi_initiator(initiator_name):
         logger.info("Initiator name set as: " + initiator_name)
     else:
         logger.warning("Setting initiator name failed")
-    os.system("service iscsi restart &> /dev/null")
+    system(["service", "iscsi", "restart"])
 
 def get_current_iscsi_initiator_name():
     iscsi_config = open(INITIATOR_FILE)
@@ -42,11 +43,11 @@ def get_current_iscsi_initiator_name():
             initiator_name = line.replace("InitiatorName=","")
             return initiator_name.strip()
 
+@span("iscsi_auto")
 def iscsi_auto():
     if not OVIRT_VARS.has_key("OVIRT_ISCSI_NAME"):
         logger.info("Generating iSCSI IQN")
-        iscsi_iqn_cmd = subprocess.Popen("/sbin/iscsi-iname", stdout=PIPE)
-        iscsi_iqn, err = iscsi_iqn_cmd.communicate()
-        set_iscsi_initiator(iscsi_iqn.strip())
+        iscsi_iqn = process.output(["/sbin/iscsi-iname"])
+        set_iscsi_initiator(iscsi_iqn)
     else:
         set_iscsi_initiator(OVIRT_VARS["OVIRT_ISCSI_NAME"])
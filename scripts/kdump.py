@@ -19,6 +19,7 @@
 # also available at http://www.gnu.org/copyleft/gpl.html.
 
 from ovirtnode.ovirtfunctions import *
+from ovirtnode.spans import span
 
 def write_kdump_config(config):
     kdump_config_file = open("/etc/kdump.conf", "w")
@@ -44,10 +45,11 @@ def process_kdump_config():
     if self.kdump_restore_config.value() == 1:
         restore_kdump_config()
     ovirt_store_config("/etc/kdump.conf")
-    os.system("service kdump restart &> /dev/null")
+    system(["service", "kdump", "restart"])
     return True
 
 
+@span("kdump_auto")
 def kdump_auto():
     try:
         if OVIRT_VARS.has_key("OVIRT_KDUMP_NFS"):
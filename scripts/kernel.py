@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# kernel.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Direct Linux system calls through ctypes.
+
+Used where spawning mount(8) and friends for every single operation
+would dominate the cost.  Failures raise OSError with the errno set,
+like the functions in the os module.
+"""
+
+import os
+import ctypes
+import ctypes.util
+
+# <sys/mount.h>
+MS_RDONLY = 1
+MS_REMOUNT = 32
+MS_BIND = 4096
+MS_MOVE = 8192
+MS_REC = 16384
+
+MNT_FORCE = 1
+MNT_DETACH = 2
+
+_libc = None
+
+
+def libc():
+    """Returns the C library, loaded on first use."""
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library("c") or "libc.so.6"
+        _libc = ctypes.CDLL(name, use_errno=True)
+    return _libc
+
+
+def _raise(what):
+    err = ctypes.get_errno()
+    raise OSError(err, "%s: %s" % (what, os.strerror(err)))
+
+
+def mount(source, target, fstype=None, flags=0, data=None):
+    """mount(2), e.g. mount(src, dst, flags=MS_BIND) for a bind mount."""
+    if libc().mount(source, target, fstype, flags, data) != 0:
+        _raise("mount %s on %s" % (source, target))
+
+
+def bind_mount(source, target):
+    mount(source, target, None, MS_BIND)
+
+
+def umount(target, flags=0):
+    """umount2(2)."""
+    if libc().umount2(target, flags) != 0:
+        _raise("umount %s" % target)
@@ -0,0 +1,260 @@
+#!/usr/bin/python
+# labelindex.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Filesystem label and UUID lookups without blkid.
+
+probe() reads the ext2/3/4, vfat or iso9660 superblock of a device
+and returns its type, label and UUID.  A LabelIndex answers
+find(label) from /dev/disk/by-label, checking each link against the
+superblock it points to, and probes every block device once when a
+label has no usable link.  Answers are cached until invalidate() or
+until the block inventory changes; call invalidate() after mkfs or
+e2label, which do not always produce a uevent.
+"""
+
+import os
+import re
+import struct
+import logging
+import threading
+import ovirtnode.blockinventory as blockinventory
+
+logger = logging.getLogger("ovirtnode.labelindex")
+
+BY_LABEL = "/dev/disk/by-label"
+BY_UUID = "/dev/disk/by-uuid"
+
+# ext superblock
+EXT_OFFSET = 1024
+EXT_MAGIC = 0xEF53
+EXT_COMPAT_HAS_JOURNAL = 0x4
+EXT_INCOMPAT_EXT4 = 0x40 | 0x80 | 0x200   # extents, 64bit, flex_bg
+
+# iso9660 primary volume descriptor
+ISO_PVD_OFFSET = 32768
+
+PROBE_SIZE = ISO_PVD_OFFSET + 2048
+
+_escape = re.compile(r"\\x([0-9a-fA-F]{2})")
+
+
+def _unescape(name):
+    # udev writes unsafe characters of a label as \xNN
+    return _escape.sub(lambda m: chr(int(m.group(1), 16)), name)
+
+
+def _format_uuid(raw):
+    hexed = raw.encode("hex")
+    return "-".join([hexed[0:8], hexed[8:12], hexed[12:16], hexed[16:20],
+                     hexed[20:32]])
+
+
+def _probe_ext(data):
+    sb = data[EXT_OFFSET:EXT_OFFSET + 1024]
+    if len(sb) < 136 or struct.unpack_from("<H", sb, 56)[0] != EXT_MAGIC:
+        return None
+    compat, incompat = struct.unpack_from("<II", sb, 92)
+    if incompat & EXT_INCOMPAT_EXT4:
+        fstype = "ext4"
+    elif compat & EXT_COMPAT_HAS_JOURNAL:
+        fstype = "ext3"
+    else:
+        fstype = "ext2"
+    label = sb[120:136].split("\0", 1)[0] or None
+    return fstype, label, _format_uuid(sb[104:120])
+
+
+def _probe_vfat(data):
+    if len(data) < 512 or data[510:512] != "\x55\xaa":
+        return None
+    if data[82:87] == "FAT32":
+        label, serial = data[71:82], data[67:71]
+    elif data[54:59] in ("FAT12", "FAT16"):
+        label, serial = data[43:54], data[39:43]
+    else:
+        return None
+    label = label.rstrip(" \0")
+    if label in ("", "NO NAME"):
+        label = None
+    serial = struct.unpack("<I", serial)[0]
+    return "vfat", label, "%04X-%04X" % (serial >> 16, serial & 0xffff)
+
+
+def _probe_iso9660(data):
+    pvd = data[ISO_PVD_OFFSET:ISO_PVD_OFFSET + 2048]
+    if len(pvd) < 830 or pvd[0] != "\x01" or pvd[1:6] != "CD001":
+        return None
+    label = pvd[40:72].rstrip(" \0") or None
+    # blkid uses the creation time, e.g. 2012-05-14-10-21-33-00
+    created = pvd[813:829]
+    uuid = None
+    if created.isdigit() and created.strip("0"):
+        uuid = "-".join([created[0:4], created[4:6], created[6:8],
+                         created[8:10], created[10:12], created[12:14],
+                         created[14:16]])
+    return "iso9660", label, uuid
+
+
+PROBES = (_probe_ext, _probe_vfat, _probe_iso9660)
+
+
+def probe(path):
+    """Returns (fstype, label, uuid) of the filesystem on path, None if
+    none is recognized, or raises OSError if path cannot be read."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        chunks = []
+        size = 0
+        while size < PROBE_SIZE:
+            chunk = os.read(fd, PROBE_SIZE - size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size = size + len(chunk)
+    finally:
+        os.close(fd)
+    data = "".join(chunks)
+    for func in PROBES:
+        result = func(data)
+        if result is not None:
+            return result
+    return None
+
+
+class LabelIndex(object):
+    """Label and UUID to device lookups, cached per block inventory."""
+
+    def __init__(self, by_label=BY_LABEL, by_uuid=BY_UUID):
+        self.by_label = by_label
+        self.by_uuid = by_uuid
+        self._lock = threading.Lock()
+        self._inventory = None
+        self._tables = None
+        self._probed = False
+
+    def invalidate(self):
+        self._lock.acquire()
+        try:
+            self._inventory = None
+        finally:
+            self._lock.release()
+
+    def _check(self):
+        inventory = blockinventory.current()
+        if inventory is not self._inventory:
+            self._inventory = inventory
+            self._tables = {"label": {}, "uuid": {}}
+            self._probed = False
+        return inventory
+
+    def _from_link(self, inventory, kind, value):
+        directory = kind == "label" and self.by_label or self.by_uuid
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return None
+        for name in names:
+            if _unescape(name) != value:
+                continue
+            target = os.path.realpath(os.path.join(directory, name))
+            device = inventory.get(target)
+            if device is not None and (device.holders or
+                                       inventory.behind_multipath(device)):
+                # a path under a multipath map, or the like; the map
+                # is found by probing, as _probe_all() skips these
+                logger.debug("Skipping %s link %s -> %s" % (kind, name,
+                                                           target))
+                continue
+            path = device is not None and device.path or target
+            try:
+                found = probe(path)
+            except OSError:
+                # unreadable, trust udev
+                return path
+            if found is None:
+                # e.g. a link left behind after wiping
+                logger.debug("Unrecognized %s link %s -> %s" % (kind, name,
+                                                               target))
+                continue
+            if (kind == "label" and found[1] == value) or \
+                    (kind == "uuid" and found[2] == value):
+                return path
+            logger.debug("Stale %s link %s -> %s" % (kind, name, target))
+        return None
+
+    def _probe_all(self, inventory):
+        devices = list(inventory)
+        # like blkid, prefer the device-mapper name of a filesystem
+        devices.sort(key=lambda d: (not d.device_mapper, d.name))
+        for device in devices:
+            if device.size == 0 or device.holders or \
+                    inventory.behind_multipath(device):
+                continue
+            try:
+                found = probe(device.path)
+            except OSError:
+                continue
+            if found is None:
+                continue
+            fstype, label, uuid = found
+            if label is not None:
+                self._tables["label"].setdefault(label, device.path)
+            if uuid is not None:
+                self._tables["uuid"].setdefault(uuid, device.path)
+        self._probed = True
+
+    def _find(self, kind, value):
+        self._lock.acquire()
+        try:
+            inventory = self._check()
+            table = self._tables[kind]
+            if value in table:
+                return table[value]
+            if not self._probed:
+                path = self._from_link(inventory, kind, value)
+                if path is not None:
+                    table[value] = path
+                    return path
+                self._probe_all(inventory)
+            return table.get(value)
+        finally:
+            self._lock.release()
+
+    def find(self, label):
+        """Returns the device with the filesystem label, or None."""
+        return self._find("label", label)
+
+    def find_uuid(self, uuid):
+        """Returns the device with the filesystem UUID, or None."""
+        return self._find("uuid", uuid)
+
+
+index = LabelIndex()
+
+
+def find(label):
+    return index.find(label)
+
+
+def find_uuid(uuid):
+    return index.find_uuid(uuid)
+
+
+def invalidate():
+    """Forgets all answers, e.g. after mkfs or e2label."""
+    index.invalidate()
@@ -5,6 +5,7 @@
 import os
 import sys
 from ovirtnode.ovirtfunctions import *
+from ovirtnode.spans import span
 
 RSYSLOG_FILE="/etc/rsyslog.conf"
 
@@ -75,7 +76,7 @@ def ovirt_rsyslog(server, port, protocol):
     rsyslog_config = open(RSYSLOG_FILE, "w")
     rsyslog_config.write(rsyslog_config_out)
     rsyslog_config.close()
-    os.system("/sbin/service rsyslog restart &> /dev/null")
+    system(["/sbin/service", "rsyslog", "restart"])
     if ovirt_store_config("/etc/rsyslog.conf"):
         logger.info("Syslog Configuration Updated")
     return True
@@ -83,7 +84,7 @@ def ovirt_rsyslog(server, port, protocol):
 def ovirt_netconsole(server, port):
     augtool("set","/files/etc/sysconfig/netconsole/SYSLOGADDR", server)
     augtool("set","/files/etc/sysconfig/netconsole/SYSLOGPORT", port)
-    os.system("/sbin/service netconsole restart &> /dev/null")
+    system(["/sbin/service", "netconsole", "restart"])
     if ovirt_store_config("/etc/sysconfig/netconsole"):
         logger.info("Netconsole Configuration Updated")
     return True
@@ -162,6 +163,7 @@ def netconsole_auto():
         ovirt_netconsole(OVIRT_VARS["OVIRT_NETCONSOLE_SERVER"], OVIRT_VARS["OVIRT_NETCONSOLE_PORT"])
         return True
 
+@span("logging_auto")
 def logging_auto():
     try:
         syslog_auto()
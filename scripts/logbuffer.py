@@ -0,0 +1,268 @@
+#!/usr/bin/python
+# logbuffer.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Buffered writer for ovirt.log.
+
+Records are formatted by the caller and queued in a bounded ring; a
+writer thread appends them to the log file in batches.  The file is
+opened once, fsynced on close and at exit, and can be moved with
+migrate(), e.g. from /tmp to the Logging LV, without losing or
+repeating lines: records logged while the move is in progress stay
+queued and end up in the new file.
+"""
+
+import os
+import sys
+import atexit
+import logging
+import threading
+import collections
+
+# records kept in memory if the writer falls behind
+CAPACITY = 10000
+# records queued before the writer is woken early
+BATCH = 256
+# seconds a record may wait in the queue
+FLUSH_INTERVAL = 0.5
+
+
+def merge(source, dest):
+    """Appends source to dest, syncs dest and removes source."""
+    try:
+        src = open(source, "rb")
+    except IOError:
+        return False
+    try:
+        out = open(dest, "ab")
+        try:
+            data = src.read(1024 * 1024)
+            while data:
+                out.write(data)
+                data = src.read(1024 * 1024)
+            out.flush()
+            os.fsync(out.fileno())
+        finally:
+            out.close()
+    finally:
+        src.close()
+    os.unlink(source)
+    return True
+
+
+def _join(dropped, chunk):
+    """Returns the text to write for chunk, unicode records encoded as
+    UTF-8, after a marker if records were dropped."""
+    lines = []
+    if dropped:
+        lines.append("--- %d log records dropped ---\n" % dropped)
+    for text in chunk:
+        if isinstance(text, unicode):
+            text = text.encode("utf-8", "replace")
+        lines.append(text)
+    return "".join(lines)
+
+
+class BufferedLogHandler(logging.Handler):
+    """Handler queueing formatted records for a writer thread.
+
+    path is the log file, or a callable returning it; it is resolved
+    when the first batch is written.
+    """
+
+    def __init__(self, path, capacity=CAPACITY, interval=FLUSH_INTERVAL):
+        logging.Handler.__init__(self)
+        self._path = path
+        self.interval = interval
+        self.dropped = 0
+        self._pending = collections.deque(maxlen=capacity)
+        self._cond = threading.Condition(threading.Lock())
+        self._io_lock = threading.RLock()
+        self._file = None
+        self._suspended = False
+        self._closed = False
+        self._thread = None
+        atexit.register(self.close)
+
+    @property
+    def path(self):
+        if callable(self._path):
+            self._path = self._path()
+        return self._path
+
+    def emit(self, record):
+        try:
+            text = self.format(record) + "\n"
+        except Exception:
+            self.handleError(record)
+            return
+        self.write(text)
+
+    def write(self, text):
+        """Queues raw text for the log file."""
+        self._cond.acquire()
+        try:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped = self.dropped + 1
+            self._pending.append(text)
+            if self._closed:
+                sync = True
+            else:
+                sync = False
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run,
+                                                    name="ovirt-log")
+                    self._thread.setDaemon(True)
+                    self._thread.start()
+                elif len(self._pending) >= BATCH:
+                    self._cond.notify()
+        finally:
+            self._cond.release()
+        if sync:
+            self._drain()
+
+    def _run(self):
+        while True:
+            self._cond.acquire()
+            try:
+                if not self._pending and not self._closed:
+                    self._cond.wait(self.interval)
+                if self._closed:
+                    return
+            finally:
+                self._cond.release()
+            # the writer must outlive any bad batch
+            try:
+                self._drain()
+            except Exception, e:
+                sys.stderr.write("ovirt-log writer: %s\n" % e)
+
+    def _take(self):
+        """Returns (records dropped before, queued records)."""
+        self._cond.acquire()
+        try:
+            chunk = list(self._pending)
+            self._pending.clear()
+            dropped = self.dropped
+            self.dropped = 0
+            return dropped, chunk
+        finally:
+            self._cond.release()
+
+    def _requeue(self, dropped, chunk):
+        """Puts chunk back in front of the queue, as far as there is
+        room; what does not fit counts as dropped."""
+        self._cond.acquire()
+        try:
+            room = self._pending.maxlen - len(self._pending)
+            if len(chunk) > room:
+                # keep the newest, as the queue itself does
+                dropped = dropped + len(chunk) - room
+                chunk = chunk[len(chunk) - room:]
+            self._pending.extendleft(reversed(chunk))
+            self.dropped = self.dropped + dropped
+        finally:
+            self._cond.release()
+
+    def _drain(self, sync=False):
+        self._io_lock.acquire()
+        try:
+            if self._suspended:
+                return
+            dropped, chunk = self._take()
+            path = None
+            try:
+                if chunk or dropped:
+                    if self._file is None:
+                        path = self.path
+                        self._file = open(path, "a")
+                    self._file.write(_join(dropped, chunk))
+                    self._file.flush()
+                if sync and self._file is not None:
+                    os.fsync(self._file.fileno())
+            except (IOError, OSError), e:
+                # keep the lines for the next attempt
+                self._requeue(dropped, chunk)
+                sys.stderr.write("Unable to write %s: %s\n" %
+                                 (path or "the log", e))
+            except Exception, e:
+                self._cond.acquire()
+                try:
+                    self.dropped = self.dropped + dropped + len(chunk)
+                finally:
+                    self._cond.release()
+                sys.stderr.write("Dropping %d log records: %s\n" %
+                                 (len(chunk), e))
+        finally:
+            self._io_lock.release()
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            finally:
+                self._file = None
+
+    def flush(self):
+        """Writes all queued records."""
+        self._drain()
+
+    def sync(self):
+        """Writes all queued records and fsyncs the log file."""
+        self._drain(sync=True)
+
+    def migrate(self, path, prepare=None):
+        """Moves logging to path.
+
+        Queued records are written to the current file, which is synced
+        and closed.  prepare(old_path) then runs with writing suspended,
+        to move or merge the old file; records logged meanwhile stay
+        queued.  If prepare raises, logging continues in the old file.
+        """
+        self._io_lock.acquire()
+        try:
+            self._drain(sync=True)
+            old = self.path
+            self._close_file()
+            self._suspended = True
+            try:
+                if prepare is not None:
+                    prepare(old)
+                self._path = path
+            finally:
+                self._suspended = False
+        finally:
+            self._io_lock.release()
+        self._drain()
+
+    def close(self):
+        self._cond.acquire()
+        try:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        finally:
+            self._cond.release()
+        if thread is not None and thread is not threading.currentThread():
+            thread.join(1)
+        self._io_lock.acquire()
+        try:
+            self._drain(sync=True)
+            self._close_file()
+        finally:
+            self._io_lock.release()
+        logging.Handler.close(self)
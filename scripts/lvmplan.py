@@ -0,0 +1,313 @@
+#!/usr/bin/python
+# lvmplan.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Volume groups planned up front and created in one go.
+
+A VolumeGroup lists its logical volumes in order, each with a size in
+MiB or taking the rest of the group, and what to put on it:
+
+    vg = VolumeGroup("HostVG", ["/dev/sda4"])
+    vg.add("Config", 5, "ext4", "CONFIG")
+    vg.add("Data", None, "ext4", "DATA", "/data", "defaults,noatime")
+    create(vg, progress)
+
+create() runs vgcreate and all lvcreates in a single lvm shell
+session, then formats the volumes side by side, so a large Data
+volume does not wait for the small ones.  ext filesystems are made
+without periodic checks instead of running tune2fs afterwards.  The
+progress callback, if any, learns the bytes formatted as each volume
+is done.
+fstab() returns the lines for /etc/fstab, to be written at once.
+"""
+
+import os
+import struct
+import logging
+import tempfile
+import threading
+import ovirtnode.process as process
+import ovirtnode.devwait as devwait
+import ovirtnode.diskwipe as diskwipe
+from ovirtnode.workers import parallel_map
+
+logger = logging.getLogger("ovirtnode.lvmplan")
+
+MKE2FS_CONFIG = "/etc/mke2fs.conf"
+NO_PERIODIC_FSCK = "\tenable_periodic_fsck = 0\n"
+
+# s_max_mnt_count and s_checkinterval of the ext superblock
+EXT_SUPERBLOCK = 1024
+EXT_MAX_MOUNT_COUNT = 54
+EXT_CHECK_INTERVAL = 68
+
+NODE_TIMEOUT = 5
+
+
+class Volume(object):
+
+    def __init__(self, vg, name, size_mb, fstype, label, mountpoint,
+                 options):
+        self.vg = vg
+        self.name = name
+        # None takes the free space left in the group
+        self.size_mb = size_mb
+        self.fstype = fstype
+        self.label = label
+        self.mountpoint = mountpoint
+        self.options = options
+
+    def __repr__(self):
+        return "<Volume %s %s %s>" % (self.path, self.size_mb, self.fstype)
+
+    @property
+    def path(self):
+        return "/dev/%s/%s" % (self.vg, self.name)
+
+    @property
+    def mapper_path(self):
+        return "/dev/mapper/%s-%s" % (self.vg.replace("-", "--"),
+                                      self.name.replace("-", "--"))
+
+    def lvcreate(self):
+        if self.size_mb is None:
+            size = ["-l", "100%FREE"]
+        else:
+            size = ["--size", "%dM" % self.size_mb]
+        return ["lvcreate", "--name", self.name] + size + ["/dev/" + self.vg]
+
+
+class VolumeGroup(object):
+    """A volume group and its logical volumes, in order."""
+
+    def __init__(self, name, physical_volumes):
+        self.name = name
+        self.physical_volumes = list(physical_volumes)
+        self.volumes = []
+
+    def add(self, name, size_mb=None, fstype=None, label=None,
+            mountpoint=None, options="defaults"):
+        """Appends a volume of size_mb MiB, or taking the rest of the
+        group if size_mb is None, formatted as fstype ("swap", "ext4"
+        or None) and listed in fstab if it has a mountpoint."""
+        if self.volumes and self.volumes[-1].size_mb is None:
+            raise ValueError("%s follows a volume taking the rest of %s" %
+                             (name, self.name))
+        volume = Volume(self.name, name, size_mb, fstype, label, mountpoint,
+                        options)
+        self.volumes.append(volume)
+        return volume
+
+    def volume(self, name):
+        for volume in self.volumes:
+            if volume.name == name:
+                return volume
+        return None
+
+    def vgcreate(self):
+        return ["vgcreate", "/dev/" + self.name] + self.physical_volumes
+
+    def fstab(self):
+        """Returns the fstab lines of the volumes with a mountpoint."""
+        lines = []
+        for volume in self.volumes:
+            if volume.mountpoint is None:
+                continue
+            lines.append("%s %s %s %s 0 0\n" % (
+                volume.path, volume.mountpoint, volume.fstype,
+                volume.options))
+        return lines
+
+
+def _shell(commands):
+    """Runs commands in one lvm shell; returns the Result, or None if
+    that is not possible."""
+    for argv in commands:
+        for arg in argv:
+            # the lvm shell splits at whitespace and knows no quoting
+            if not arg or arg != arg.strip() or len(arg.split()) != 1:
+                return None
+    script = "".join([" ".join(argv) + "\n" for argv in commands])
+    result = process.run(["lvm"], input=script + "exit\n")
+    logger.debug(script + result.stdout + result.stderr)
+    if result.returncode == 127:
+        return None
+    return result
+
+
+def _errors(stderr):
+    """Returns the lines of lvm output that are not warnings."""
+    return [line.strip() for line in stderr.splitlines()
+            if line.strip() and not line.strip().startswith("WARNING")]
+
+
+def _run(argv, env=None):
+    result = process.run(argv, env=env)
+    if not result:
+        raise RuntimeError("%s failed: %s" % (process.format_argv(argv),
+                                              result.stderr.strip()))
+
+
+def _existing_volumes(vg):
+    """Returns the names of the logical volumes of vg, or None if the
+    volume group does not exist."""
+    result = process.run(["lvs", "--noheadings", "-o", "lv_name", vg.name])
+    if not result:
+        return None
+    return set(result.stdout.split())
+
+
+def _create_volumes(vg):
+    commands = [vg.vgcreate()] + [v.lvcreate() for v in vg.volumes]
+    logger.info("Creating volume group %s on %s with %s" % (
+        vg.name, " ".join(vg.physical_volumes),
+        ", ".join([v.name for v in vg.volumes])))
+    errors = []
+    result = _shell(commands)
+    if result is not None:
+        # the lvm shell exits 0 even if commands in it failed
+        errors = _errors(result.stderr)
+        existing = _existing_volumes(vg)
+        if existing is not None:
+            commands = [v.lvcreate() for v in vg.volumes
+                        if v.name not in existing]
+        if commands:
+            left = ", ".join([" ".join(c[:3]) for c in commands])
+            logger.warning("lvm shell left out %s, running them one by "
+                           "one: %s" % (left, "; ".join(errors)))
+        elif errors:
+            logger.warning("lvm shell: %s" % "; ".join(errors))
+    for argv in commands:
+        try:
+            _run(argv)
+        except RuntimeError, e:
+            if errors:
+                raise RuntimeError("%s; lvm shell: %s" % (e, "; ".join(errors)))
+            raise
+    for v in vg.volumes:
+        if not devwait.wait_for_block_device(v.mapper_path, NODE_TIMEOUT):
+            raise RuntimeError("%s was created but %s did not appear" %
+                               (v.path, v.mapper_path))
+    return True
+
+
+def mke2fs_config(source=MKE2FS_CONFIG):
+    """Returns the text of source with periodic checks disabled."""
+    try:
+        f = open(source)
+        try:
+            text = f.read()
+        finally:
+            f.close()
+    except IOError:
+        text = ""
+    lines = text.splitlines(True)
+    for n, line in enumerate(lines):
+        if line.strip() == "[defaults]":
+            lines.insert(n + 1, NO_PERIODIC_FSCK)
+            return "".join(lines)
+    return "[defaults]\n" + NO_PERIODIC_FSCK + text
+
+
+def periodic_fsck(path):
+    """True if the ext filesystem on path has mount count or interval
+    triggered checks enabled."""
+    f = open(path, "rb")
+    try:
+        f.seek(EXT_SUPERBLOCK)
+        sb = f.read(EXT_CHECK_INTERVAL + 4)
+    finally:
+        f.close()
+    max_mounts = struct.unpack_from("<h", sb, EXT_MAX_MOUNT_COUNT)[0]
+    interval = struct.unpack_from("<I", sb, EXT_CHECK_INTERVAL)[0]
+    return max_mounts > 0 or interval > 0
+
+
+class Formatter(object):
+
+    def __init__(self, config, progress=None, sizes=None):
+        self.env = os.environ.copy()
+        self.env["MKE2FS_CONFIG"] = config
+        self.progress = progress
+        self.sizes = sizes or {}
+        self.total = sum(self.sizes.values())
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def format(self, volume):
+        if volume.fstype == "swap":
+            argv = ["mkswap", volume.path]
+            if volume.label:
+                argv[1:1] = ["-L", volume.label]
+            _run(argv)
+            return
+        argv = ["mke2fs", "-j", "-t", volume.fstype, volume.path]
+        if volume.label:
+            argv.extend(["-L", volume.label])
+        _run(argv, self.env)
+        if periodic_fsck(volume.path):
+            # mke2fs before 1.42 ignores enable_periodic_fsck
+            _run(["tune2fs", "-c", "0", "-i", "0", volume.path])
+
+    def __call__(self, volume):
+        self.format(volume)
+        if self.progress is None:
+            return
+        # the volumes are formatted side by side, report one at a time
+        self.lock.acquire()
+        try:
+            self.done = self.done + self.sizes.get(volume.path, 0)
+            self.progress(self.done, self.total, volume.path)
+        finally:
+            self.lock.release()
+
+
+def _sizes(volumes):
+    sizes = {}
+    for volume in volumes:
+        try:
+            sizes[volume.path] = diskwipe.device_size(volume.path)
+        except OSError, e:
+            logger.debug("Unable to size %s: %s" % (volume.path, e))
+    return sizes
+
+
+def _format_volumes(volumes, progress=None):
+    fd, config = tempfile.mkstemp(prefix="mke2fs.", suffix=".conf")
+    try:
+        os.write(fd, mke2fs_config())
+        os.close(fd)
+        logger.info("Formatting %s" % ", ".join([v.name for v in volumes]))
+        sizes = None
+        if progress is not None:
+            sizes = _sizes(volumes)
+            progress(0, sum(sizes.values()), None)
+        parallel_map(Formatter(config, progress, sizes), volumes,
+                     max(len(volumes), 1))
+    finally:
+        os.unlink(config)
+
+
+def create(vg, progress=None):
+    """Creates vg and its volumes and formats them; raises
+    RuntimeError or JobError on failure.  progress(bytes done, bytes
+    total, volume path) is called as each volume is formatted."""
+    _create_volumes(vg)
+    volumes = [v for v in vg.volumes if v.fstype is not None]
+    if volumes:
+        _format_volumes(volumes, progress)
+    return vg
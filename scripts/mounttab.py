@@ -0,0 +1,260 @@
+#!/usr/bin/python
+# mounttab.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Parsed, cached view of the mount table.
+
+The table is built from /proc/self/mountinfo, which unlike /proc/mounts
+carries the device number and the path inside the filesystem of every
+mount, so bind mounts can be told apart from regular ones.  The kernel
+flags /proc/self/mounts with POLLPRI whenever the mount namespace
+changes; the cached table is dropped then and rebuilt on next use.
+
+All ovirtnode modules share the table instance in this module.
+"""
+
+import os
+import re
+import select
+import threading
+
+MOUNTINFO = "/proc/self/mountinfo"
+MOUNTS = "/proc/self/mounts"
+
+_escape_re = re.compile(r"\\([0-7]{3})")
+
+
+def _unescape(field):
+    """mountinfo escapes blanks and backslashes as octal sequences."""
+    return _escape_re.sub(lambda m: chr(int(m.group(1), 8)), field)
+
+
+class MountEntry(object):
+    """One line of /proc/self/mountinfo."""
+
+    def __init__(self, mount_id, parent_id, major, minor, root, target,
+                 options, fstype, source, super_options):
+        self.mount_id = mount_id
+        self.parent_id = parent_id
+        self.major = major
+        self.minor = minor
+        self.root = root
+        self.target = target
+        self.options = options
+        self.fstype = fstype
+        self.source = source
+        self.super_options = super_options
+
+    def __repr__(self):
+        return "<MountEntry %s on %s type %s>" % (self.source, self.target,
+                                                  self.fstype)
+
+    def dev(self):
+        return (self.major, self.minor)
+
+
+def parse_mountinfo(data):
+    """Returns the MountEntry list for the mountinfo text in data."""
+    entries = []
+    for line in data.splitlines():
+        fields = line.split()
+        try:
+            sep = fields.index("-", 6)
+            major, minor = fields[2].split(":")
+            entries.append(MountEntry(int(fields[0]), int(fields[1]),
+                                      int(major), int(minor),
+                                      _unescape(fields[3]),
+                                      _unescape(fields[4]),
+                                      fields[5].split(","),
+                                      fields[sep + 1],
+                                      _unescape(fields[sep + 2]),
+                                      fields[sep + 3].split(",")))
+        except (ValueError, IndexError):
+            continue
+    return entries
+
+
+class MountTable(object):
+    """Queryable mount table which reloads itself when mounts change."""
+
+    def __init__(self, mountinfo=MOUNTINFO, mounts=MOUNTS):
+        self.mountinfo = mountinfo
+        self._lock = threading.RLock()
+        self._entries = None
+        self._by_target = {}
+        # bumped on every reload, lets callers key their own caches
+        self.generation = 0
+        self._watch = None
+        self._poll = None
+        try:
+            self._watch = open(mounts)
+            self._poll = select.poll()
+            self._poll.register(self._watch.fileno(),
+                                select.POLLPRI | select.POLLERR)
+        except (IOError, AttributeError):
+            # no change notification, reload on every query
+            self._poll = None
+
+    def _check(self, timeout=0):
+        if self._poll is None:
+            self._entries = None
+            return True
+        if self._poll.poll(timeout):
+            self._entries = None
+            return True
+        return False
+
+    def _load(self):
+        self._check()
+        if self._entries is not None:
+            return self._entries
+        f = open(self.mountinfo)
+        try:
+            entries = parse_mountinfo(f.read())
+        finally:
+            f.close()
+        by_target = {}
+        for entry in entries:
+            # the last mount on a path is the visible one
+            by_target[entry.target] = entry
+        self._entries = entries
+        self._by_target = by_target
+        self.generation = self.generation + 1
+        return entries
+
+    def invalidate(self):
+        self._lock.acquire()
+        try:
+            self._entries = None
+        finally:
+            self._lock.release()
+
+    def wait(self, timeout=None):
+        """Blocks until the mount table changes or timeout seconds pass.
+
+        Returns True if a change was seen.
+        """
+        if timeout is not None:
+            timeout = int(timeout * 1000)
+        self._lock.acquire()
+        try:
+            return self._check(timeout)
+        finally:
+            self._lock.release()
+
+    def entries(self):
+        """Returns all mounts in mount order."""
+        self._lock.acquire()
+        try:
+            return list(self._load())
+        finally:
+            self._lock.release()
+
+    def targets(self):
+        """Returns the set of current mount points."""
+        self._lock.acquire()
+        try:
+            self._load()
+            return set(self._by_target.keys())
+        finally:
+            self._lock.release()
+
+    def by_target(self, target):
+        """Returns the visible mount on target, or None."""
+        target = os.path.abspath(target)
+        self._lock.acquire()
+        try:
+            self._load()
+            return self._by_target.get(target)
+        finally:
+            self._lock.release()
+
+    def is_mounted(self, target):
+        return self.by_target(target) is not None
+
+    def by_source(self, source):
+        """Returns the mounts of the device or name source.
+
+        Device nodes are matched by device number, so /dev/HostVG/Config
+        also finds mounts listed as /dev/mapper/HostVG-Config.
+        """
+        rdev = None
+        try:
+            st = os.stat(source)
+            if st.st_rdev:
+                rdev = (os.major(st.st_rdev), os.minor(st.st_rdev))
+        except OSError:
+            pass
+        result = []
+        for entry in self.entries():
+            if entry.source == source or entry.dev() == rdev:
+                result.append(entry)
+        return result
+
+    def by_fstype(self, fstype):
+        return [e for e in self.entries() if e.fstype == fstype]
+
+    def bind_origin(self, target):
+        """Returns the path a bind mount on target was made from.
+
+        Returns None if target is not a mount point or is the primary
+        mount of its filesystem.
+        """
+        self._lock.acquire()
+        try:
+            entries = self._load()
+            entry = self._by_target.get(os.path.abspath(target))
+            return self._origin(entries, entry)
+        finally:
+            self._lock.release()
+
+    def _origin(self, entries, entry):
+        if entry is None:
+            return None
+        for primary in entries:
+            if primary.dev() == entry.dev() and primary.root == "/":
+                if primary is entry:
+                    return None
+                if entry.root == "/":
+                    return primary.target
+                return os.path.join(primary.target, entry.root.lstrip("/"))
+        return None
+
+    def binds_from(self, path):
+        """Returns the bind mounts made from path or from below it."""
+        path = os.path.abspath(path)
+        self._lock.acquire()
+        try:
+            entries = self._load()
+            result = []
+            for entry in entries:
+                origin = self._origin(entries, entry)
+                if origin is None:
+                    continue
+                if origin == path or origin.startswith(path + "/"):
+                    result.append(entry)
+            return result
+        finally:
+            self._lock.release()
+
+
+table = MountTable()
+
+
+def is_mounted(target):
+    """Returns True if something is mounted on target."""
+    return table.is_mounted(target)
@@ -17,6 +17,7 @@
 # MA  02110-1301, USA.  A copy of the GNU General Public License is
 # also available at http://www.gnu.org/copyleft/gpl.html.
 from ovirtnode.ovirtfunctions import *
+from ovirtnode.spans import span
 from glob import glob
 import tempfile
 import sys
@@ -25,7 +26,6 @@ import logging
 class Network:
 
     def __init__(self):
-        OVIRT_VARS = parse_defaults()
         self.WORKDIR=tempfile.mkdtemp()
         self.IFSCRIPTS_PATH ="/etc/sysconfig/network-scripts/ifcfg-"
         self.IFCONFIG_FILE_ROOT="/files%s" % self.IFSCRIPTS_PATH
@@ -171,7 +171,6 @@ class Network:
 
 
     def configure_dns(self):
-        OVIRT_VARS = parse_defaults()
         if OVIRT_VARS.has_key("OVIRT_DNS"):
             DNS=OVIRT_VARS["OVIRT_DNS"]
             try:
@@ -206,124 +205,123 @@ class Network:
         ntpconf += "set %s/includefile /etc/ntp/crypto/pw\n" % ntproot
         ntpconf += "set %s/keys /etc/ntp/keys" % ntproot
         ntpconf = ntpconf.split("\n")
-        for line in ntpconf:
-            try:
-                oper, key, value = line.split()
-                augtool(oper, key, value)
-            except:
-                oper, key = line.split()
-                augtool(oper, key, "")
+        with augsession.transaction():
+            for line in ntpconf:
+                try:
+                    oper, key, value = line.split()
+                    augtool(oper, key, value)
+                except:
+                    oper, key = line.split()
+                    augtool(oper, key, "")
 
+            if OVIRT_VARS.has_key("OVIRT_NTP"):
+                offset=1
+                SERVERS = OVIRT_VARS["OVIRT_NTP"].split(",")
+                for server in SERVERS:
+                    if offset == 1:
+                        augtool("set", "/files/etc/ntp.conf/server[1]", server)
+                    elif offset == 2:
+                        augtool("set", "/files/etc/ntp.conf/server[2]", server)
+                    offset = offset + 1
         if OVIRT_VARS.has_key("OVIRT_NTP"):
-            offset=1
-            SERVERS = OVIRT_VARS["OVIRT_NTP"].split(",")
-            for server in SERVERS:
-                if offset == 1:
-                    augtool("set", "/files/etc/ntp.conf/server[1]", server)
-                elif offset == 2:
-                    augtool("set", "/files/etc/ntp.conf/server[2]", server)
-                offset = offset + 1
-            os.system("service ntpd stop &> /dev/null")
-            os.system("service ntpdate start &> /dev/null")
-            os.system("service ntpd start &> /dev/null")
+            system(["service", "ntpd", "stop"])
+            system(["service", "ntpdate", "start"])
+            system(["service", "ntpd", "start"])
 
     def save_network_configuration(self):
         aug.load()
         net_configured=0
         augtool_workdir_list = "ls %s/augtool-* >/dev/null"
         logger.info("Configuring network")
-        system("ifdown br" + self.CONFIGURED_NIC)
+        system(["ifdown", "br" + self.CONFIGURED_NIC])
         for vlan in os.listdir("/proc/net/vlan/"):
             # XXX wrong match e.g. eth10.1 with eth1
             if self.CONFIGURED_NIC in vlan:
-                os.system("vconfig rem " + vlan + "&> /dev/null")
+                system(["vconfig", "rem", vlan])
                 ovirt_safe_delete_config(self.IFSCRIPTS_PATH + vlan)
-                os.system("rm -rf " + self.IFSCRIPTS_PATH + vlan)
+                system(["rm", "-rf", self.IFSCRIPTS_PATH + vlan])
 
         for script in glob("%s%s*" % (self.IFSCRIPTS_PATH, self.CONFIGURED_NIC)):
             # XXX wrong match e.g. eth10 with eth1* (need * to cover VLANs)
             logger.debug("Removing Script: " + script)
             ovirt_safe_delete_config(script)
-        augtool("rm", self.IFCONFIG_FILE_ROOT+"br"+self.CONFIGURED_NIC, "")
-
-        for line in self.IF_CONFIG:
-            logger.debug(line)
-            try:
-                oper, key, value = line.split()
-                augtool(oper, key, value)
-            except:
-                oper, key = line.split()
-                augtool(oper, key, "")
+        with augsession.transaction() as txn:
+            augtool("rm", self.IFCONFIG_FILE_ROOT+"br"+self.CONFIGURED_NIC, "")
 
-        for line in self.BR_CONFIG:
-            logger.debug(line)
-            try:
-                oper, key, value = line.split()
-                augtool(oper, key, value)
-            except:
+            for line in self.IF_CONFIG:
+                logger.debug(line)
                 try:
+                    oper, key, value = line.split()
+                    augtool(oper, key, value)
+                except:
                     oper, key = line.split()
                     augtool(oper, key, "")
+
+            for line in self.BR_CONFIG:
+                logger.debug(line)
+                try:
+                    oper, key, value = line.split()
+                    augtool(oper, key, value)
                 except:
-                    pass
+                    try:
+                        oper, key = line.split()
+                        augtool(oper, key, "")
+                    except:
+                        pass
 
-        for line in self.VL_CONFIG.split("\n"):
-            logger.debug(line)
-            try:
-                oper, key, value = line.split()
-                augtool(oper, key, value)
-            except:
+            for line in self.VL_CONFIG.split("\n"):
+                logger.debug(line)
                 try:
-                    oper, key = line.split()
-                    augtool(oper, key, "")
+                    oper, key, value = line.split()
+                    augtool(oper, key, value)
                 except:
-                    pass
+                    try:
+                        oper, key = line.split()
+                        augtool(oper, key, "")
+                    except:
+                        pass
 
-        # preserve current MAC mappings for *all physical* network interfaces
-        for nicdev in glob('/sys/class/net/*/device'):
-            nic=nicdev.split('/')[4]
-            if nic != self.CONFIGURED_NIC:
-                f=open('/sys/class/net/%s/address' % nic)
-                mac=f.read().strip()
-                f.close()
-                if len(mac) > 0:
-                    self.CONFIGURED_NICS.append(nic)
-                    nicroot = "%s%s" % (self.IFCONFIG_FILE_ROOT, nic)
-                    # XXX augtool does save every time!
-                    augtool("set", "%s/DEVICE" % nicroot, nic)
-                    augtool("set", "%s/HWADDR" % nicroot, mac)
-                    augtool("set", "%s/ONBOOT" % nicroot, "no")
+            # preserve current MAC mappings for *all physical* network interfaces
+            for nicdev in glob('/sys/class/net/*/device'):
+                nic=nicdev.split('/')[4]
+                if nic != self.CONFIGURED_NIC:
+                    f=open('/sys/class/net/%s/address' % nic)
+                    mac=f.read().strip()
+                    f.close()
+                    if len(mac) > 0:
+                        self.CONFIGURED_NICS.append(nic)
+                        nicroot = "%s%s" % (self.IFCONFIG_FILE_ROOT, nic)
+                        augtool("set", "%s/DEVICE" % nicroot, nic)
+                        augtool("set", "%s/HWADDR" % nicroot, mac)
+                        augtool("set", "%s/ONBOOT" % nicroot, "no")
 
-        net_configured=1
-        for nic in self.CONFIGURED_NICS:
-            ovirt_store_config("%s%s" % (self.IFSCRIPTS_PATH, nic) )
-        ovirt_store_config(self.NTP_CONFIG_FILE)
-        augtool("set", "/files/etc/sysconfig/network/NETWORKING", "yes")
-        ovirt_store_config("/etc/sysconfig/network")
-        ovirt_store_config ("/etc/hosts")
+            net_configured=1
+            augtool("set", "/files/etc/sysconfig/network/NETWORKING", "yes")
+        persist = ["%s%s" % (self.IFSCRIPTS_PATH, nic) for nic in self.CONFIGURED_NICS]
+        persist.extend([self.NTP_CONFIG_FILE, "/etc/sysconfig/network", "/etc/hosts"])
+        # files already persisted only need storing again if rewritten
+        persist = [f for f in persist if f in txn.changed or not is_persisted(f)]
+        ovirt_store_config(persist)
         logger.info("Network configured successfully")
         if net_configured == 1:
             logger.info("Stopping Network services")
-            os.system("service network stop &> /dev/null")
-            os.system("service ntpd stop &> /dev/null")
+            system(["service", "network", "stop"])
+            system(["service", "ntpd", "stop"])
             # XXX eth assumed in breth
-            brctl_cmd = "brctl show|grep breth|awk '{print $1}'"
-            brctl = subprocess.Popen(brctl_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-            brctl_output = brctl.stdout.read()
-            for i in brctl_output.split():
-                if_down_cmd = "ifconfig %s down &> /dev/null" % i
-                os.system(if_down_cmd)
-                del_br_cmd = "brctl delbr %s &> /dev/null" % i
-                os.system(del_br_cmd)
+            brctl = process.run(["brctl", "show"])
+            for line in brctl.stdout.splitlines():
+                if "breth" not in line:
+                    continue
+                i = line.split()[0]
+                system(["ifconfig", i, "down"])
+                system(["brctl", "delbr", i])
             logger.info("Starting Network service")
-            os.system("service network start &> /dev/null")
-            os.system("service ntpdate start &> /dev/null")
-            os.system("service ntpd start &> /dev/null")
+            system(["service", "network", "start"])
+            system(["service", "ntpdate", "start"])
+            system(["service", "ntpd", "start"])
             # rhbz#745541
-            os.system("service rpcbind start &> /dev/null")
-            os.system("service nfslock start &> /dev/null")
-            os.system("service rpcidmapd start &> /dev/null")
-            os.system("service rpcgssd start &> /dev/null")
+            for service in ["rpcbind", "nfslock", "rpcidmapd", "rpcgssd"]:
+                system(["service", service, "start"])
             if OVIRT_VARS.has_key("NTP"):
                 logger.info("Testing NTP Configuration")
                 test_ntp_configuration()
@@ -349,9 +347,8 @@ def get_system_nics():
                         pci_dev = dev_path[3].replace("0000:","")
                     else:
                         pci_dev = dev_path[4].replace("0000:","")
-                    pci_lookup_cmd = " lspci|grep %s|awk -F \":\" {'print $3'}" % pci_dev
-                    pci_lookup = subprocess.Popen(pci_lookup_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-                    dev_vendor = pci_lookup.stdout.read().strip()
+                    pci_lookup = process.run(["lspci", "-s", pci_dev])
+                    dev_vendor = pci_lookup.stdout.split(":")[2].strip()
                 except:
                     dev_vendor = "unknown"
             try:
@@ -399,6 +396,7 @@ def get_system_nics():
                     ntp_dhcp = 1
     return nic_dict, configured_nics, ntp_dhcp
 
+@span("network_auto")
 def network_auto():
     try:
         network = Network()
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# nodeconfig.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""The node configuration, OVIRT_VARS.
+
+/etc/sysconfig/node-config holds the defaults and /etc/default/ovirt
+the values set on this node.  NodeConfig parses both, and parses them
+again only once one of them got replaced or modified, which is checked
+by comparing (st_ino, st_size, st_mtime) on access.
+
+NodeConfig is a dict, so existing code keeps using OVIRT_VARS[key] and
+has_key().  Values set in memory are kept until the files set the same
+key again.
+"""
+
+import os
+import logging
+import threading
+
+logger = logging.getLogger("ovirtnode.nodeconfig")
+
+NODE_SYSCONFIG = "/etc/sysconfig/node-config"
+OVIRT_DEFAULTS = "/etc/default/ovirt"
+
+TRUE_VALUES = ("1", "y", "yes", "true", "on")
+FALSE_VALUES = ("0", "n", "no", "false", "off")
+
+# multipliers to MB, the unit sizes are given in
+SIZE_UNITS = {"K": 1.0 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+
+
+def parse_sysconfig(path):
+    """Parses KEY="value" lines, as written to node-config."""
+    values = {}
+    f = open(path)
+    try:
+        for line in f:
+            try:
+                key, value = line.strip().split("\"", 1)
+            except ValueError:
+                continue
+            values[key.strip("=").strip()] = value.strip("\"")
+    finally:
+        f.close()
+    return values
+
+
+def parse_defaults_file(path):
+    """Parses KEY=value lines with optional quotes, as in
+    /etc/default/ovirt."""
+    values = {}
+    f = open(path)
+    try:
+        for line in f:
+            try:
+                key, value = line.strip().split("=", 1)
+            except ValueError:
+                continue
+            values[key.strip("=")] = value.strip("\"")
+    finally:
+        f.close()
+    return values
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+class NodeConfig(dict):
+    """Dict of the node configuration, refreshed from disk on access."""
+
+    def __init__(self, sysconfig=NODE_SYSCONFIG, defaults=OVIRT_DEFAULTS):
+        dict.__init__(self)
+        # later files override earlier ones
+        self._sources = [(sysconfig, parse_sysconfig, False),
+                         (defaults, parse_defaults_file, True)]
+        self._signatures = None
+        self._parsed = {}
+        self._callbacks = []
+        self._lock = threading.RLock()
+
+    def refresh(self, force=False):
+        """Parses the files again if one of them changed.  Returns True
+        if they were parsed."""
+        signatures = [_signature(path) for path, parse, required
+                      in self._sources]
+        self._lock.acquire()
+        try:
+            if not force and signatures == self._signatures:
+                return False
+            parsed = {}
+            for path, parse, required in self._sources:
+                try:
+                    parsed.update(parse(path))
+                except IOError:
+                    if required:
+                        raise
+            self._signatures = signatures
+            changes = []
+            for key in self._parsed:
+                if key not in parsed and dict.__contains__(self, key):
+                    changes.append((key, dict.__getitem__(self, key), None))
+                    dict.__delitem__(self, key)
+            for key, value in parsed.iteritems():
+                old = dict.get(self, key)
+                if old != value:
+                    changes.append((key, old, value))
+                dict.__setitem__(self, key, value)
+            self._parsed = parsed
+            callbacks = list(self._callbacks)
+        finally:
+            self._lock.release()
+        for key, old, new in changes:
+            for callback in callbacks:
+                try:
+                    callback(key, old, new)
+                except Exception, e:
+                    logger.warning("Config callback for %s failed: %s" %
+                                   (key, e))
+        return True
+
+    def on_change(self, callback):
+        """Calls callback(key, old, new) for every key a refresh changes.
+        A removed key has new None."""
+        self._callbacks.append(callback)
+
+    def get_bool(self, key, default=False):
+        value = self.get(key)
+        if value is None:
+            return default
+        value = value.strip().lower()
+        if value in TRUE_VALUES:
+            return True
+        if value in FALSE_VALUES:
+            return False
+        return default
+
+    def get_int(self, key, default=None):
+        try:
+            return int(self.get(key, "").strip())
+        except ValueError:
+            return default
+
+    def get_list(self, key, sep=",", default=None):
+        """Returns the non-empty items of a separated value."""
+        value = self.get(key)
+        if value is None:
+            return default
+        return [item.strip() for item in value.split(sep) if item.strip()]
+
+    def get_size(self, key, default=None):
+        """Returns a size in MB; values may carry a K, M, G or T suffix."""
+        value = self.get(key, "").strip().upper()
+        if value.endswith("B"):
+            value = value[:-1]
+        unit = 1
+        if value[-1:] in SIZE_UNITS:
+            unit = SIZE_UNITS[value[-1]]
+            value = value[:-1]
+        try:
+            return int(float(value) * unit)
+        except ValueError:
+            return default
+
+
+def _refreshing(name):
+    method = getattr(dict, name)
+    def wrapper(self, *args, **kwargs):
+        self.refresh()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ["__getitem__", "__setitem__", "__delitem__", "__contains__",
+              "__iter__", "__len__", "__repr__", "__eq__", "__ne__",
+              "get", "has_key", "keys", "values", "items", "iterkeys",
+              "itervalues", "iteritems", "copy", "pop", "popitem",
+              "setdefault", "update", "clear"]:
+    setattr(NodeConfig, _name, _refreshing(_name))
@@ -27,6 +27,7 @@ from ovirtnode.network import *
 from ovirtnode.log import *
 from ovirtnode.kdump import *
 from ovirtnode.snmp import *
+import ovirtnode.progress as progress
 
 def config_networking():
    # network configuration
@@ -34,7 +35,7 @@ def config_networking():
     if OVIRT_VARS["OVIRT_BOOTIF"] != "":
         network_auto()
     if OVIRT_VARS.has_key("OVIRT_HOSTNAME"):
-        system("hostname %s" % OVIRT_VARS["OVIRT_HOSTNAME"])
+        system(["hostname", OVIRT_VARS["OVIRT_HOSTNAME"]])
 
 # setup network before storage for iscsi installs
 if is_iscsi_install():
@@ -42,18 +43,20 @@ if is_iscsi_install():
 
 if not is_stateless():
     print "Performing automatic disk partitioning"
+    # phase and byte progress as plain lines, fit for serial consoles
+    progress.start(progress.AUTO_INSTALL)
+    progress.subscribe(progress.TextReporter())
 
     if storage_auto():
         print "Completed automatic disk partitioning"
         # store /etc/shadow if adminpw/rootpw are set, handled already in ovirt-early
-        file = open("/proc/cmdline")
-        args = file.read()
+        args = boot_context().cmdline
         if "adminpw" in args or "rootpw" in args:
             print "Storing /etc/shadow"
             ovirt_store_config("/etc/passwd")
             ovirt_store_config("/etc/shadow")
-        file.close()
     else:
+        progress.finish(False)
         config_networking()
         print "Automatic installation failed. Please review /tmp/ovirt.log"
         sys.exit(1)
@@ -65,7 +68,7 @@ if OVIRT_VARS.has_key("OVIRT_SSH_PWAUTH"):
         augtool("set","/files/etc/ssh/sshd_config/PasswordAuthentication", "yes")
     elif OVIRT_VARS["OVIRT_SSH_PWAUTH"] == "no":
         augtool("set","/files/etc/ssh/sshd_config/PasswordAuthentication", "no")
-    os.system("service sshd restart &> /dev/null")
+    system(["service", "sshd", "restart"])
 
 # iscsi handled in install.py
 print "Configuring Logging"
@@ -84,8 +87,10 @@ snmp_auto()
 if not is_stateless():
     print "Installing Bootloader"
     if install.ovirt_boot_setup():
+        progress.finish()
         print "Bootloader Installation Completed"
     else:
+        progress.finish(False)
         print "Bootloader Installation Failed"
         sys.exit(1)
     print "Installation and Configuration Completed"
@@ -21,6 +21,7 @@ from snack import *
 import ovirtnode.password as password
 from ovirtnode.install import *
 import ovirtnode.storage as storage
+import ovirtnode.progress as progress
 from ovirtnode.ovirtfunctions import *
 import _snack
 import traceback
@@ -51,6 +52,7 @@ PASSWORD_PAGE = 7
 UPGRADE_PAGE = 9
 FAILED_PAGE = 11
 FINISHED_PAGE = 13
+PROGRESS_WIDTH = 50
 current_password = ""
 
 def pam_conv(auth, query_list):
@@ -75,12 +77,19 @@ def tui_check_fakeraid(device, screen):
     else:
         return True
 
+# bus, device, size, description, serial and model of a
+# blockinventory.BlockDevice as shown on the disk pages
+def disk_details(disk):
+    if disk is None:
+        return ("", "", "", "", "", "")
+    return (disk.bus_label, disk.path, str(disk.size_gb), disk.description,
+            disk.serial or "", disk.model or "")
+
 class NodeInstallScreen:
     def __init__(self, colorset = None):
         self.__current_page = 1
         self.__finished = False
         self.ovirt_defaults_file = "/etc/default/ovirt"
-        OVIRT_VARS = parse_defaults()
         _console_colorset = {
                         "ROOT"          : ("gray",  "magenta"),
                         "BORDER"        : ("magenta", "magenta"),
@@ -371,7 +380,9 @@ class NodeInstallScreen:
         return [Label(""), elements]
 
     def failed_install_page(self):
-        os.system("cat " + OVIRT_TMP_LOGFILE + ">> " + OVIRT_LOGFILE)
+        if log_handler.path != OVIRT_LOGFILE:
+            log_handler.migrate(OVIRT_LOGFILE,
+                                lambda old: logbuffer.merge(old, OVIRT_LOGFILE))
         elements = Grid(2, 5)
         elements.setField(Label("%s Installation Failed " %
             PRODUCT_SHORT), 0, 0)
@@ -427,11 +438,10 @@ class NodeInstallScreen:
         elif self.__current_page == HOSTVG_STORAGE_PAGE:
             dev = self.hostvg_checkbox.getCurrent()
         if "Location" in dev or "NoDevices" in dev:
-            blank_entry = ",,,,,"
-            dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = blank_entry.split(",",5)
+            dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = disk_details(None)
         else:
             dev = translate_multipath_device(dev)
-            dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = self.disk_dict[dev].split(",",5)
+            dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = disk_details(self.disk_dict[dev])
         self.dev_bus_label.setText(dev_bus)
         dev_name = dev_name.replace(" ","")
         self.dev_name_label.setText(dev_name)
@@ -452,7 +462,7 @@ class NodeInstallScreen:
             dev = translate_multipath_device(dev)
             if not self.displayed_disks.has_key(dev):
                 if self.disk_dict.has_key(dev) and dev != self.live_disk:
-                    dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = self.disk_dict[dev].split(",",5)
+                    dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = disk_details(self.disk_dict[dev])
                     dev_desc = pad_or_trim(33, dev_desc)
                     self.valid_disks.append(dev_name)
                     dev_name = os.path.basename(dev_name).replace(" ", "")
@@ -464,12 +474,12 @@ class NodeInstallScreen:
                     self.displayed_disks[dev] = ""
         if len(self.valid_disks) == 0:
             self.root_disk_menu_list.append(" No Valid Install Devices Detected", "NoDevices")
-            self.disk_dict["NoDevices"] = ",,,,,"
-            dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = self.disk_dict["NoDevices"].split(",",5)
+            self.disk_dict["NoDevices"] = None
+            dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = disk_details(None)
         else:
-            dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = self.disk_dict[self.valid_disks[0]].split(",",5)
+            dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = disk_details(self.disk_dict[self.valid_disks[0]])
         self.root_disk_menu_list.append(" Other Device", "OtherDevice")
-        self.disk_dict["OtherDevice"] = ",,,,,"
+        self.disk_dict["OtherDevice"] = None
         elements.setField(Label("Please select the disk to use for booting %s"
             % PRODUCT_SHORT), 0,1, anchorLeft = 1)
         elements.setField(Label(" "), 0,2, anchorLeft = 1)
@@ -517,7 +527,7 @@ class NodeInstallScreen:
             dev = translate_multipath_device(dev)
             if not self.displayed_disks.has_key(dev) and dev != self.live_disk:
                 if self.disk_dict.has_key(dev):
-                    dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = self.disk_dict[dev].split(",",5)
+                    dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = disk_details(self.disk_dict[dev])
                     dev_desc = pad_or_trim(33, dev_desc)
                     if dev_name == self.root_disk_menu_list.current():
                         select_status = 1
@@ -546,7 +556,7 @@ class NodeInstallScreen:
         disk_grid.setField(Label("Size         "),0, 4, anchorLeft = 1)
         disk_grid.setField(Label("Description  "),0, 5, anchorLeft = 1)
         # get disk's info to prepopulate
-        dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = self.disk_dict[self.root_disk_menu_list.current()].split(",",5)
+        dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model = disk_details(self.disk_dict[self.root_disk_menu_list.current()])
         self.hostvg_checkbox.setCurrent(self.root_disk_menu_list.current())
         dev_name = dev_name.replace(" ", "")
         self.dev_name_label = Label(dev_name)
@@ -649,67 +659,77 @@ class NodeInstallScreen:
             return self.finish_install_page()
         return []
 
-    def install_node(self):
-        self.__current_page = FAILED_PAGE
-        gridform = GridForm(self.screen, "", 2, 3)
-        dev_name = self.storage_init.replace(" ","")
-        gridform.add(Label("Partitioning and Creating File Systems On"), 0, 0)
-        gridform.add(Label(dev_name), 0, 1)
-        progress_bar = Scale(50,100)
-        progress_bar.set(25)
-        gridform.add(progress_bar, 0, 2)
+    def show_progress(self, title, dev_name=None):
+        """Draws a progress bar and a status line following the
+        ovirtnode.progress events; returns the subscriber."""
+        gridform = GridForm(self.screen, "", 1, 4)
+        gridform.add(Label(title), 0, 0)
+        row = 1
+        if dev_name:
+            gridform.add(Label(dev_name), 0, row)
+            row = row + 1
+        progress_bar = Scale(PROGRESS_WIDTH, 100)
+        gridform.add(progress_bar, 0, row)
+        # the label keeps the width it is created with
+        status = Label(" " * PROGRESS_WIDTH)
+        gridform.add(status, 0, row + 1)
         gridform.draw()
         self.screen.refresh()
-        config_storage = storage.Storage()
-        storage_setup = config_storage.perform_partitioning()
-        if storage_setup:
-            progress_bar.set(50)
-            gridform = GridForm(self.screen, "", 2, 2)
-            gridform.add(Label("Setting Root Password"), 0, 0)
-            gridform.add(progress_bar, 0, 1)
+
+        def redraw(event):
+            progress_bar.set(event.percent)
+            text = progress.describe(event)[:PROGRESS_WIDTH]
+            status.setText(text.ljust(PROGRESS_WIDTH))
             gridform.draw()
             self.screen.refresh()
-            admin_pw_set = password.set_password(self.root_password_1.value(), "admin")
-            if admin_pw_set:
-                gridform.add(progress_bar, 0, 1)
-                gridform.draw()
-                self.screen.refresh()
-                progress_bar.set(75)
-                gridform = GridForm(self.screen, "", 2, 3)
-                gridform.add(Label("Installing Bootloader Configuration On "), 0, 0)
-                gridform.add(Label(dev_name), 0, 1)
-                gridform.add(progress_bar, 0, 2)
-                gridform.draw()
-                self.screen.refresh()
-                install = Install()
-                boot_setup = install.ovirt_boot_setup()
-                if boot_setup:
-                    progress_bar.set(100)
-                    self.__current_page = FINISHED_PAGE
+        subscriber = progress.Throttle(redraw, progress.redraw_interval())
+        progress.subscribe(subscriber)
+        return subscriber
+
+    def install_node(self):
+        self.__current_page = FAILED_PAGE
+        dev_name = self.storage_init.replace(" ","")
+        progress.start(progress.INSTALL)
+        subscriber = self.show_progress("Installing Hypervisor On", dev_name)
+        try:
+            config_storage = storage.Storage()
+            if not config_storage.perform_partitioning():
+                progress.finish(False)
+                return
+            progress.phase("password")
+            if not password.set_password(self.root_password_1.value(), "admin"):
+                progress.finish(False)
+                return
+            install = Install()
+            boot_setup = install.ovirt_boot_setup()
+            progress.finish(boot_setup)
+            if boot_setup:
+                self.__current_page = FINISHED_PAGE
+        finally:
+            progress.unsubscribe(subscriber)
 
     def upgrade_node(self):
-        gridform = GridForm(self.screen, "", 2, 2)
+        self.__current_page = FAILED_PAGE
+        progress.start(progress.UPGRADE)
         # can also cover downgrading/reinstalling so changed to "updating"
-        gridform.add(Label("Updating Hypervisor"), 0, 0, anchorLeft = 1)
-        progress_bar = Scale(50,100)
-        progress_bar.set(75)
-        gridform.add(progress_bar, 0, 1)
-        gridform.draw()
-        self.screen.refresh()
-        admin_pw_set = password.set_password(self.root_password_1.value(), "admin")
-        if admin_pw_set:
+        subscriber = self.show_progress("Updating Hypervisor")
+        try:
+            progress.phase("password")
+            if not password.set_password(self.root_password_1.value(), "admin"):
+                progress.finish(False)
+                return
             install = Install()
             boot_setup = install.ovirt_boot_setup()
-            progress_bar.set(100)
-            self.__current_page = FINISHED_PAGE
-            return
+            progress.finish(boot_setup)
+            if boot_setup:
+                self.__current_page = FINISHED_PAGE
+        finally:
+            progress.unsubscribe(subscriber)
 
     def start(self):
         self.set_console_colors()
         active = True
         while active and (self.__finished == False):
-            # reread defaults every refresh
-            OVIRT_VARS = parse_defaults()
             self.screen = SnackScreen()
             screen = self.screen
             for item in self.__colorset.keys():
@@ -67,8 +67,6 @@ NETWORK_DETAILS_PAGE = 19
 SUPPORT_PAGE = 21
 LOCKED_PAGE = 99
 
-OVIRT_VARS = parse_defaults()
-
 def pam_conv(auth, query_list):
     global login_password
     resp = []
@@ -604,12 +602,11 @@ class NodeConfigScreen():
             if network_up():
                 self.network_status = {}
                 status_text = ""
-                client = gudev.Client(['net'])
                 # reload augeas tree
                 aug.load()
-                for nic in client.query_by_subsystem("net"):
+                for link in rtnetlink.snapshot().links:
                     try:
-                        interface = nic.get_property("INTERFACE")
+                        interface = link.name
                         logger.debug(interface)
                         if not interface == "lo":
                             if has_ip_address(interface) or get_ipv6_address(interface):
@@ -636,10 +633,7 @@ class NodeConfigScreen():
                       dev_bootproto = augtool_get(cmd)
                       if dev_bootproto is None:
                           dev_bootproto = "Disabled"
-                    link_status_cmd = "ethtool %s|grep \"Link detected\"" % key
-                    link_status = subprocess.Popen(link_status_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-                    link_status = link_status.stdout.read()
-                    if not "yes" in link_status:
+                    if not link_detected(key):
                         ipv4_addr = "(Link Inactive)"
                     if ipv4_addr.strip() == "" and dev_bootproto.strip() == "dhcp":
                         if "Inactive" in ipv4_addr:
@@ -897,7 +891,7 @@ class NodeConfigScreen():
 
       def network_details_page(self,screen):
           grid = Grid(1,15)
-          if system("ethtool %s|grep \"Link detected\"|grep yes" % self.nic_lb.current()):
+          if link_detected(self.nic_lb.current()):
               link_status = "Active"
           else:
               link_status = "Inactive"
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# ovirt-profile - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+# Summarizes the SPAN lines and spawned commands in ovirt.log into a
+# per-phase breakdown of an install or configuration run.
+
+import os
+import re
+import sys
+import optparse
+
+from ovirtnode.spans import parse
+
+DEFAULT_LOGS = ["/tmp/ovirt.log", "/var/log/ovirt.log"]
+
+SPAWN_LINE = re.compile(r"spawned (.*) rc=(\S+) in ([0-9.]+)s$")
+
+
+def read_logs(paths):
+    spans = []
+    commands = {}
+    for path in paths:
+        try:
+            f = open(path)
+        except IOError, e:
+            print >> sys.stderr, "Unable to read %s: %s" % (path, e)
+            continue
+        for line in f:
+            line = line.rstrip("\n")
+            record = parse(line)
+            if record is not None:
+                spans.append(record)
+                continue
+            m = SPAWN_LINE.search(line)
+            if m:
+                # group by the program and its first argument,
+                # e.g. "udevadm settle" or "multipath -r"
+                key = " ".join(m.group(1).split()[:2])
+                duration = float(m.group(3))
+                count, total, longest = commands.get(key, (0, 0.0, 0.0))
+                commands[key] = (count + 1, total + duration,
+                                 max(longest, duration))
+        f.close()
+    spans.sort(key=lambda r: (r.get("pid"), r.get("start"), r.get("depth")))
+    return spans, commands
+
+
+def print_tree(spans):
+    print "%-44s %9s %7s %9s %-7s %s" % ("phase", "duration", "spawns",
+                                         "children", "outcome", "slowest child")
+    for r in spans:
+        name = "  " * r.get("depth", 0) + r["name"]
+        slowest = ""
+        if r.get("slowest"):
+            slowest = "%.1fs %s" % (r["slowest"][1], r["slowest"][0])
+        print "%-44s %8.1fs %7d %8.1fs %-7s %s" % (
+            name[:44], r["duration"], r["spawns"], r["child_time"],
+            r["outcome"], slowest[:60])
+
+
+def print_summary(spans):
+    totals = {}
+    for r in spans:
+        count, total, longest, failed = totals.get(r["name"], (0, 0.0, 0.0, 0))
+        if r["outcome"] != "ok":
+            failed = failed + 1
+        totals[r["name"]] = (count + 1, total + r["duration"],
+                             max(longest, r["duration"]), failed)
+    print "%-40s %6s %10s %9s %6s" % ("phase", "runs", "total", "max",
+                                      "failed")
+    items = totals.items()
+    items.sort(key=lambda i: -i[1][1])
+    for name, (count, total, longest, failed) in items:
+        print "%-40s %6d %9.1fs %8.1fs %6d" % (name[:40], count, total,
+                                               longest, failed)
+
+
+def print_commands(commands, top):
+    print "%-40s %6s %10s %9s" % ("command", "runs", "total", "max")
+    items = commands.items()
+    items.sort(key=lambda i: -i[1][1])
+    for key, (count, total, longest) in items[:top]:
+        print "%-40s %6d %9.1fs %8.1fs" % (key[:40], count, total, longest)
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] [ovirt.log ...]")
+    parser.add_option("-s", "--summary", action="store_true",
+                      help="totals per phase instead of every span")
+    parser.add_option("-c", "--commands", type="int", default=15,
+                      metavar="N",
+                      help="show the N most expensive commands [%default]")
+    (options, args) = parser.parse_args()
+    paths = args or [p for p in DEFAULT_LOGS if os.path.exists(p)]
+    spans, commands = read_logs(paths)
+    if not spans and not commands:
+        print "No timing data found in %s" % ", ".join(paths)
+        return 1
+    if options.summary:
+        print_summary(spans)
+    else:
+        print_tree(spans)
+    if options.commands > 0 and commands:
+        print
+        print_commands(commands, options.commands)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,20 +20,30 @@
 import subprocess
 from subprocess import Popen, PIPE, STDOUT
 import os
+import glob
 import tempfile
 import string
 import sys
-import augeas
 import socket
 import fcntl
 import struct
 import hashlib
 import shutil
 import re
-import gudev
-import cracklib
-import libvirt
 import logging
+import ovirtnode.process as process
+import ovirtnode.mounttab as mounttab
+import ovirtnode.persistence as persistence
+import ovirtnode.bootmount as bootmount
+import ovirtnode.digestcache as digestcache
+import ovirtnode.augsession as augsession
+import ovirtnode.nodeconfig as nodeconfig
+import ovirtnode.bootcontext as bootcontext
+import ovirtnode.logbuffer as logbuffer
+import ovirtnode.rtnetlink as rtnetlink
+import ovirtnode.blockinventory as blockinventory
+import ovirtnode.labelindex as labelindex
+import ovirtnode.diskwipe as diskwipe
 
 OVIRT_LOGFILE="/var/log/ovirt.log"
 OVIRT_TMP_LOGFILE="/tmp/ovirt.log"
@@ -45,53 +55,86 @@ OVIRT_LABEL="OVIRT"
 # 2. /etc/default/ovirt is loaded to override defaults with karg values
 NODE_SYSCONFIG="/etc/sysconfig/node-config"
 OVIRT_DEFAULTS="/etc/default/ovirt"
-aug = augeas.Augeas()
-#   workaround for bind-mounted files
-#   see https://fedorahosted.org/augeas/ticket/32
-aug.set("/augeas/save/copy_if_rename_fails", "")
+VERSION_FILE="/etc/default/version"
+
+# Expensive handles are created on first use, so importing this module
+# stays cheap for tools which only need a helper or two.
+
+class _LazyModule(object):
+    """Stands in for a module which is imported on first attribute access."""
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__["_module"] = __import__(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+augeas = _LazyModule("augeas")
+gudev = _LazyModule("gudev")
+cracklib = _LazyModule("cracklib")
+libvirt = _LazyModule("libvirt")
+
+def get_augeas():
+    """Returns the shared Augeas handle loading every lens, creating it on
+    first use.  Files known to augsession are edited through augtool()
+    and augtool_get(), which only load the files in play."""
+    return augsession.full()
+
+class _LazyAugeas(object):
+    """The module level aug, backed by get_augeas()."""
+
+    def load(self):
+        augsession.reload()
+
+    def __getattr__(self, attr):
+        return getattr(get_augeas(), attr)
+
+aug = _LazyAugeas()
 
 # read product / version info
-PRODUCT_SHORT = aug.get("/files/etc/default/version/PRODUCT_SHORT")
+def _read_version():
+    version = {}
+    try:
+        f = open(VERSION_FILE)
+    except IOError:
+        return version
+    for line in f:
+        if "=" in line and not line.lstrip().startswith("#"):
+            key, value = line.split("=", 1)
+            version[key.strip()] = value.strip()
+    f.close()
+    return version
+
+_version = _read_version()
+PRODUCT_SHORT = _version.get("PRODUCT_SHORT")
 if PRODUCT_SHORT == None:
     PRODUCT_SHORT = "oVirt"
 else:
     PRODUCT_SHORT = PRODUCT_SHORT.strip("'\"")
-PRODUCT_VERSION = aug.get("/files/etc/default/version/VERSION")
-PRODUCT_RELEASE = aug.get("/files/etc/default/version/RELEASE")
+PRODUCT_VERSION = _version.get("VERSION")
+PRODUCT_RELEASE = _version.get("RELEASE")
 
-OVIRT_VARS = {}
-# Parse all OVIRT_* variables
+OVIRT_VARS = nodeconfig.NodeConfig(NODE_SYSCONFIG, OVIRT_DEFAULTS)
+bootcontext.watch(OVIRT_VARS)
 
-def parse_defaults():
-    global OVIRT_VARS
-    if os.path.exists(NODE_SYSCONFIG):
-        try:
-            f = open(NODE_SYSCONFIG, 'r')
-            for line in f:
-                try:
-                    line = line.strip()
-                    key, value = line.split("\"", 1)
-                    key = key.strip("=")
-                    key = key.strip()
-                    value = value.strip("\"")
-                    OVIRT_VARS[key] = value
-                except:
-                    pass
-            f.close()
-        except:
-            pass
+def boot_context():
+    """Returns the BootContext the is_* helpers below read from."""
+    return bootcontext.current(OVIRT_VARS)
 
-    f = open(OVIRT_DEFAULTS, 'r')
-    for line in f:
-        try:
-            line = line.strip()
-            key, value = line.split("=", 1)
-            key = key.strip("=")
-            value = value.strip("\"")
-            OVIRT_VARS[key] = value
-        except:
-            pass
-    f.close()
+# Parse all OVIRT_* variables
+def parse_defaults():
+    """Returns OVIRT_VARS, re-read if the files changed.  OVIRT_VARS
+    refreshes itself on access, so callers can use it directly."""
+    OVIRT_VARS.refresh()
     return OVIRT_VARS
 
 
@@ -103,36 +146,37 @@ OVIRT_BACKUP_DIR="/var/lib/ovirt-backup"
 MANAGEMENT_SCRIPTS_DIR="/etc/node.d"
 
 def log(log_entry):
-    if is_stateless():
-        log_file = open(OVIRT_LOGFILE, "a")
-    elif is_firstboot():
-        log_file = open(OVIRT_TMP_LOGFILE, "a")
-    else:
-        log_file = open(OVIRT_LOGFILE, "a")
-    try: 
-        log_file.write(log_entry +"\n")
+    try:
+        log_handler.write(log_entry + "\n")
     except:
-        log_file.write(str(log_entry))
-    log_file.close()
+        log_handler.write(str(log_entry))
 
 def augtool(oper, key, value):
+    # inside augsession.transaction() edits are saved when it ends
+    txn = augsession.current()
+    if txn is not None:
+        session = txn
+    else:
+        session = augsession.for_path(key)
     if oper == "set":
-        aug.set(key, value)
-        aug.save()
+        session.set(key, value)
+        if txn is None:
+            session.save()
         return
     elif oper == "rm":
-        aug.remove(key)
-        aug.save()
+        session.remove(key)
+        if txn is None:
+            session.save()
         return
     elif oper == "get":
-        value = aug.get(key)
+        value = session.get(key)
         return value
     elif oper == "match":
-        value = aug.match(key)
+        value = session.match(key)
         return value
 
 def augtool_get(key):
-    value = aug.get(key)
+    value = augsession.for_path(key).get(key)
     return value
 # return 1 if oVirt Node is running in standalone mode
 # return 0 if oVirt Node is managed by the oVirt Server
@@ -152,10 +196,7 @@ def is_standalone(self):
 # return 0 if local storage is configured
 # return 1 if local storage is not configured
 def is_local_storage_configured():
-    ret = os.system("lvs HostVG/Config &>/dev/null")
-    if ret > 0:
-        return False
-    return True
+    return process.succeeds(["lvs", "HostVG/Config"])
 
 # perform automatic local disk installation
 # when at least following boot parameters are present:
@@ -180,22 +221,11 @@ def is_upgrade(self):
 # return 0 if booted from local disk
 # return 1 if booted from other media
 def is_booted_from_local_disk():
-    ret = os.system("grep -q LABEL=Root /proc/cmdline")
-    if ret == 0:
-        return True
-    else:
-        return False
+    return boot_context().booted_from_local_disk
 
+# rescue on the kernel command line, or runlevel 1/single
 def is_rescue_mode():
-    ret = os.system("grep -q rescue /proc/cmdline")
-    if ret == 0:
-        return True
-    # check for runlevel 1/single
-    else:
-        ret = os.system("runlevel|grep -q '1\|S'")
-        if ret == 0:
-            return True
-        return False
+    return boot_context().rescue
 
 def get_ttyname():
     for f in sys.stdin, sys.stdout, sys.stderr:
@@ -236,68 +266,47 @@ def manual_teardown():
 # was firstboot menu already shown?
 # state is stored in persistent config partition
 def is_firstboot():
-    # check if theres a key first
-    if OVIRT_VARS.has_key("OVIRT_FIRSTBOOT"):
-        if OVIRT_VARS["OVIRT_FIRSTBOOT"] == "1":
-            return True
-        elif OVIRT_VARS["OVIRT_FIRSTBOOT"] == "0":
-            return False
-    # in case there's no key, default to True unless booted from disk
-    if is_booted_from_local_disk():
-        return False
-    else:
-        return True
+    return boot_context().firstboot
 
 def is_cim_enabled():
-    # check if theres a key first
-    # reload OVIRT_VARS
-    OVIRT_VARS = parse_defaults()
-    if OVIRT_VARS.has_key("OVIRT_CIM_ENABLED"):
-        if OVIRT_VARS["OVIRT_CIM_ENABLED"] == "1":
-            return True
-        elif OVIRT_VARS["OVIRT_CIM_ENABLED"] == "0":
-            return False
-    return False
+    return OVIRT_VARS.get_bool("OVIRT_CIM_ENABLED")
 
 def is_stateless():
-    # check if theres a key first
-    if OVIRT_VARS.has_key("OVIRT_STATELESS"):
-        if OVIRT_VARS["OVIRT_STATELESS"] == "1":
-            return True
-        elif OVIRT_VARS["OVIRT_STATELESS"] == "0":
-            return False
-    return False
+    return boot_context().stateless
 
 def disable_firstboot():
-    if os.path.ismount("/config"):
-        aug.set("/files/etc/default/ovirt/OVIRT_FIRSTBOOT", "0")
-        aug.set("/files/etc/default/ovirt/OVIRT_INIT", '""')
-        aug.set("/files/etc/default/ovirt/OVIRT_UPGRADE", "0")
-        aug.save()
+    if mounttab.is_mounted("/config"):
+        defaults = augsession.session("defaults")
+        defaults.set("/files/etc/default/ovirt/OVIRT_FIRSTBOOT", "0")
+        defaults.set("/files/etc/default/ovirt/OVIRT_INIT", '""')
+        defaults.set("/files/etc/default/ovirt/OVIRT_UPGRADE", "0")
+        defaults.save()
         ovirt_store_config("/etc/default/ovirt")
 
 # Destroys a particular volume group and its logical volumes.
 # The input (vg) is accepted as either the vg_name or vg_uuid
 def wipe_volume_group(vg):
-    vg_name_cmd = "vgs -o vg_name,vg_uuid --noheadings 2>/dev/null | grep -w \"" + vg + "\" | awk '{print $1}'"
-    vg_name = subprocess.Popen(vg_name_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    vg = vg_name.stdout.read().strip()
-    files_cmd = "grep '%s' /proc/mounts|awk '{print $2}'|sort -r" % vg
-    files = subprocess.Popen(files_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    files_output = files.stdout.read()
-    for file in files_output.split():
-        os.system("umount %s &>/dev/null" % file)
-    swap_cmd = "grep '%s' /proc/swaps|awk '{print $1}'" % vg
-    swap = subprocess.Popen(swap_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    swap_output = swap.stdout.read().strip()
-    for d in swap_output.split():
-        os.system("swapoff %s &>/dev/null" % d)
-    system("vgchange -an %s" % vg)
-    vgremove_cmd = "vgremove -ff %s &>> %s" % (vg, OVIRT_TMP_LOGFILE)
-    ret = os.system(vgremove_cmd)
-    if ret != 0:
+    vgs = process.run(["vgs", "-o", "vg_name,vg_uuid", "--noheadings"])
+    for line in vgs.lines():
+        if vg in line.split():
+            vg = line.split()[0]
+            break
+    # LVs show up as /dev/VG/LV or /dev/mapper/VG-LV, "-" doubled in names
+    prefixes = ("/dev/%s/" % vg, "/dev/mapper/%s-" % vg.replace("-", "--"))
+    devs = set([e.dev() for e in mounttab.table.entries()
+                if e.source.startswith(prefixes)])
+    # unmount in reverse mount order, which also covers bind mounts
+    mounts = [e.target for e in mounttab.table.entries() if e.dev() in devs]
+    mounts.reverse()
+    for mount in mounts:
+        process.run(["umount", mount])
+    for line in read_file("/proc/swaps").splitlines():
+        if vg in line:
+            process.run(["swapoff", line.split()[0]])
+    system(["vgchange", "-an", vg])
+    if not system(["vgremove", "-ff", vg], OVIRT_TMP_LOGFILE):
         #retry one more time before failing
-        os.system(vgremove_cmd)
+        system(["vgremove", "-ff", vg], OVIRT_TMP_LOGFILE)
 
 # find_srv SERVICE PROTO
 #
@@ -306,22 +315,21 @@ def wipe_volume_group(vg):
 # Example usage:
 # find_srv ovirt tcp
 def find_srv(srv, proto):
-    domain = subprocess.Popen("dnsdomainname 2>/dev/null", shell=True, stdout=PIPE, stderr=STDOUT)
-    domain_output = domain.stdout.read()
+    domain_output = process.run(["dnsdomainname"]).stdout
     if domain_output == "localdomain":
         domain=""
     # FIXME dig +search does not seem to work with -t srv
     # dnsreply=$(dig +short +search -t srv _$1._$2)
     # This is workaround:
-    search = subprocess.Popen("grep search /etc/resolv.conf", shell=True, stdout=PIPE, stderr=STDOUT)
-    search_output = search.stdout.read()
+    search_output = "".join([line for line in
+                             read_file("/etc/resolv.conf").splitlines(True)
+                             if "search" in line])
     search = search_output.replace("search ","")
     domain_search = domain_output + search_output
     for d in domain_search.split():
-        dig_cmd = "dig +short -t srv _%s._%s.%s" % (srv, proto,search)
-        dig = subprocess.Popen(dig_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        dig_output = dig.stdout.read()
-        dig.poll()
+        dig_cmd = ["dig", "+short", "-t", "srv", "_%s._%s.%s" % (srv, proto,search)]
+        dig = process.run(dig_cmd, merge_stderr=True)
+        dig_output = dig.stdout
         dig_rc = dig.returncode
         if dig_rc == 0:
             try:
@@ -333,17 +341,21 @@ def find_srv(srv, proto):
 
 def ovirt_setup_libvirtd(self):
     # just to get a boot warning to shut up
-    os.system("touch /etc/resolv.conf")
+    open("/etc/resolv.conf", "a").close()
 
     # make libvirtd listen on the external interfaces
-    os.system("sed -i -e 's/^#\(LIBVIRTD_ARGS=\"--listen\"\).*/\1/' /etc/sysconfig/libvirtd")
+    system(["sed", "-i", "-e", 's/^#\\(LIBVIRTD_ARGS="--listen"\\).*/\\1/',
+            "/etc/sysconfig/libvirtd"])
 
     # set up qemu daemon to allow outside VNC connections
-    os.system("sed -i -e 's/^[[:space:]]*#[[:space:]]*\(vnc_listen = \"0.0.0.0\"\).*/\1/' /etc/libvirt/qemu.conf")
+    system(["sed", "-i", "-e",
+            's/^[[:space:]]*#[[:space:]]*\\(vnc_listen = "0.0.0.0"\\).*/\\1/',
+            "/etc/libvirt/qemu.conf"])
     # set up libvirtd to listen on TCP (for kerberos)
-    os.system('sed -i -e "s/^[[:space:]]*#[[:space:]]*\(listen_tcp\)\>.*/\1 = 1/" \
-       -e "s/^[[:space:]]*#[[:space:]]*\(listen_tls\)\>.*/\1 = 0/" \
-       /etc/libvirt/libvirtd.conf')
+    system(["sed", "-i",
+            "-e", "s/^[[:space:]]*#[[:space:]]*\\(listen_tcp\\)\\>.*/\\1 = 1/",
+            "-e", "s/^[[:space:]]*#[[:space:]]*\\(listen_tls\\)\\>.*/\\1 = 0/",
+            "/etc/libvirt/libvirtd.conf"])
 
 def ovirt_setup_anyterm():
    # configure anyterm
@@ -352,7 +364,7 @@ def ovirt_setup_anyterm():
    anyterm_conf.write("ANYTERM_LOCAL_ONLY=false")
    anyterm_conf.close()
    # permit it to run the virsh console
-   os.system("echo 'anyterm ALL=NOPASSWD: /usr/bin/virsh console *' >> /etc/sudoers")
+   append_file("/etc/sudoers", "anyterm ALL=NOPASSWD: /usr/bin/virsh console *\n")
 
 # mount livecd media
 # e.g. CD /dev/sr0, USB /dev/sda1,
@@ -360,33 +372,27 @@ def ovirt_setup_anyterm():
 # not available when booted from local disk installation
 def mount_live():
     live_dev = ""
-    if system('cat /proc/mounts|grep -q "none /live"'):
-        system("umount /live")
+    live = mounttab.table.by_target("/live")
+    if live is not None and live.source == "none":
+        system(["umount", "/live"])
     if not os.path.exists("/dev/live"):
-        if system("losetup /dev/loop0|grep -q '\.iso'"):
+        if ".iso" in process.output(["losetup", "/dev/loop0"]):
             # PXE boot
             live_dev="/dev/loop0"
         else:
             # /dev/live if not exist alternative
-            client = gudev.Client(['block'])
-            version = open("/etc/default/version")
-            for line in version.readlines():
-                if "PACKAGE" in line:
-                    pkg, pkg_name = line.split("=")
-            for device in client.query_by_subsystem("block"):
-                if device.has_property("ID_CDROM"):
-                    dev = device.get_property("DEVNAME")
-                    if system("blkid '%s'|grep -q '%s'" % (dev, pkg_name)):
-                        live_dev = dev
+            live_cdrom = find_live_cdrom()
+            if live_cdrom is not None:
+                live_dev = live_cdrom.path
             if not live_dev:
                 # usb devices with LIVE label
                 live_dev = findfs("LIVE")
     else:
         live_dev="/dev/live"
 
-    os.system("mkdir -p /live")
-    os.system("mount -r " + live_dev + " /live &>/dev/null")
-    if os.path.ismount("/live"):
+    makedirs("/live")
+    system(["mount", "-r", live_dev, "/live"])
+    if mounttab.is_mounted("/live"):
         return True
     else:
         return False
@@ -394,17 +400,18 @@ def mount_live():
 # mount root partition
 # boot loader + kernel + initrd + LiveOS
 def mount_liveos():
-    if os.path.ismount("/liveos"):
+    if mounttab.is_mounted("/liveos"):
         return True
     else:
-        os.system("mkdir -p /liveos")
-        if not system("mount LABEL=Root /liveos"):
+        makedirs("/liveos")
+        if not system(["mount", "LABEL=Root", "/liveos"]):
             # just in case /dev/disk/by-label is not using devmapper and fails
             for dev in os.listdir("/dev/mapper"):
-                if system("e2label \"/dev/mapper/" + dev + "\" 2>/dev/null|grep Root|grep -v Backup"):
-                    system("rm -rf /dev/disk/by-label/Root")
-                    system("ln -s \"/dev/mapper/" + dev + "\" /dev/disk/by-label/Root")
-                    if system("mount LABEL=Root /liveos"):
+                label = process.output(["e2label", "/dev/mapper/" + dev])
+                if "Root" in label and not "Backup" in label:
+                    system(["rm", "-rf", "/dev/disk/by-label/Root"])
+                    system(["ln", "-s", "/dev/mapper/" + dev, "/dev/disk/by-label/Root"])
+                    if system(["mount", "LABEL=Root", "/liveos"]):
                         return True
         else:
             return True
@@ -414,59 +421,38 @@ def mount_liveos():
 def mount_config():
     # Only try to mount /config if the persistent storage exists
     if os.path.exists("/dev/HostVG/Config"):
-        os.system("mkdir -p /config")
-        if not os.path.ismount("/config"):
-            ret = os.system("mount /dev/HostVG/Config /config")
-            if ret > 0:
+        makedirs("/config")
+        if not mounttab.is_mounted("/config"):
+            if not system(["mount", "/dev/HostVG/Config", "/config"]):
                 return False
 
         # optional config embedded in the livecd image
-        if os.path.exists("/live/config"):
-            os.system("cp -rv --update /live/config/* /config")
-
+        bootmount.sync_live_config()
         # bind mount all persisted configs to rootfs
-        filelist_cmd = "find /config -type f"
-        filelist = subprocess.Popen(filelist_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        filelist = filelist.stdout.read()
-        for f in filelist.split():
-            logger.debug("Bind Mounting: " + f)
-            if os.path.isfile(f) and f != "/config/files":
-                target = string.replace(f, "/config", "")
-                mounted_cmd = "grep -q " + target + " /proc/mounts"
-                mounted = os.system(mounted_cmd)
-                if mounted == 0:
-                    # skip if already bind-mounted
-                    pass
-                else:
-                    dirname = os.path.dirname(target)
-                    os.system("mkdir -p '%s'" % dirname)
-                    os.system("touch '%s'" % target)
-                    os.system("mount -n --bind '%s' '%s'" % (f,target))
+        bootmount.bind_config()
         return True
     else:
         # /config is not available
         return False
 
 def mount_boot(self):
-    if os.path.ismount("/boot"):
+    if mounttab.is_mounted("/boot"):
        return
     else:
-        os.system("mkdir -p /boot")
-        os.system("mount LABEL=Boot /boot")
+        makedirs("/boot")
+        system(["mount", "LABEL=Boot", "/boot"])
 
 # stop any service which keeps /var/log busy
 # keep the list of services
 def unmount_logging_services():
     # mapping command->service is lame, but works for most initscripts
     logging_services= []
-    prgs_cmd = "cd /etc/init.d|lsof -Fc +D /var/log|grep ^c|sort -u"
-    prgs = subprocess.Popen(prgs_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    prgs_output = prgs.stdout.read()
-    for prg in prgs_output.split():
+    prgs = process.run(["lsof", "-Fc", "+D", "/var/log"], cwd="/etc/init.d")
+    prgs_output = sorted(set([prg for prg in prgs.lines() if prg.startswith("c")]))
+    for prg in prgs_output:
         svc = prg = prg[1:]
-        ret = os.system("service " + svc +" stop &>/dev/null")
-        if ret != 0:
-            os.system("pkill " + svc)
+        if not process.succeeds(["service", svc, "stop"]):
+            process.run(["pkill", svc])
         logging_services.append(svc)
     return logging_services
     # debugging help
@@ -475,26 +461,39 @@ def unmount_logging_services():
 # mount logging partition
 # this only gets executed when disk is re-partitioned, HostVG/Logging is empty
 def mount_logging():
-    if os.path.ismount("/var/log"):
+    if mounttab.is_mounted("/var/log"):
         return True
     if os.path.exists("/dev/HostVG/Logging"):
         logger.info("Mounting log partition")
         # temporary mount-point
         log2 = tempfile.mkdtemp()
-        os.system("mount /dev/HostVG/Logging " + log2)
+        system(["mount", "/dev/HostVG/Logging", log2])
         logging_services = unmount_logging_services()
-        # save logs from tmpfs
-        os.system("cp -av /var/log/* " + log2 + " &>/dev/null")
-        # save temporary log
-        if os.path.exists("/tmp/ovirt.log"):
-            os.system("cp /tmp/ovirt.log " + log2 +"/ovirt.log-tmp &>> /tmp/ovirt.log")
-        os.system("mount --move " + log2 + " /var/log")
-        shutil.rmtree(log2)
-        os.system("restorecon -rv /var/log &>/dev/null")
+        def move_logs(old_log):
+            # save logs from tmpfs
+            logs = glob.glob("/var/log/*")
+            if logs:
+                process.run(["cp", "-av"] + logs + [log2])
+            if not system(["mount", "--move", log2, "/var/log"]):
+                raise OSError("Unable to move %s to /var/log" % log2)
+            # save temporary log, only once it has a place to go
+            if old_log != OVIRT_LOGFILE:
+                logbuffer.merge(old_log, OVIRT_LOGFILE)
+        try:
+            log_handler.migrate(OVIRT_LOGFILE, move_logs)
+        except (IOError, OSError), e:
+            logger.error("Moving logs to the log partition failed: %s" % e)
+        # if the move failed the LV is still mounted on log2, keep its
+        # contents and only remove the directory once nothing is on it
+        if mounttab.is_mounted(log2) and not system(["umount", log2]):
+            logger.error("Unable to unmount %s, leaving it in place" % log2)
+        else:
+            shutil.rmtree(log2, True)
+        process.run(["restorecon", "-rv", "/var/log"])
         for srv in logging_services:
-            os.system("service " + srv + " start &>/dev/null")
+            process.run(["service", srv, "start"])
         # make sure rsyslog restarts
-        os.system("service rsyslog start &>/dev/null")
+        process.run(["service", "rsyslog", "start"])
         return
     else:
         # /var/log is not available
@@ -502,40 +501,38 @@ def mount_logging():
         return False
 
 def unmount_logging():
-    if not os.path.ismount("/var/log"):
+    if not mounttab.is_mounted("/var/log"):
         return True
     logger.info("Unmounting log partition")
     # plymouthd keeps /var/log/boot.log
-    ret = os.system("plymouth --ping")
-    if ret == 0:
-        os.system("plymouth --quit")
+    if process.succeeds(["plymouth", "--ping"]):
+        process.run(["plymouth", "--quit"])
     logging_services = unmount_logging_services()
 
-    ret = os.system("umount /var/log &>/dev/null")
+    ret = process.run(["umount", "/var/log"]).returncode
     if ret > 0:
         return ret
     for srv in logging_services:
-        os.system("service " + srv + " start &> /dev/null")
+        process.run(["service", srv, "start"])
     return
 
 # mount data partition
 def mount_data():
-    if os.path.ismount("/data"):
+    if mounttab.is_mounted("/data"):
         return
 
     if os.path.exists("/dev/HostVG/Data"):
-        os.system("mkdir -p /data")
-        os.system("mount /data")
-        os.system("mkdir -p /data/images")
-        os.system("mkdir -p /data/images/rhev")
-        os.system("chown 36:36 /data/images/rhev")
-        os.system("mkdir -p /var/lib/libvirt/images")
-        os.system("mount /var/lib/libvirt/images")
-        os.system("restorecon -rv /var/lib/libvirt/images &>/dev/null")
-        os.system("mkdir -p /data/core")
-        os.system("mkdir -p /var/log/core")
-        os.system("mount /var/log/core")
-        os.system("restorecon -rv /var/log/core &>/dev/null")
+        makedirs("/data")
+        system(["mount", "/data"])
+        makedirs("/data/images/rhev")
+        os.chown("/data/images/rhev", 36, 36)
+        makedirs("/var/lib/libvirt/images")
+        system(["mount", "/var/lib/libvirt/images"])
+        process.run(["restorecon", "-rv", "/var/lib/libvirt/images"])
+        makedirs("/data/core")
+        makedirs("/var/log/core")
+        system(["mount", "/var/log/core"])
+        process.run(["restorecon", "-rv", "/var/log/core"])
         return
     else:
         # /data is not available
@@ -543,14 +540,14 @@ def mount_data():
         return False
 
 def mount_data2():
-    if os.path.ismount("/data2"):
+    if mounttab.is_mounted("/data2"):
         return True
 
     if os.path.exists("/dev/AppVG/Data2"):
-        system("mkdir -p /data2")
-        system("mount /data2")
+        makedirs("/data2")
+        system(["mount", "/data2"])
 
-    if os.path.ismount("/data2"):
+    if mounttab.is_mounted("/data2"):
         return True
     else:
         # /data2 is not available
@@ -558,13 +555,7 @@ def mount_data2():
         return False
 
 def md5sum(filename):
-    m = hashlib.md5()
-    with open(filename) as f:
-        data = f.read(4096)
-        while data:
-            m.update(data)
-            data = f.read(4096)
-        return m.hexdigest()
+    return digestcache.file_digest(filename)
 
 
 STRING_TYPE=(str,unicode)
@@ -573,74 +564,15 @@ STRING_TYPE=(str,unicode)
 #   copy to /config and bind-mount back
 
 def ovirt_store_config(files):
-  if is_stateless():
-      return True
-  if not os.path.ismount("/config"):
-    logger.error("/config is not mounted")
-    return False
-  if isinstance(files,STRING_TYPE):
-    files_list = []
-    files_list.append(files)
-  else:
-    files_list=files
-  for f in files_list:
-    filename = os.path.abspath(f)
-    persist_it=True
-    # ensure that, if this is a directory
-    # that it's not already persisted
-    if os.path.isdir(filename):
-        if os.path.isdir("/config/" + filename):
-            logger.warn("Directory already persisted: " + filename)
-            logger.warn("You need to unpersist its child directories and/or files and try again.")
-            persist_it=False
-            rc = 0
-
-    # if it's a file then make sure it's not already persisted
-    if os.path.isfile(filename):
-        if os.path.isfile("/config/" + filename):
-            md5root=md5sum(filename)
-            md5stored=md5sum("/config" + filename)
-            if md5root == md5stored:
-                logger.warn("File already persisted: " + filename)
-                persist_it=False
-                rc = 0
-            else:
-                # persistent copy needs refresh
-                if system("umount -n " + filename + " 2> /dev/null"):
-                    system("rm -f /config"+ filename)
-    if persist_it:
-        # skip if file does not exist
-        if not os.path.exists(filename):
-            logger.warn("Skipping, file: " + filename + " does not exist")
-        # skip if already bind-mounted
-        if not check_bind_mount(filename):
-            dirname = os.path.dirname(filename)
-            system("mkdir -p /config/" + dirname)
-            if system("cp -a " + filename + " /config"+filename):
-                if not system("mount -n --bind /config"+filename+ " "+filename):
-                    logger.error("Failed to persist: " + filename)
-                    rc = 1
-                else:
-                    logger.info("File: " + filename + " persisted")
-                    rc = True
-        # register in /config/files used by rc.sysinit
-        ret = os.system("grep -q \"^$" + filename +"$\" /config/files 2> /dev/null")
-        if ret > 0:
-            os.system("echo "+filename+" >> /config/files")
-            logger.info("Successfully persisted: " + filename)
-            rc = 0
-    else:
-        logger.warn(filename + " Already persisted")
-        rc = 0
-    if rc == 0:
+    if is_stateless():
         return True
+    if not mounttab.is_mounted("/config"):
+        logger.error("/config is not mounted")
+        return False
+    return persistence.store_configs(files)
 
 def is_persisted(filename):
-    abspath = os.path.abspath(filename)
-    if os.path.exists("/config" + abspath):
-        return True
-    else:
-        return False
+    return persistence.is_persisted(filename)
 
 # unmount bindmounted config files
 #       unmount_config /etc/config /etc/config2 ...
@@ -651,28 +583,11 @@ def is_persisted(filename):
 #
 
 def check_bind_mount(config_file):
-    bind_mount_cmd = 'grep -q "%s ext4" /proc/mounts' % config_file
-    if os.system(bind_mount_cmd) == 0:
-        return True
-    else:
-        return False
+    return persistence.index.is_mounted(config_file)
 
 def unmount_config(files):
-    if os.path.ismount("/config"):
-      if isinstance(files,STRING_TYPE):
-        files_list = []
-        files_list.append(files)
-      else:
-        files_list=files
-      for f in files_list:
-        filename = os.path.abspath(f)
-        if check_bind_mount(filename):
-            ret = os.system('umount -n "%s" &>/dev/null' % filename)
-            if ret == 0:
-                if os.path.exists('/config%s' % filename):
-                    # refresh the file in rootfs if it was mounted over
-                    if os.system('cp -a /config"%s" "%s" &> /dev/null' % (filename,filename)):
-                        return True
+    if mounttab.is_mounted("/config"):
+        return persistence.index.unmount(files)
 
 # remove persistent config files
 #       remove_config /etc/config /etc/config2 ...
@@ -682,47 +597,11 @@ def remove_config(files):
         return True
     # if there are no persisted files then just exit
     if os.path.exists("/config/files"):
-        if os.path.getsize('/config/files') == 0:
+        if len(persistence.index.registered()) == 0:
             print "There are currently no persisted files."
             return True
-    if os.path.ismount("/config"):
-      if isinstance(files,STRING_TYPE):
-        files_list = []
-        files_list.append(files)
-      else:
-        files_list=files
-      for f in files_list:
-            filename = os.path.abspath(f)
-            ret = os.system('grep "^%s$" /config/files > /dev/null 2>&1' % filename)
-            if ret == 0:
-                if check_bind_mount(filename):
-                    ret = os.system('umount -n "%s" &>/dev/null' % filename)
-                    if ret == 0:
-                        if os.path.isdir(filename):
-                            ret = os.system('cp -ar /config/"%s"/* "%s"' % (filename,filename))
-                            if ret > 0:
-                                logger.error(" Failed to unpersist %s" % filename)
-                                return False
-                            else:
-                                logger.info("%s successully unpersisted" % filename)
-                                return True
-                        else:
-                            if os.path.isfile(filename):
-                                # refresh the file in rootfs if it was mounted over
-                               ret = os.system('cp -a /config"%s" "%s"' % (filename,filename))
-                               if ret > 0:
-                                    logger.error("Failed to unpersist %s" % filename)
-                                    return False
-                               else:
-                                   logger.info("%s successully unpersisted" % filename)
-                    # clean up the persistent store
-                    os.system('rm -Rf /config"%s"' % filename)
-                    # unregister in /config/files used by rc.sysinit
-                    os.system('sed --copy -i "\|^%s$|d" /config/files' % filename)
-                else:
-                    logger.warn("%s is not a persisted file." % filename)
-            else:
-                logger.warn("File not explicitly persisted: %s" % filename)
+    if mounttab.is_mounted("/config"):
+        return persistence.index.remove(files)
 
 # ovirt_safe_delete_config
 #       ovirt_safe_delete_config /etc/config /etc/config2 ...
@@ -739,35 +618,32 @@ def ovirt_safe_delete_config(files):
     for f in files_list:
         filename = os.path.abspath(f)
         if check_bind_mount(filename):
-            os.system('umount -n "%s" &>/dev/null' % filename)
+            process.run(["umount", "-n", filename])
 
-        os.system('sed --copy -i "\|%s$|d" /config/files' % filename)
+        unregister_config(filename, suffix_match=True)
 
         if os.path.isdir(filename):
-            for child in subprocess.Popen("ls -d '%s'" % filename, shell=True, stdout=PIPE, stderr=STDOUT).stdout.read():
-                ovirt_safe_delete_config(child)
-            os.system("rm -rf /config'%s'" % filename)
-            os.system("rm -rf '%s'" % filename)
+            for child in os.listdir(filename):
+                ovirt_safe_delete_config(os.path.join(filename, child))
+            process.run(["rm", "-rf", "/config" + filename])
+            process.run(["rm", "-rf", filename])
         else:
-            os.system("shred -u /config'%s'" % filename)
-            os.system("shred -u '%s'" % filename)
+            process.run(["shred", "-u", "/config" + filename])
+            process.run(["shred", "-u", filename])
+
+# unregister persisted files in /config/files used by rc.sysinit
+def unregister_config(filename, suffix_match=False):
+    persistence.index.unregister(filename, suffix_match)
 
 
 # compat function to handle different udev versions
 def udev_info(name, query):
     # old udev command with shortopts
-    udev_cmd = "udevadm info -n %s -q %s" % (name, query)
-    udev = subprocess.Popen(udev_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    udev_output = udev.stdout.read()
-    udev.poll()
-    udev_rc = udev.returncode
-    if udev_rc > 0:
-        udev_cmd = "udevadm info --name=%s --query=%s" % (name, query)
-        udev = subprocess.Popen(udev_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        udev_output = udev.stdout.read()
-        udev.poll()
-        udev_rc = udev.returncode
-    return udev_output
+    udev = process.run(["udevadm", "info", "-n", name, "-q", query], merge_stderr=True)
+    if udev.returncode > 0:
+        udev = process.run(["udevadm", "info", "--name=%s" % name, "--query=%s" % query],
+                           merge_stderr=True)
+    return udev.stdout
 
 def get_live_disk():
     live_disk=""
@@ -780,28 +656,41 @@ def get_live_disk():
         if "block" in live_disk:
             live_disk = os.path.basename(udev_info("/dev/disk/by-label/LIVE","path")).strip()
     else:
-        ret = os.system("losetup /dev/loop0|grep -q '\.iso'")
-        if ret != 0:
-            client = gudev.Client(['block'])
-            version = open("/etc/default/version")
-            for line in version.readlines():
-                if "PACKAGE" in line:
-                    pkg, pkg_name = line.split("=")
-            for device in client.query_by_subsystem("block"):
-                if device.has_property("ID_CDROM"):
-                    dev = device.get_property("DEVNAME")
-                    blkid_cmd = "blkid '%s'|grep -q '%s' " % (dev, pkg_name)
-                    ret = os.system(blkid_cmd)
-                    if ret == 0:
-                        live_disk = os.path.basename(dev)
+        if not ".iso" in process.output(["losetup", "/dev/loop0"]):
+            live_cdrom = find_live_cdrom()
+            if live_cdrom is not None:
+                live_disk = live_cdrom.name
     return live_disk
 
+# returns the CD-ROM whose iso9660 label carries the PACKAGE name of
+# /etc/default/version, or None
+def find_live_cdrom():
+    pkg_name = None
+    version = open("/etc/default/version")
+    for line in version.readlines():
+        if "PACKAGE" in line:
+            pkg, pkg_name = line.split("=")
+            pkg_name = pkg_name.strip()
+    version.close()
+    if not pkg_name:
+        return None
+    for device in blockinventory.current():
+        if not device.cdrom or device.size == 0:
+            continue
+        try:
+            found = labelindex.probe(device.path)
+        except OSError:
+            continue
+        if found is not None and found[1] and pkg_name in found[1]:
+            return device
+    return None
+
 def backup_file(self, file):
     dir = os.path.dirname(file)
     if dir in os.listdir("/"):
         print "unexpected non-absolute dir: %s" % dir
         sys.exit(1)
-    os.system("mkdir -p '%s%s'") % (OVIRT_BACKUP_DIR, dir)
+    makedirs(OVIRT_BACKUP_DIR + dir)
     if os.path.exists(file):
         shutil.copy(file, OVIRT_BACKUP_DIR + file)
     #test -f "$1" && cp -pf "$1" "$OVIRT_BACKUP_DIR/${dir:1}"
@@ -823,12 +712,9 @@ def finish_install():
         # setup new Root if update is prepared
         root_update_dev = findfs("RootUpdate")
         root_dev = findfs("Root")
-        e2label_rootbackup_cmd = "e2label '%s' RootBackup" % root_dev
-        e2label_root_cmd = "e2label '%s' Root" % root_update_dev
-        logger.debug(e2label_rootbackup_cmd)
-        logger.debug(e2label_root_cmd)
-        subprocess.Popen(e2label_rootbackup_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        subprocess.Popen(e2label_root_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
+        system(["e2label", root_dev, "RootBackup"])
+        system(["e2label", root_update_dev, "Root"])
+        labelindex.invalidate()
     # run post-install hooks
     # e.g. to avoid reboot loops using Cobbler PXE only once
     # Cobbler XMLRPC post-install trigger (XXX is there cobbler SRV record?):
@@ -836,12 +722,14 @@ def finish_install():
     #   -O /dev/null
     hookdir="/etc/ovirt-config-boot.d"
     for hook in os.listdir(hookdir):
-        os.system(os.path.join(hookdir,hook))
+        system([os.path.join(hookdir,hook)])
+    persist = []
     for f in ["/etc/ssh/ssh_host%s_key" % t for t in ["", "_dsa", "_rsa"]]:
-        ovirt_store_config(f)
-        ovirt_store_config("%s.pub" % f)
+        persist.append(f)
+        persist.append("%s.pub" % f)
     # store keyboard config
-    ovirt_store_config("/etc/sysconfig/keyboard")
+    persist.append("/etc/sysconfig/keyboard")
+    ovirt_store_config(persist)
     return True
 
 def is_valid_ipv4(ip_address):
@@ -928,63 +816,48 @@ def is_valid_iqn(iqn):
 
 # Check if networking is already up
 def network_up():
-    ret = os.system("ip addr show | grep -q 'inet.*scope global'")
-    if ret == 0:
-        return True
-    return False
+    return rtnetlink.snapshot().has_global_address()
+
+def _first_address(ifname, family):
+    addresses = rtnetlink.snapshot().addresses_of(ifname, family)
+    if addresses:
+        return addresses[0]
+    return None
 
 def get_ip_address(ifname):
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        ip = socket.inet_ntoa(fcntl.ioctl(
-            s.fileno(),
-            0x8915,  # SIOCGIFADDR
-            struct.pack('256s', ifname[:15])
-        )[20:24])
-    except:
-        ip = ""
-    return ip
+    address = _first_address(ifname, socket.AF_INET)
+    if address is None:
+        return ""
+    return address.address
 
 def get_netmask(ifname):
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        netmask = fcntl.ioctl(s, 0x891b, struct.pack('256s', ifname))[20:24]
-        netmask = socket.inet_ntoa(netmask)
-    except:
-        netmask = ""
-    return netmask
+    address = _first_address(ifname, socket.AF_INET)
+    if address is None:
+        return ""
+    return address.netmask
 
 def get_gateway(ifname):
-    cmd = "ip route list dev "+ ifname + " | awk ' /^default/ {print $3}'"
-    result = subprocess.Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    result = result.stdout.read().strip()
-    return result
+    return "\n".join(rtnetlink.snapshot().default_gateways(ifname))
 
 def get_ipv6_address(interface):
-    inet6_lookup_cmd = "ip addr show dev %s | awk '$1==\"inet6\" && $4==\"global\" { print $2 }'" % interface
-    inet6_lookup = subprocess.Popen(inet6_lookup_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    ipv6_addr = inet6_lookup.stdout.read().strip()
-    try:
-        ip, netmask = ipv6_addr.split("/")
-        return (ip,netmask)
-    except:
-        logger.debug("unable to determine ip/netmask from: " + ipv6_addr)
+    addresses = rtnetlink.snapshot().addresses_of(interface, socket.AF_INET6,
+                                                  rtnetlink.RT_SCOPE_UNIVERSE)
+    if len(addresses) == 1:
+        return (addresses[0].address, str(addresses[0].prefixlen))
+    logger.debug("unable to determine ip/netmask from: %s" % addresses)
     return False
 
 def get_ipv6_gateway(ifname):
-    cmd = "ip route list dev "+ ifname + " | awk ' /^default/ {print $3}'"
-    result = subprocess.Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    result = result.stdout.read().strip()
-    return result
+    return "\n".join(rtnetlink.snapshot().default_gateways(ifname,
+                                                           socket.AF_INET6))
 
 def has_ip_address(ifname):
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        ip = socket.inet_ntoa(fcntl.ioctl(s.fileno(),
-            0x8915, struct.pack('256s', ifname[:15]))[20:24])
-        return True
-    except IOError:
-        return False
+    return _first_address(ifname, socket.AF_INET) is not None
+
+# same as "Link detected" of ethtool
+def link_detected(ifname):
+    link = rtnetlink.snapshot().link(ifname)
+    return link is not None and link.carrier
 
 def is_valid_port(port_number):
     regex = "^(6553[0-5]|655[0-2]\d|65[0-4]\d\d|6[0-4]\d{3}|[1-5]\d{4}|[1-9]\d{0,3}|0)$"
@@ -993,62 +866,42 @@ def is_valid_port(port_number):
     else:
         return False
 
-# Cleans partition tables
-def wipe_partitions(drive):
-    logger.info("Wiping old boot sector")
-    os.system("dd if=/dev/zero of=\""+ drive +"\" bs=1024K count=1 &>>" + OVIRT_TMP_LOGFILE)
-    # zero out the GPT secondary header
-    logger.info("Wiping secondary gpt header")
-    disk_kb = subprocess.Popen("sfdisk -s \""+ drive +"\" 2>/dev/null", shell=True, stdout=PIPE, stderr=STDOUT)
-    disk_kb_count = disk_kb.stdout.read()
-    os.system("dd if=/dev/zero of=\"" +drive +"\" bs=1024 seek=$(("+ disk_kb_count+" - 1)) count=1 &>>" + OVIRT_TMP_LOGFILE)
+# Cleans partition tables and the LVM, RAID and filesystem signatures
+# on drive and its old partitions, and the first MiB at each of offsets
+def wipe_partitions(drive, offsets=()):
+    logger.info("Wiping old partition table and signatures")
+    try:
+        diskwipe.wipe(drive, offsets)
+    except (IOError, OSError), e:
+        logger.error("Unable to wipe %s: %s" % (drive, e))
     if os.path.exists("/dev/mapper/HostVG-Swap"):
-        os.system("swapoff -a")
+        system(["swapoff", "-a"])
     # remove remaining HostVG entries from dmtable
-    for lv in os.listdir("/dev/mapper/"):
-        if "HostVG" in lv:
-            os.system("dmsetup remove " +lv + " &>>" + OVIRT_TMP_LOGFILE)
+    for device in blockinventory.current():
+        if device.dm_name and "HostVG" in device.dm_name:
+            system(["dmsetup", "remove", device.dm_name], OVIRT_TMP_LOGFILE)
 
 
 def test_ntp_configuration(self):
     # stop ntpd service for testing
-    os.system("service ntpd stop > /dev/null 2>&1")
+    process.run(["service", "ntpd", "stop"])
     for server in OVIRT_VARS["NTP"].split():
-        ret = os.system("ntpdate %s > /dev/null 2>&1" % server)
-        if ret > 0:
+        if not process.succeeds(["ntpdate", server]):
             logger.error("Unable to verify NTP server: %s" % server)
         else:
             logger.info("Verified NTP server: %s" % server)
-    os.system("service ntpd start")
+    process.run(["service", "ntpd", "start"])
 
 def get_dm_device(device):
-    dev_major_cmd="stat -c '%t' " + "\"/dev/" + device + "\""
-    dev_minor_cmd="stat -c '%T' " + "\"/dev/" + device + "\""
-    major_lookup = subprocess.Popen(dev_major_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    minor_lookup = subprocess.Popen(dev_minor_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    major_lookup = major_lookup.stdout.read().strip()
-    minor_lookup = minor_lookup.stdout.read().strip()
-    dm_cmd = "ls /dev/mapper"
-    dm_cmd = subprocess.Popen(dm_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    devices = dm_cmd.stdout.read().strip()
-    for dm in devices.split("\n"):
-        dm_major_cmd="stat -c '%t' " + "\"/dev/mapper/" + dm + "\""
-        dm_minor_cmd="stat -c '%T' " + "\"/dev/mapper/" + dm + "\""
-        dm_major_lookup = subprocess.Popen(dm_major_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        dm_minor_lookup = subprocess.Popen(dm_minor_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        dm_major_lookup = dm_major_lookup.stdout.read().strip()
-        dm_minor_lookup = dm_minor_lookup.stdout.read().strip()
-        if dm_major_lookup == major_lookup and minor_lookup == dm_minor_lookup:
-            dm = "/dev/mapper/" + dm
-            return dm
+    return blockinventory.current().mapper_path(device)
 
 def check_existing_hostvg(install_dev):
-    if install_dev is "":
-        devices_cmd = "pvs --separator=\":\" -o pv_name,vg_name --noheadings 2>/dev/null| grep HostVG |awk -F \":\" {'print $1'}"
-    else:
-        devices_cmd="pvs --separator=: -o pv_name,vg_name --noheadings 2>/dev/null| grep -v '%s' | grep HostVG | awk -F: {'print $1'}" % install_dev
-    devices_cmd = subprocess.Popen(devices_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    devices = devices_cmd.stdout.read().strip()
+    pvs = process.run(["pvs", "--separator=:", "-o", "pv_name,vg_name", "--noheadings"])
+    devices = []
+    for line in pvs.lines():
+        if "HostVG" in line and (install_dev is "" or not install_dev in line):
+            devices.append(line.split(":")[0])
+    devices = "\n".join(devices)
     if len(devices) > 0:
         logger.error("There appears to already be an installation on another device:")
         for device in devices.split(":"):
@@ -1066,92 +919,111 @@ def translate_multipath_device(dev):
         return False
     if "/dev/mapper" in dev:
         return dev
-    if "/dev/cciss" in dev:
-        cciss_dev_cmd = "cciss_id " + dev
-        cciss_dev = subprocess.Popen(cciss_dev_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        dev = "/dev/mapper/" + cciss_dev.stdout.read().strip()
-    dm_dev_cmd = "multipath -ll '%s' | egrep dm-[0-9]+" % dev
-    dm_dev = subprocess.Popen(dm_dev_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    (dm_dev_output, dummy) = dm_dev.communicate()
-    if dm_dev.returncode > 0:
-        return dev
-    else:
-        logger.debug("Translated to: /dev/mapper/" + dm_dev_output.split()[0])
-        return "/dev/mapper/"+dm_dev_output.split()[0]
+    translated = blockinventory.current().translate(dev)
+    if translated != dev:
+        logger.debug("Translated to: " + translated)
+    return translated
 
 def pwd_lock_check(user):
-    passwd_cmd = "passwd -S %s" % user
-    passwd = subprocess.Popen(passwd_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    passwd, err = passwd.communicate()
+    passwd = process.run(["passwd", "-S", user], merge_stderr=True).stdout
     if "locked" in passwd:
         return True
     else:
         return False
 
 def pwd_set_check(user):
-    passwd_cmd = "passwd -S %s" % user
-    passwd = subprocess.Popen(passwd_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    passwd, err = passwd.communicate()
+    passwd = process.run(["passwd", "-S", user], merge_stderr=True).stdout
     if "set" in passwd:
         return True
     else:
         return False
 
+# returns [VERSION, RELEASE] from an image version file, or False
+def get_version_number(version_file):
+    details = {}
+    for line in version_file.readlines():
+        try:
+            key, value = line.strip().split("=")
+            value = value.replace("'", "")
+            details[key] = value
+        except:
+            pass
+    if details.has_key("VERSION") and details.has_key("RELEASE"):
+        return [details["VERSION"],details["RELEASE"]]
+    return False
+
 def get_installed_version_number():
     if mount_liveos():
         existing_version = open("/liveos/version")
-        existing_install = {}
-        for line in existing_version.readlines():
-            try:
-                key, value = line.strip().split("=")
-                value = value.replace("'", "")
-                existing_install[key] = value
-            except:
-                pass
-        if existing_install.has_key("VERSION") and existing_install.has_key("RELEASE"):
-            return [existing_install["VERSION"],existing_install["RELEASE"]]
-        else:
-            return False
+        try:
+            return get_version_number(existing_version)
+        finally:
+            existing_version.close()
 
 def get_media_version_number():
-    new_install = {}
     if mount_live():
         try:
             upgrade_version = open("/live/isolinux/version")
         except:
             upgrade_version = open("/live/syslinux/version")
-        for line in upgrade_version.readlines():
-            try:
-                key, value = line.strip().split("=")
-                value = value.replace("'", "")
-                new_install[key] = value
-            except:
-                pass
+        try:
+            return get_version_number(upgrade_version)
+        finally:
+            upgrade_version.close()
     else:
         logger.error("Failed to mount_live()")
         return False
-    if new_install.has_key("VERSION") and new_install.has_key("RELEASE"):
-        return [new_install["VERSION"],new_install["RELEASE"]]
-    return False
 
+# returns the device with the filesystem label, or ""
+#   answers are cached, call labelindex.invalidate() after mkfs or e2label
 def findfs(label):
-    system("partprobe /dev/mapper/*")
-    system("udevadm settle")
-    blkid_cmd = "/sbin/blkid -c /dev/null -l -o device -t LABEL=\"" + label + "\""
-    blkid = subprocess.Popen(blkid_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    blkid_output = blkid.stdout.read().strip()
-    return blkid_output
-
-def system(command):
-    system_cmd = subprocess.Popen(command, shell=True, stdout=PIPE, stderr=PIPE)
-    output, err = system_cmd.communicate()
-    logger.debug(command)
-    logger.debug(output)
-    if system_cmd.returncode == 0:
+    return labelindex.find(label) or ""
+
+# run a command and return True if it succeeded
+#   argv lists are executed directly, strings are passed to /bin/sh
+#   output is appended to log_file when given
+def system(command, log_file=None):
+    result = process.run(command, shell=isinstance(command, basestring))
+    logger.debug(process.format_argv(command))
+    logger.debug(result.stdout)
+    if log_file in (OVIRT_LOGFILE, OVIRT_TMP_LOGFILE):
+        # ovirt.log is written through log_handler, wherever it is now
+        log_handler.write(result.stdout + result.stderr)
+    elif log_file is not None:
+        try:
+            append_file(log_file, result.stdout + result.stderr)
+        except IOError:
+            pass
+    if result.returncode == 0:
         return True
     else:
         return False
 
+def read_file(filename):
+    try:
+        f = open(filename)
+        try:
+            return f.read()
+        finally:
+            f.close()
+    except IOError:
+        return ""
+
+def append_file(filename, data):
+    f = open(filename, "a")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+def makedirs(path):
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
 def password_check(password_1, password_2):
           if password_1 != "" and password_2 != "":
               if password_1 != password_2:
@@ -1188,9 +1060,10 @@ def get_virt_hw_status():
         logger.info("Hardware virtualization detected")
     else:
         hwvirt_msg = "Virtualization hardware is unavailable."
-        cpuflags_cmd = "cat /proc/cpuinfo |grep ^flags|tail -n 1"
-        cpuflags_lookup = subprocess.Popen(cpuflags_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        cpuflags = cpuflags_lookup.stdout.read().strip()
+        cpuflags = ""
+        for line in read_file("/proc/cpuinfo").splitlines():
+            if line.startswith("flags"):
+                cpuflags = line.strip()
         if "vmx" in cpuflags or "svm" in cpuflags:
             hwvirt_msg = "(Virtualization hardware detected but disabled)"
         else:
@@ -1200,9 +1073,8 @@ def get_virt_hw_status():
 def get_ssh_hostkey(variant="rsa"):
     fn_hostkey = "/etc/ssh/ssh_host_%s_key.pub" % variant
     hostkey = open(fn_hostkey).read ()
-    hostkey_fp_cmd = "ssh-keygen -l -f '%s'" % fn_hostkey
-    hostkey_fp_lookup = subprocess.Popen(hostkey_fp_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    fingerprint = hostkey_fp_lookup.stdout.read().strip().split(" ")[1]
+    hostkey_fp_lookup = process.run(["ssh-keygen", "-l", "-f", fn_hostkey], merge_stderr=True)
+    fingerprint = hostkey_fp_lookup.stdout.strip().split(" ")[1]
     return (fingerprint, hostkey)
 
 def get_mac_address(dev):
@@ -1226,28 +1098,17 @@ def logical_to_physical_networks():
     return networks
 
 def has_fakeraid(device):
-    fakeraid_cmd = "dmraid -r $(readlink -f \"" + device + "\")"
-    fakeraid = subprocess.Popen(fakeraid_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    fakeraid.communicate()
-    fakeraid.poll()
+    fakeraid = process.run(["dmraid", "-r", os.path.realpath(device)])
     if fakeraid.returncode == 0:
         return True
     else:
         return False
 
 def is_wipe_fakeraid():
-    OVIRT_VARS = parse_defaults()
-    # check if theres a key first
-    if "OVIRT_WIPE_FAKERAID" in OVIRT_VARS:
-        if OVIRT_VARS["OVIRT_WIPE_FAKERAID"] == "1":
-            return True
-        elif OVIRT_VARS["OVIRT_WIPE_FAKERAID"] == "0":
-            return False
-    return False
+    return OVIRT_VARS.get_bool("OVIRT_WIPE_FAKERAID")
 
 def set_wipe_fakeraid(value):
     augtool("set","/files/etc/default/ovirt/OVIRT_WIPE_FAKERAID",str(value))
-    OVIRT_VARS = parse_defaults()
 
 
 def pad_or_trim(length, string):
@@ -1262,10 +1123,7 @@ def pad_or_trim(length, string):
     return string
 
 def is_efi_boot():
-    if os.path.exists("/sys/firmware/efi"):
-        return True
-    else:
-        return False
+    return boot_context().efi
 
 def manage_firewall_port(port, action="open", proto="tcp"):
     if action == "open":
@@ -1274,15 +1132,12 @@ def manage_firewall_port(port, action="open", proto="tcp"):
     elif action == "close":
         opt = "-D"
         logger.info("Closing port " + port)
-    os.system("iptables %s INPUT -p %s --dport %s -j ACCEPT" % (opt, proto, port))
-    os.system("iptables-save")
+    system(["iptables", opt, "INPUT", "-p", proto, "--dport", port, "-j", "ACCEPT"])
+    system(["iptables-save"])
     ovirt_store_config("/etc/sysconfig/iptables")
 
 def is_iscsi_install():
-    if OVIRT_VARS.has_key("OVIRT_ISCSI_INSTALL") and OVIRT_VARS["OVIRT_ISCSI_INSTALL"].upper() == "Y":
-        return True
-    else:
-        return False
+    return boot_context().iscsi_install
 
 class PluginBase(object):
     """Base class for pluggable Hypervisor configuration options.
@@ -1319,24 +1174,26 @@ class PluginBase(object):
         """
         pass
 
-OVIRT_VARS = parse_defaults()
-
 # setup logging facility
-if is_stateless():
-    log_file = OVIRT_LOGFILE
-elif is_firstboot():
-    log_file = OVIRT_TMP_LOGFILE
-else:
-    log_file = OVIRT_LOGFILE
+def get_log_file():
+    if is_stateless():
+        return OVIRT_LOGFILE
+    elif is_firstboot():
+        return OVIRT_TMP_LOGFILE
+    else:
+        return OVIRT_LOGFILE
+
+# ovirt.log, moved to the Logging LV by mount_logging()
+log_handler = logbuffer.BufferedLogHandler(get_log_file)
 
 def setup_custom_logger():
     formatter = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
-    handler = logging.FileHandler(log_file)
-    handler.setFormatter(formatter)
-    logger = logging.getLogger(PRODUCT_SHORT)
-    logger.setLevel(logging.DEBUG)
-    logger.addHandler(handler)
-    return logger
+    log_handler.setFormatter(formatter)
+    # helper modules log below the "ovirtnode" namespace
+    for name in (PRODUCT_SHORT, "ovirtnode"):
+        logging.getLogger(name).setLevel(logging.DEBUG)
+        logging.getLogger(name).addHandler(log_handler)
+    return logging.getLogger(PRODUCT_SHORT)
 
 setup_custom_logger()
 logger = logging.getLogger(PRODUCT_SHORT)
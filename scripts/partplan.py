@@ -0,0 +1,309 @@
+#!/usr/bin/python
+# partplan.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Partition layouts planned up front and written in one go.
+
+A Layout lists the partitions of a disk by name, each ending at a
+fixed offset in MiB or taking the rest of the disk:
+
+    layout = Layout("gpt")
+    layout.add("Root", 512, bootable=True)
+    layout.add("HostVG", kind="lvm")
+    layout.write("/dev/sda")
+
+write() computes extents aligned to 1MiB, or to the coarser grain of
+the disk's I/O topology (see alignment.py), and writes the whole GPT
+(protective MBR, primary and backup header and entries) or MBR table
+directly, so the kernel sees one table change instead of one per
+parted call.  read() parses a table back, e.g. from an image file.
+"""
+
+import os
+import zlib
+import uuid
+import struct
+import logging
+
+logger = logging.getLogger("ovirtnode.partplan")
+
+MIB = 1024 * 1024
+SECTOR_SIZE = 512
+
+GPT_SIGNATURE = "EFI PART"
+GPT_REVISION = 0x00010000
+GPT_HEADER = struct.Struct("<8sIIIIQQQQ16sQIII")
+GPT_ENTRY = struct.Struct("<16s16sQQQ72s")
+GPT_ENTRIES = 128
+GPT_ATTR_LEGACY_BOOT = 1 << 2
+
+GPT_TYPES = {
+    "linux": "0FC63DAF-8483-4772-8E79-3D69D8477DE4",
+    "lvm": "E6D6D379-F507-44C2-A23C-238F2A3DF928",
+    "efi": "C12A7328-F81F-11D2-BA4B-00A0C93EC93B",
+    "bios_grub": "21686148-6449-6E6F-744E-656564454649",
+}
+
+MBR_TYPES = {
+    "linux": 0x83,
+    "lvm": 0x8e,
+    "efi": 0xef,
+    "bios_grub": 0x83,
+}
+MBR_PROTECTIVE = 0xee
+MBR_ENTRY = struct.Struct("<B3sB3sII")
+MBR_TABLE_OFFSET = 446
+MBR_SIGNATURE = "\x55\xaa"
+# CHS fields are not used by anything we boot, mark them as LBA only
+MBR_CHS_LBA = "\xfe\xff\xff"
+
+
+class Partition(object):
+
+    def __init__(self, number, name, end_mb, kind, bootable):
+        self.number = number
+        self.name = name
+        self.end_mb = end_mb
+        self.kind = kind
+        self.bootable = bootable
+        # first and last sector, set by Layout.plan()
+        self.start = None
+        self.end = None
+
+    def __repr__(self):
+        return "<Partition %d %s %s %s-%s>" % (self.number, self.name,
+                                               self.kind, self.start, self.end)
+
+
+class Layout(object):
+    """The partitions of one disk, in order."""
+
+    def __init__(self, label_type="gpt", sector_size=SECTOR_SIZE,
+                 alignment=MIB, alignment_offset=0):
+        if label_type not in ("gpt", "msdos"):
+            raise ValueError("Unsupported label type: %s" % label_type)
+        if alignment % sector_size or alignment_offset % sector_size:
+            raise ValueError("Alignment is not a multiple of %d byte "
+                             "sectors" % sector_size)
+        self.label_type = label_type
+        self.sector_size = sector_size
+        # partitions start at alignment_offset + n * alignment bytes
+        self.alignment = alignment
+        self.alignment_offset = alignment_offset
+        self.partitions = []
+
+    def add(self, name, end_mb=None, kind="linux", bootable=False):
+        """Appends a partition ending at end_mb MiB from the start of
+        the disk, or at the end of the disk if end_mb is None."""
+        if kind not in GPT_TYPES:
+            raise ValueError("Unknown partition kind: %s" % kind)
+        if self.partitions and self.partitions[-1].end_mb is None:
+            raise ValueError("%s follows a partition taking the rest of "
+                             "the disk" % name)
+        if self.label_type == "msdos" and len(self.partitions) == 4:
+            raise ValueError("msdos labels hold four primary partitions")
+        part = Partition(len(self.partitions) + 1, name, end_mb, kind,
+                         bootable)
+        self.partitions.append(part)
+        return part
+
+    def partition(self, name):
+        for part in self.partitions:
+            if part.name == name:
+                return part
+        return None
+
+    def _entry_sectors(self):
+        return GPT_ENTRIES * GPT_ENTRY.size / self.sector_size
+
+    def usable(self, total_sectors):
+        """Returns the first and last sector partitions may use."""
+        if self.label_type == "gpt":
+            entries = self._entry_sectors()
+            return 2 + entries, total_sectors - 2 - entries
+        return 1, min(total_sectors, 0xffffffff) - 1
+
+    def align(self, sector):
+        """Returns the first aligned sector at or after sector."""
+        grain = self.alignment / self.sector_size
+        offset = self.alignment_offset / self.sector_size
+        rest = (sector - offset) % grain
+        if rest:
+            sector = sector + grain - rest
+        return sector
+
+    def plan(self, total_sectors):
+        """Assigns the extents of all partitions; raises ValueError if
+        they do not fit.  With a grain coarser than 1MiB partitions move
+        up to their aligned start and keep their size."""
+        per_mib = MIB / self.sector_size
+        first, last = self.usable(total_sectors)
+        start = per_mib
+        # where the partition would start with 1MiB alignment
+        nominal = per_mib
+        for part in self.partitions:
+            start = self.align(max(start, first))
+            if part.end_mb is None:
+                end = last
+            else:
+                end = start + part.end_mb * per_mib - nominal - 1
+                nominal = part.end_mb * per_mib
+            if end > last or end <= start:
+                raise ValueError("%s does not fit: sectors %d-%d of %d-%d" %
+                                 (part.name, start, end, first, last))
+            part.start = start
+            part.end = end
+            start = end + 1
+        return self.partitions
+
+    def _mbr(self, boot_sector, entries):
+        table = []
+        for status, kind, start, sectors in entries:
+            table.append(MBR_ENTRY.pack(status, MBR_CHS_LBA, kind,
+                                        MBR_CHS_LBA, start, sectors))
+        table = "".join(table).ljust(4 * MBR_ENTRY.size, "\0")
+        # keep the boot code and disk signature
+        return boot_sector[:MBR_TABLE_OFFSET] + table + MBR_SIGNATURE
+
+    def _gpt(self, total_sectors):
+        ss = self.sector_size
+        entries = []
+        for part in self.partitions:
+            attrs = 0
+            if part.bootable:
+                attrs = GPT_ATTR_LEGACY_BOOT
+            entries.append(GPT_ENTRY.pack(
+                uuid.UUID(GPT_TYPES[part.kind]).bytes_le,
+                uuid.uuid4().bytes_le, part.start, part.end, attrs,
+                part.name.encode("utf-16-le")[:72]))
+        entries = "".join(entries).ljust(GPT_ENTRIES * GPT_ENTRY.size, "\0")
+        entries_crc = zlib.crc32(entries) & 0xffffffff
+        first, last = self.usable(total_sectors)
+        disk_guid = uuid.uuid4().bytes_le
+        backup_lba = total_sectors - 1
+        backup_entries_lba = backup_lba - self._entry_sectors()
+
+        def header(current, backup, entries_lba):
+            fields = [GPT_SIGNATURE, GPT_REVISION, GPT_HEADER.size, 0, 0,
+                      current, backup, first, last, disk_guid, entries_lba,
+                      GPT_ENTRIES, GPT_ENTRY.size, entries_crc]
+            crc = zlib.crc32(GPT_HEADER.pack(*fields)) & 0xffffffff
+            fields[3] = crc
+            return GPT_HEADER.pack(*fields).ljust(ss, "\0")
+
+        primary = header(1, backup_lba, 2)
+        backup = header(backup_lba, 1, backup_entries_lba)
+        return primary, backup, entries, backup_entries_lba
+
+    def write(self, path):
+        """Plans the layout for the disk or image at path and writes
+        its partition table."""
+        ss = self.sector_size
+        fd = os.open(path, os.O_RDWR)
+        try:
+            total_sectors = os.lseek(fd, 0, 2) / ss
+            self.plan(total_sectors)
+            os.lseek(fd, 0, 0)
+            boot_sector = os.read(fd, ss).ljust(ss, "\0")
+            if self.label_type == "gpt":
+                sectors = min(total_sectors - 1, 0xffffffff)
+                mbr = self._mbr(boot_sector,
+                                [(0, MBR_PROTECTIVE, 1, sectors)])
+                primary, backup, entries, backup_entries_lba = \
+                    self._gpt(total_sectors)
+                writes = [(0, mbr.ljust(ss, "\0")),
+                          (1, primary),
+                          (2, entries),
+                          (backup_entries_lba, entries),
+                          (total_sectors - 1, backup)]
+            else:
+                table = []
+                for part in self.partitions:
+                    status = 0
+                    if part.bootable:
+                        status = 0x80
+                    table.append((status, MBR_TYPES[part.kind], part.start,
+                                  part.end - part.start + 1))
+                writes = [(0, self._mbr(boot_sector, table).ljust(ss, "\0"))]
+            for lba, data in writes:
+                os.lseek(fd, lba * ss, 0)
+                os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        logger.info("Wrote %s label to %s: %s" % (
+            self.label_type, path,
+            ", ".join(["%d %s" % (p.number, p.name) for p in self.partitions])))
+        return self.partitions
+
+
+def read(path, sector_size=SECTOR_SIZE):
+    """Returns (label type, [(number, name, kind, start, end, bootable)])
+    of the partition table at path; the label type is None if there is
+    no table.  Raises ValueError for a GPT with a bad checksum."""
+    f = open(path, "rb")
+    try:
+        mbr = f.read(sector_size)
+        if len(mbr) < 512 or mbr[510:512] != MBR_SIGNATURE:
+            return None, []
+        mbr_entries = []
+        for n in range(4):
+            status, chs, kind, chs_end, start, sectors = MBR_ENTRY.unpack_from(
+                mbr, MBR_TABLE_OFFSET + n * MBR_ENTRY.size)
+            if kind:
+                mbr_entries.append((n + 1, status, kind, start, sectors))
+        if not (len(mbr_entries) == 1 and mbr_entries[0][2] == MBR_PROTECTIVE):
+            kinds = dict([(v, k) for k, v in MBR_TYPES.items()
+                          if k != "bios_grub"])
+            return "msdos", [(n, None, kinds.get(kind, hex(kind)), start,
+                              start + sectors - 1, status == 0x80)
+                             for n, status, kind, start, sectors
+                             in mbr_entries]
+        header = f.read(sector_size)
+        fields = list(GPT_HEADER.unpack_from(header))
+        if fields[0] != GPT_SIGNATURE:
+            raise ValueError("Protective MBR without GPT header")
+        crc = fields[3]
+        fields[3] = 0
+        if zlib.crc32(GPT_HEADER.pack(*fields)) & 0xffffffff != crc:
+            raise ValueError("Bad GPT header checksum")
+        entries_lba, count, size, entries_crc = fields[10:14]
+        f.seek(entries_lba * sector_size)
+        entries = f.read(count * size)
+        if zlib.crc32(entries) & 0xffffffff != entries_crc:
+            raise ValueError("Bad GPT entries checksum")
+    finally:
+        f.close()
+    kinds = {}
+    for kind, guid in GPT_TYPES.items():
+        kinds[uuid.UUID(guid).bytes_le] = kind
+    partitions = []
+    for n in range(count):
+        type_guid, unique, start, end, attrs, name = \
+            GPT_ENTRY.unpack_from(entries, n * size)
+        if type_guid == "\0" * 16:
+            continue
+        name = name.decode("utf-16-le").rstrip(u"\0").encode("utf-8")
+        partitions.append((n + 1, name, kinds.get(type_guid, "unknown"),
+                           start, end, bool(attrs & GPT_ATTR_LEGACY_BOOT)))
+    return "gpt", partitions
+
+
+def partition_paths(drive, number):
+    """Returns the possible device names of a partition, e.g.
+    /dev/sda2 and /dev/cciss/c0d0p2 or /dev/mapper/mpathap2."""
+    return [drive + str(number), drive + "p" + str(number)]
@@ -42,17 +42,18 @@ def set_password(password, user):
     return True
 
 def check_ssh_password_auth():
-    password_auth_status = augeas.Augeas("root=/")
-    password_auth_status.get("/files/etc/ssh/sshd_config/PasswordAuthentication")
-    return password_auth_status
+    ssh_config = augsession.session("ssh")
+    ssh_config.load()
+    return ssh_config.get("/files/etc/ssh/sshd_config/PasswordAuthentication")
 
 def toggle_ssh_access():
-    ssh_config = augeas.Augeas("root=/")
-    ssh_config.set("/files/etc/ssh/sshd_config", OVIRT_VARS["ssh_pass_enabled"])
+    ssh_config = augsession.session("ssh")
+    ssh_config.set("/files/etc/ssh/sshd_config/PasswordAuthentication",
+                   OVIRT_VARS["ssh_pass_enabled"])
     ssh_config.save()
     ovirt_store_config("/etc/ssh/sshd_config")
-    rc = os.system("service sshd reload")
+    rc = process.run(["service", "sshd", "reload"]).returncode
     return rc
 
 def set_sasl_password(user, password):
-    os.system("saslpasswd2 -a libvirt -p %s") % user
+    process.run(["saslpasswd2", "-a", "libvirt", "-p", user], input=password)
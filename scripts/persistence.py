@@ -0,0 +1,360 @@
+#!/usr/bin/python
+# persistence.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Index of the configuration persisted to /config.
+
+A persisted file /etc/foo is copied to /config/etc/foo, bind-mounted
+back over /etc/foo and listed in /config/files, which rc.sysinit reads
+at boot to restore the bind mounts.
+
+ConfigIndex keeps /config/files and the set of current bind mounts in
+memory so lookups do not rescan either file.  /config/files is reloaded
+when its inode, size or mtime change, which covers edits made by the
+shell helpers.  Bind mounts come from the shared mount table; batch
+operations take one snapshot of it and keep that up to date themselves.
+"""
+
+import os
+import logging
+import threading
+import ovirtnode.process as process
+import ovirtnode.kernel as kernel
+import ovirtnode.mounttab as mounttab
+import ovirtnode.digestcache as digestcache
+
+logger = logging.getLogger("ovirtnode.persistence")
+
+CONFIG_ROOT = "/config"
+FILES_LIST = "/config/files"
+
+
+def _as_list(files):
+    if isinstance(files, basestring):
+        return [files]
+    return list(files)
+
+
+class ConfigIndex(object):
+    """In-memory view of /config/files and the /config bind mounts."""
+
+    def __init__(self, root=CONFIG_ROOT, files_list=FILES_LIST, table=None):
+        self.root = root
+        self.files_list = files_list
+        if table is None:
+            table = mounttab.table
+        self.table = table
+        self._lock = threading.RLock()
+        self._entries = []
+        self._entry_set = set()
+        self._files_sig = None
+        self._mounted = None
+
+    def store_path(self, filename):
+        """Returns the location of filename's copy below /config."""
+        return self.root + filename
+
+    # /config/files
+
+    def _signature(self):
+        try:
+            st = os.stat(self.files_list)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def _load_files(self):
+        sig = self._signature()
+        if sig == self._files_sig:
+            return
+        entries = []
+        if sig is not None:
+            f = open(self.files_list)
+            try:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if line:
+                        entries.append(line)
+            finally:
+                f.close()
+        self._entries = entries
+        self._entry_set = set(entries)
+        self._files_sig = sig
+
+    def registered(self):
+        """Returns the paths listed in /config/files, in file order."""
+        self._lock.acquire()
+        try:
+            self._load_files()
+            return list(self._entries)
+        finally:
+            self._lock.release()
+
+    def is_registered(self, filename):
+        self._lock.acquire()
+        try:
+            self._load_files()
+            return os.path.abspath(filename) in self._entry_set
+        finally:
+            self._lock.release()
+
+    def register(self, files):
+        """Adds files to /config/files with a single append.
+
+        Returns the list of paths that were not registered before.
+        """
+        self._lock.acquire()
+        try:
+            self._load_files()
+            new = []
+            for f in _as_list(files):
+                filename = os.path.abspath(f)
+                if filename not in self._entry_set and filename not in new:
+                    new.append(filename)
+            if new:
+                out = open(self.files_list, "a")
+                try:
+                    out.write("".join([n + "\n" for n in new]))
+                finally:
+                    out.close()
+                self._entries.extend(new)
+                self._entry_set.update(new)
+                self._files_sig = self._signature()
+            return new
+        finally:
+            self._lock.release()
+
+    def unregister(self, files, suffix_match=False):
+        """Removes files from /config/files with a single rewrite.
+
+        With suffix_match every entry ending in one of the names is
+        dropped, which also catches entries below a removed directory.
+        """
+        self._lock.acquire()
+        try:
+            self._load_files()
+            if self._files_sig is None:
+                return []
+            names = [os.path.abspath(f) for f in _as_list(files)]
+            drop = set()
+            if suffix_match:
+                for entry in self._entries:
+                    for name in names:
+                        if entry.endswith(name):
+                            drop.add(entry)
+            else:
+                drop = self._entry_set.intersection(names)
+            if drop:
+                kept = [e for e in self._entries if e not in drop]
+                # rewrite in place, /config/files may be bind-mounted
+                out = open(self.files_list, "w")
+                try:
+                    out.write("".join([k + "\n" for k in kept]))
+                finally:
+                    out.close()
+                self._entries = kept
+                self._entry_set = set(kept)
+                self._files_sig = self._signature()
+            return list(drop)
+        finally:
+            self._lock.release()
+
+    # bind mounts
+
+    def _read_mounts(self):
+        """Returns the paths bind-mounted from /config."""
+        return set([e.target for e in self.table.binds_from(self.root)])
+
+    def refresh_mounts(self):
+        self._lock.acquire()
+        try:
+            self._mounted = self._read_mounts()
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        """Forgets all cached state; it is reloaded on next use."""
+        self._lock.acquire()
+        try:
+            self._mounted = None
+            self._files_sig = None
+        finally:
+            self._lock.release()
+        self.table.invalidate()
+
+    def is_mounted(self, filename):
+        """Returns True if filename is bind-mounted from /config."""
+        origin = self.table.bind_origin(os.path.abspath(filename))
+        return origin is not None and origin.startswith(self.root + "/")
+
+    def _bind(self, filename):
+        try:
+            kernel.bind_mount(self.store_path(filename), filename)
+        except OSError, e:
+            logger.error(str(e))
+            return False
+        self._mounted.add(filename)
+        return True
+
+    def _unbind(self, filename):
+        try:
+            kernel.umount(filename)
+        except OSError, e:
+            logger.error(str(e))
+            return False
+        self._mounted.discard(filename)
+        return True
+
+    # batch operations
+
+    def store(self, files):
+        """Persists files to /config.
+
+        The mount table is read once and all new entries are appended
+        to /config/files together.  Returns True if every file is
+        persisted afterwards.
+        """
+        self._lock.acquire()
+        try:
+            self.refresh_mounts()
+            ok = True
+            pending = []
+            for f in _as_list(files):
+                filename = os.path.abspath(f)
+                stored = self.store_path(filename)
+                if not os.path.exists(filename):
+                    logger.warn("Skipping, file: " + filename +
+                                " does not exist")
+                    ok = False
+                    continue
+                if os.path.isdir(filename) and os.path.isdir(stored):
+                    logger.warn("Directory already persisted: " + filename)
+                    logger.warn("You need to unpersist its child "
+                                "directories and/or files and try again.")
+                    pending.append(filename)
+                    continue
+                if os.path.isfile(filename) and os.path.isfile(stored):
+                    if digestcache.same_content(filename, stored):
+                        logger.warn("File already persisted: " + filename)
+                        pending.append(filename)
+                        continue
+                    # persistent copy needs refresh
+                    if filename in self._mounted:
+                        if self._unbind(filename):
+                            os.unlink(stored)
+                    else:
+                        os.unlink(stored)
+                if filename in self._mounted:
+                    pending.append(filename)
+                    continue
+                dirname = os.path.dirname(stored)
+                if not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                if not process.succeeds(["cp", "-a", filename, stored]):
+                    logger.error("Failed to persist: " + filename)
+                    ok = False
+                    continue
+                if not self._bind(filename):
+                    logger.error("Failed to persist: " + filename)
+                    ok = False
+                    continue
+                logger.info("File: " + filename + " persisted")
+                pending.append(filename)
+            # register in /config/files used by rc.sysinit
+            for filename in self.register(pending):
+                logger.info("Successfully persisted: " + filename)
+            digestcache.cache.save()
+            return ok
+        finally:
+            self._lock.release()
+
+    def unmount(self, files):
+        """Removes the bind mounts of files and refreshes the copy in
+        the root filesystem from /config."""
+        self._lock.acquire()
+        try:
+            self.refresh_mounts()
+            ok = True
+            for f in _as_list(files):
+                filename = os.path.abspath(f)
+                if filename not in self._mounted:
+                    continue
+                if not self._unbind(filename):
+                    ok = False
+                    continue
+                stored = self.store_path(filename)
+                if os.path.exists(stored):
+                    # refresh the file in rootfs if it was mounted over
+                    if not process.succeeds(["cp", "-a", stored, filename]):
+                        ok = False
+            return ok
+        finally:
+            self._lock.release()
+
+    def remove(self, files):
+        """Unpersists files, leaving the current content in place."""
+        self._lock.acquire()
+        try:
+            self.refresh_mounts()
+            ok = True
+            removed = []
+            for f in _as_list(files):
+                filename = os.path.abspath(f)
+                if not self.is_registered(filename):
+                    logger.warn("File not explicitly persisted: %s" % filename)
+                    continue
+                if filename not in self._mounted:
+                    logger.warn("%s is not a persisted file." % filename)
+                    continue
+                stored = self.store_path(filename)
+                if self._unbind(filename):
+                    if os.path.isdir(filename):
+                        children = [os.path.join(stored, c)
+                                    for c in os.listdir(stored)]
+                        if not process.succeeds(["cp", "-ar"] + children +
+                                                [filename]):
+                            logger.error(" Failed to unpersist %s" % filename)
+                            ok = False
+                            continue
+                    elif os.path.isfile(filename):
+                        # refresh the file in rootfs if it was mounted over
+                        if not process.succeeds(["cp", "-a", stored,
+                                                 filename]):
+                            logger.error("Failed to unpersist %s" % filename)
+                            ok = False
+                            continue
+                    logger.info("%s successully unpersisted" % filename)
+                # clean up the persistent store
+                process.run(["rm", "-Rf", stored])
+                removed.append(filename)
+            # unregister in /config/files used by rc.sysinit
+            self.unregister(removed)
+            return ok
+        finally:
+            self._lock.release()
+
+
+index = ConfigIndex()
+
+
+def store_configs(files):
+    """Persists a batch of files; see ConfigIndex.store()."""
+    return index.store(files)
+
+
+def is_persisted(filename):
+    return index.is_registered(filename)
@@ -0,0 +1,204 @@
+#!/usr/bin/python
+# process.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Shell-free command execution for ovirtnode.
+
+Commands are given as argv lists and executed without /bin/sh, so a
+lookup like "ip route | awk" costs one fork/exec instead of three.
+Every child spawned through this module is counted and timed; the
+accounting is per process and can be inspected with spawn_count()
+and spawn_log().
+"""
+
+import os
+import signal
+import subprocess
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger("ovirtnode.process")
+
+# number of spawn records kept for spawn_log()
+SPAWN_LOG_SIZE = 1024
+
+_spawn_lock = threading.Lock()
+_spawn_count = 0
+_spawn_time = 0.0
+_spawn_log = deque(maxlen=SPAWN_LOG_SIZE)
+
+
+class Result(object):
+    """Outcome of a finished command.
+
+    A Result is true if the command exited with status 0, which keeps
+    "if run([...]):" working like the old system() helper.
+    """
+
+    def __init__(self, argv, returncode, stdout, stderr, duration,
+                 timed_out=False):
+        self.argv = argv
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.timed_out = timed_out
+
+    def __nonzero__(self):
+        return self.returncode == 0
+
+    def __repr__(self):
+        return "<Result %s rc=%s %.3fs>" % (format_argv(self.argv),
+                                            self.returncode, self.duration)
+
+    def lines(self):
+        """Returns stdout split into stripped, non-empty lines."""
+        return [l.strip() for l in self.stdout.splitlines() if l.strip()]
+
+
+def format_argv(argv):
+    """Returns a printable form of argv for log messages."""
+    if isinstance(argv, basestring):
+        return argv
+    return " ".join(argv)
+
+
+def _account(argv, returncode, duration):
+    global _spawn_count, _spawn_time
+    _spawn_lock.acquire()
+    try:
+        _spawn_count = _spawn_count + 1
+        _spawn_time = _spawn_time + duration
+        _spawn_log.append((time.time(), format_argv(argv), returncode,
+                           duration))
+    finally:
+        _spawn_lock.release()
+    logger.debug("spawned %s rc=%s in %.3fs" % (format_argv(argv),
+                                                returncode, duration))
+
+
+def _kill(proc, killed):
+    killed.append(proc.pid)
+    try:
+        os.kill(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def run(argv, timeout=None, input=None, env=None, cwd=None,
+        merge_stderr=False, shell=False):
+    """Run a command and wait for it to finish.
+
+    argv -- list of program and arguments; a string only with shell=True
+    timeout -- seconds after which the child is killed, None to wait forever
+    input -- string fed to the child's stdin
+    merge_stderr -- capture stderr together with stdout
+    shell -- run a string through /bin/sh, kept for legacy callers only
+
+    Returns a Result.  A missing executable is reported as status 127
+    instead of raising, like the shell does.
+    """
+    if shell and not isinstance(argv, basestring):
+        raise TypeError("shell commands must be strings")
+    if not shell and isinstance(argv, basestring):
+        raise TypeError("commands must be argv lists")
+    if input is None:
+        stdin = open(os.devnull)
+    else:
+        stdin = subprocess.PIPE
+    if merge_stderr:
+        stderr = subprocess.STDOUT
+    else:
+        stderr = subprocess.PIPE
+    start = time.time()
+    try:
+        try:
+            proc = subprocess.Popen(argv, stdin=stdin, stdout=subprocess.PIPE,
+                                    stderr=stderr, env=env, cwd=cwd,
+                                    shell=shell, close_fds=True)
+        except OSError, e:
+            duration = time.time() - start
+            _account(argv, 127, duration)
+            return Result(argv, 127, "", str(e), duration)
+    finally:
+        if input is None:
+            stdin.close()
+    timer = None
+    killed = []
+    if timeout is not None:
+        timer = threading.Timer(timeout, _kill, [proc, killed])
+        timer.start()
+    try:
+        out, err = proc.communicate(input)
+    finally:
+        if timer is not None:
+            timer.cancel()
+    duration = time.time() - start
+    timed_out = len(killed) > 0
+    if timed_out:
+        logger.warning("%s killed after %ss timeout" % (format_argv(argv),
+                                                        timeout))
+    if err is None:
+        err = ""
+    _account(argv, proc.returncode, duration)
+    return Result(argv, proc.returncode, out, err, duration, timed_out)
+
+
+def output(argv, **kwargs):
+    """Run a command and return its stripped stdout, "" on failure."""
+    result = run(argv, **kwargs)
+    if not result:
+        return ""
+    return result.stdout.strip()
+
+
+def succeeds(argv, **kwargs):
+    """Run a command and return True if it exited with status 0."""
+    return run(argv, **kwargs).returncode == 0
+
+
+def spawn_count():
+    """Returns the number of children spawned by this process so far."""
+    return _spawn_count
+
+
+def spawn_time():
+    """Returns the seconds spent running children so far."""
+    return _spawn_time
+
+
+def spawn_log():
+    """Returns the most recent spawns as (timestamp, command, returncode,
+    duration) tuples, oldest first."""
+    _spawn_lock.acquire()
+    try:
+        return list(_spawn_log)
+    finally:
+        _spawn_lock.release()
+
+
+def reset_spawn_accounting():
+    global _spawn_count, _spawn_time
+    _spawn_lock.acquire()
+    try:
+        _spawn_count = 0
+        _spawn_time = 0.0
+        _spawn_log.clear()
+    finally:
+        _spawn_lock.release()
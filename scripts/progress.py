@@ -0,0 +1,379 @@
+#!/usr/bin/python
+# progress.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Installation progress events for the installer front ends.
+
+The storage and install code announce the phase they are in and, where
+they know it, how many bytes of how many are done:
+
+    progress.phase("install.image")
+    progress.advance(done, total)
+
+A front end starts a plan, the phases it expects in order, and
+subscribes a callback receiving an Event for every announcement:
+
+    progress.start(progress.INSTALL)
+    progress.subscribe(progress.Throttle(redraw, progress.redraw_interval()))
+
+The Event gives the phase and its title, the bytes done and total, the
+fraction done of the phase and of the whole plan, weighed by how long
+each phase usually takes, and an estimate of the seconds left.  Phases
+of the plan that never come, e.g. AppVG without an AppVG drive, count
+as done once a later one starts.  Without subscribers announcements
+cost next to nothing.
+
+Callbacks run in the thread announcing, one at a time; a Throttle
+passes phase changes and the end on and otherwise at most one event
+per interval, so a screen on a serial console is not redrawn for every
+chunk copied.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+
+logger = logging.getLogger("ovirtnode.progress")
+
+# name: (title, weight), the weight being the usual share of the time
+PHASES = {
+    "storage.prepare": ("Removing old partitions", 5),
+    "storage.root": ("Partitioning and creating file systems", 10),
+    "storage.hostvg": ("Creating HostVG", 15),
+    "storage.appvg": ("Creating AppVG", 5),
+    "password": ("Setting the admin password", 1),
+    "install.prepare": ("Preparing the Root partition", 4),
+    "install.image": ("Copying the image", 45),
+    "install.bootloader": ("Installing the bootloader", 15),
+}
+
+STORAGE = ["storage.prepare", "storage.root", "storage.hostvg",
+           "storage.appvg"]
+BOOT_SETUP = ["install.prepare", "install.image", "install.bootloader"]
+INSTALL = STORAGE + ["password"] + BOOT_SETUP
+UPGRADE = ["password"] + BOOT_SETUP
+AUTO_INSTALL = STORAGE + BOOT_SETUP
+
+# no estimate before this much of the plan or phase is done
+MIN_ESTIMATE = 0.03
+
+REDRAW_INTERVAL = 0.5
+SERIAL_REDRAW_INTERVAL = 2.0
+TEXT_INTERVAL = 10.0
+SERIAL_TTYS = ("ttyS", "ttyUSB", "ttyAMA", "hvc", "hvsi", "ttysclp")
+
+
+class Event(object):
+    """One announcement; done and total are in bytes, total is None
+    if the phase has no byte count.  overall is None without a plan,
+    eta is None until there is enough to estimate it."""
+
+    def __init__(self, name, title, done, total, fraction, overall,
+                 elapsed, eta, finished=False, ok=True):
+        self.name = name
+        self.title = title
+        self.done = done
+        self.total = total
+        self.fraction = fraction
+        self.overall = overall
+        self.elapsed = elapsed
+        self.eta = eta
+        self.finished = finished
+        self.ok = ok
+
+    def __repr__(self):
+        return "<Event %s %s/%s %s>" % (self.name, self.done, self.total,
+                                        self.overall)
+
+    @property
+    def percent(self):
+        """Percent of the plan done, else of the phase."""
+        fraction = self.overall
+        if fraction is None:
+            fraction = self.fraction
+        return int(fraction * 100)
+
+
+class Tracker(object):
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.subscribers = []
+        self.start()
+
+    def start(self, plan=None):
+        self.plan = plan
+        self.started = time.time()
+        self.name = None
+        self.title = None
+        self.index = 0
+        self.phase_started = self.started
+        self.done = 0
+        self.total = None
+        self.overall = 0.0
+
+    def _weight(self, name):
+        return PHASES.get(name, (name, 0))[1]
+
+    def _plan_weight(self):
+        return sum([self._weight(name) for name in self.plan]) or 1
+
+    def _fraction(self):
+        if self.name is None:
+            return 0.0
+        if self.total:
+            return min(float(self.done) / self.total, 1.0)
+        return 0.0
+
+    def _overall(self):
+        if self.plan is None:
+            return None
+        weight = sum([self._weight(n) for n in self.plan[:self.index]])
+        if self.name in self.plan:
+            weight = weight + self._weight(self.name) * self._fraction()
+        # phases outside the plan do not move it, nor back
+        self.overall = max(self.overall, float(weight) / self._plan_weight())
+        return self.overall
+
+    def _eta(self, now, overall):
+        """Seconds left of the phase, or of the plan if there is one."""
+        left = None
+        fraction = self._fraction()
+        if self.total and fraction >= MIN_ESTIMATE:
+            rate = self.done / max(now - self.phase_started, 0.001)
+            left = (self.total - self.done) / rate
+        if overall is None:
+            return left
+        if overall < MIN_ESTIMATE:
+            return None
+        # seconds per unit of weight so far, for the phases still to come
+        per_weight = (now - self.started) / (overall * self._plan_weight())
+        rest = sum([self._weight(n) for n in self.plan[self.index + 1:]])
+        if left is None or self.name not in self.plan:
+            left = self._weight(self.name) * (1 - fraction) * per_weight
+        return left + rest * per_weight
+
+    def _event(self, finished=False, ok=True):
+        now = time.time()
+        overall = self._overall()
+        eta = self._eta(now, overall)
+        if finished:
+            eta = 0
+            if ok and self.plan is not None:
+                overall = self.overall = 1.0
+        return Event(self.name, self.title, self.done, self.total,
+                     self._fraction(), overall, now - self.started, eta,
+                     finished, ok)
+
+    def _publish(self, event):
+        for callback in list(self.subscribers):
+            try:
+                callback(event)
+            except Exception, e:
+                logger.debug("Progress subscriber %r failed: %s" %
+                             (callback, e))
+
+    def phase(self, name, total=None, title=None):
+        self.lock.acquire()
+        try:
+            if self.plan is not None and name in self.plan:
+                self.index = max(self.index, self.plan.index(name))
+            self.name = name
+            self.title = title or PHASES.get(name, (name, 0))[0]
+            self.phase_started = time.time()
+            self.done = 0
+            self.total = total
+            if self.subscribers:
+                self._publish(self._event())
+        finally:
+            self.lock.release()
+
+    def advance(self, done, total=None):
+        self.lock.acquire()
+        try:
+            if total is not None and total != self.total:
+                # the phase learned its size only now
+                self.phase_started = time.time()
+                self.total = total
+            self.done = done
+            if self.subscribers:
+                self._publish(self._event())
+        finally:
+            self.lock.release()
+
+    def finish(self, ok=True):
+        self.lock.acquire()
+        try:
+            if self.subscribers:
+                self._publish(self._event(True, ok))
+        finally:
+            self.lock.release()
+
+
+_tracker = Tracker()
+
+
+def start(plan=None):
+    """Starts tracking the phases of plan, a list of phase names."""
+    _tracker.lock.acquire()
+    try:
+        _tracker.start(plan)
+    finally:
+        _tracker.lock.release()
+
+
+def phase(name, total=None, title=None):
+    """Announces that phase name begins, of total bytes if known."""
+    _tracker.phase(name, total, title)
+
+
+def advance(done, total=None, path=None):
+    """Announces done of total bytes of the current phase; a progress
+    callback for lvmplan.create() and imagecopy.copy_files()."""
+    _tracker.advance(done, total)
+
+
+def finish(ok=True):
+    _tracker.finish(ok)
+
+
+def subscribe(callback):
+    _tracker.lock.acquire()
+    try:
+        _tracker.subscribers.append(callback)
+    finally:
+        _tracker.lock.release()
+
+
+def unsubscribe(callback):
+    _tracker.lock.acquire()
+    try:
+        if callback in _tracker.subscribers:
+            _tracker.subscribers.remove(callback)
+    finally:
+        _tracker.lock.release()
+
+
+class Throttle(object):
+    """Passes events on to callback, phase changes and the end at once,
+    others when interval seconds have passed since the last one."""
+
+    def __init__(self, callback, interval=REDRAW_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self.last = 0
+        self.name = None
+
+    def __call__(self, event):
+        now = time.time()
+        if event.name == self.name and not event.finished and \
+                now - self.last < self.interval:
+            return
+        self.name = event.name
+        self.last = now
+        self.callback(event)
+
+
+def format_size(size):
+    if size >= 10 * 1024 ** 3:
+        return "%.1fGiB" % (size / 1024.0 ** 3)
+    return "%dMiB" % (size >> 20)
+
+
+def format_seconds(seconds):
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return "%d:%02d:%02d" % (seconds / 3600, seconds / 60 % 60,
+                                 seconds % 60)
+    return "%d:%02d" % (seconds / 60, seconds % 60)
+
+
+def describe(event):
+    """Returns a line like "Copying the image: 40% (80MiB of 200MiB),
+    about 1:05 left"."""
+    text = event.title or ""
+    if event.total:
+        text = "%s: %d%% (%s of %s)" % (text, event.fraction * 100,
+                                         format_size(event.done),
+                                         format_size(event.total))
+    if event.eta >= 1 and not event.finished:
+        text = "%s, about %s left" % (text, format_seconds(event.eta))
+    return text
+
+
+def serial_console(fd=0):
+    """True if fd is a serial terminal, or /dev/console is one."""
+    try:
+        name = os.path.basename(os.ttyname(fd))
+    except (OSError, AttributeError):
+        return False
+    if name == "console":
+        # the last console listed is the one /dev/console writes to
+        try:
+            f = open("/sys/class/tty/console/active")
+            try:
+                active = f.read().split()
+            finally:
+                f.close()
+        except IOError:
+            return False
+        if not active:
+            return False
+        name = active[-1]
+    return name.startswith(SERIAL_TTYS)
+
+
+def redraw_interval(fd=0):
+    """Returns the seconds between screen updates for the terminal."""
+    if serial_console(fd):
+        return SERIAL_REDRAW_INTERVAL
+    return REDRAW_INTERVAL
+
+
+class TextReporter(object):
+    """Prints a line per phase and, throttled by interval, per update,
+    for consoles and logs that cannot be redrawn."""
+
+    def __init__(self, stream=None, interval=TEXT_INTERVAL):
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.last = 0
+        self.name = None
+        self.percent = None
+
+    def __call__(self, event):
+        now = time.time()
+        if event.finished:
+            if not event.ok:
+                return
+            line = "Completed in %s" % format_seconds(event.elapsed)
+        elif event.name != self.name:
+            line = describe(event)
+        elif now - self.last < self.interval or \
+                event.percent == self.percent:
+            return
+        else:
+            line = describe(event)
+        if event.overall is not None and not event.finished:
+            line = "[%3d%%] %s" % (event.percent, line)
+        self.name = event.name
+        self.last = now
+        self.percent = event.percent
+        self.stream.write(line + "\n")
+        self.stream.flush()
@@ -0,0 +1,433 @@
+#!/usr/bin/python
+# rtnetlink.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Links, addresses and routes read over rtnetlink.
+
+A Snapshot holds the result of one RTM_GETLINK, RTM_GETADDR and
+RTM_GETROUTE dump each, taken without spawning ip(8) or ethtool(8).
+NetworkState caches a snapshot and listens on the link, address and
+route multicast groups; the cached snapshot is replaced once the
+kernel reports a change.
+"""
+
+import os
+import errno
+import select
+import socket
+import struct
+import logging
+import threading
+
+logger = logging.getLogger("ovirtnode.rtnetlink")
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_DUMP = 0x300
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+ALL_GROUPS = (RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE |
+              RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE)
+
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_MASTER = 10
+IFLA_OPERSTATE = 16
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_TABLE = 15
+
+IFF_UP = 0x1
+IFF_LOOPBACK = 0x8
+IFF_LOWER_UP = 0x10000
+
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_LINK = 253
+RT_SCOPE_HOST = 254
+RT_TABLE_MAIN = 254
+
+OPERSTATES = ["unknown", "notpresent", "down", "lowerlayerdown",
+              "testing", "dormant", "up"]
+
+NLMSGHDR = struct.Struct("IHHII")
+IFINFOMSG = struct.Struct("BxHiII")
+IFADDRMSG = struct.Struct("BBBBI")
+RTMSG = struct.Struct("BBBBBBBBI")
+RTATTR = struct.Struct("HH")
+
+RECV_SIZE = 65536
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _attributes(data, offset):
+    """Returns {type: payload} of the rtattrs in data from offset."""
+    attrs = {}
+    while offset + RTATTR.size <= len(data):
+        length, kind = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[kind] = data[offset + RTATTR.size:offset + length]
+        offset = offset + _align(length)
+    return attrs
+
+
+def _string(value):
+    return value.split("\0", 1)[0]
+
+
+def _u32(value):
+    return struct.unpack("I", value[:4])[0]
+
+
+def _mac(value):
+    return ":".join(["%02x" % ord(c) for c in value])
+
+
+def _address(family, value):
+    if family == socket.AF_INET6:
+        return socket.inet_ntop(socket.AF_INET6, value)
+    return socket.inet_ntoa(value)
+
+
+def prefix_to_netmask(prefixlen):
+    bits = (0xffffffff << (32 - prefixlen)) & 0xffffffff
+    return socket.inet_ntoa(struct.pack("!I", bits))
+
+
+class Link(object):
+
+    def __init__(self, index, name, flags, mtu=None, address=None,
+                 operstate="unknown", master=None):
+        self.index = index
+        self.name = name
+        self.flags = flags
+        self.mtu = mtu
+        self.address = address
+        self.operstate = operstate
+        self.master = master
+
+    @property
+    def up(self):
+        return bool(self.flags & IFF_UP)
+
+    @property
+    def carrier(self):
+        """True if a link is detected, as ethtool reports it."""
+        return bool(self.flags & IFF_LOWER_UP)
+
+    @property
+    def loopback(self):
+        return bool(self.flags & IFF_LOOPBACK)
+
+    def __repr__(self):
+        return "<Link %d %s %s>" % (self.index, self.name, self.operstate)
+
+
+class Address(object):
+
+    def __init__(self, index, family, address, prefixlen, scope, label=None):
+        self.index = index
+        self.family = family
+        self.address = address
+        self.prefixlen = prefixlen
+        self.scope = scope
+        self.label = label
+
+    @property
+    def netmask(self):
+        if self.family == socket.AF_INET:
+            return prefix_to_netmask(self.prefixlen)
+        return str(self.prefixlen)
+
+    def __repr__(self):
+        return "<Address %s/%d>" % (self.address, self.prefixlen)
+
+
+class Route(object):
+
+    def __init__(self, family, dst, dst_len, gateway, oif, table,
+                 priority=None, scope=RT_SCOPE_UNIVERSE):
+        self.family = family
+        self.dst = dst
+        self.dst_len = dst_len
+        self.gateway = gateway
+        self.oif = oif
+        self.table = table
+        self.priority = priority
+        self.scope = scope
+
+    @property
+    def default(self):
+        return self.dst_len == 0
+
+    def __repr__(self):
+        return "<Route %s/%d via %s oif %s>" % (self.dst or "default",
+                                                self.dst_len, self.gateway,
+                                                self.oif)
+
+
+def _parse_link(data, offset):
+    family, kind, index, flags, change = IFINFOMSG.unpack_from(data, offset)
+    attrs = _attributes(data, offset + IFINFOMSG.size)
+    operstate = "unknown"
+    if IFLA_OPERSTATE in attrs:
+        state = ord(attrs[IFLA_OPERSTATE][0])
+        if state < len(OPERSTATES):
+            operstate = OPERSTATES[state]
+    return Link(index, _string(attrs.get(IFLA_IFNAME, "")), flags,
+                IFLA_MTU in attrs and _u32(attrs[IFLA_MTU]) or None,
+                IFLA_ADDRESS in attrs and _mac(attrs[IFLA_ADDRESS]) or None,
+                operstate,
+                IFLA_MASTER in attrs and _u32(attrs[IFLA_MASTER]) or None)
+
+
+def _parse_address(data, offset):
+    family, prefixlen, flags, scope, index = IFADDRMSG.unpack_from(data, offset)
+    attrs = _attributes(data, offset + IFADDRMSG.size)
+    # for IPv4 IFA_ADDRESS is the peer on point-to-point links
+    value = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+    if value is None:
+        return None
+    label = IFA_LABEL in attrs and _string(attrs[IFA_LABEL]) or None
+    return Address(index, family, _address(family, value), prefixlen, scope,
+                   label)
+
+
+def _parse_route(data, offset):
+    (family, dst_len, src_len, tos, table, protocol, scope, kind,
+     flags) = RTMSG.unpack_from(data, offset)
+    attrs = _attributes(data, offset + RTMSG.size)
+    if RTA_TABLE in attrs:
+        table = _u32(attrs[RTA_TABLE])
+    dst = RTA_DST in attrs and _address(family, attrs[RTA_DST]) or None
+    gateway = RTA_GATEWAY in attrs and \
+        _address(family, attrs[RTA_GATEWAY]) or None
+    return Route(family, dst, dst_len, gateway,
+                 RTA_OIF in attrs and _u32(attrs[RTA_OIF]) or None, table,
+                 RTA_PRIORITY in attrs and _u32(attrs[RTA_PRIORITY]) or None,
+                 scope)
+
+
+class NetlinkSocket(object):
+    """A NETLINK_ROUTE socket, optionally bound to multicast groups."""
+
+    def __init__(self, groups=0):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  NETLINK_ROUTE)
+        self.sock.bind((0, groups))
+        self.seq = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def dump(self, kind, body):
+        """Sends a dump request and returns [(type, data, offset)] of
+        every message in the reply."""
+        self.seq = self.seq + 1
+        header = NLMSGHDR.pack(NLMSGHDR.size + len(body), kind,
+                               NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0)
+        self.sock.send(header + body)
+        messages = []
+        while True:
+            data = self.sock.recv(RECV_SIZE)
+            offset = 0
+            while offset + NLMSGHDR.size <= len(data):
+                length, kind, flags, seq, pid = \
+                    NLMSGHDR.unpack_from(data, offset)
+                if length < NLMSGHDR.size:
+                    return messages
+                if seq == self.seq:
+                    if kind == NLMSG_DONE:
+                        return messages
+                    if kind == NLMSG_ERROR:
+                        code = struct.unpack_from("i", data,
+                                                  offset + NLMSGHDR.size)[0]
+                        if code:
+                            raise OSError(-code, os.strerror(-code))
+                        return messages
+                    messages.append((kind, data, offset + NLMSGHDR.size))
+                offset = offset + _align(length)
+
+    def pending(self, timeout=0):
+        """Reads the queued notifications and returns their count."""
+        count = 0
+        while select.select([self.sock], [], [], timeout)[0]:
+            try:
+                data = self.sock.recv(RECV_SIZE)
+            except socket.error, e:
+                # ENOBUFS: notifications were lost, count it as a change
+                if e.args[0] != errno.ENOBUFS:
+                    raise
+                count = count + 1
+                continue
+            count = count + 1
+            timeout = 0
+        return count
+
+
+class Snapshot(object):
+    """Links, addresses and routes at one point in time."""
+
+    def __init__(self, links, addresses, routes):
+        self.links = links
+        self.addresses = addresses
+        self.routes = routes
+        self._by_name = {}
+        self._by_index = {}
+        for link in links:
+            self._by_name[link.name] = link
+            self._by_index[link.index] = link
+
+    @classmethod
+    def take(cls, nl=None):
+        own = nl is None
+        if own:
+            nl = NetlinkSocket()
+        try:
+            links = [_parse_link(data, offset) for kind, data, offset in
+                     nl.dump(RTM_GETLINK, IFINFOMSG.pack(0, 0, 0, 0, 0))]
+            addresses = []
+            for kind, data, offset in nl.dump(RTM_GETADDR,
+                                              IFADDRMSG.pack(0, 0, 0, 0, 0)):
+                address = _parse_address(data, offset)
+                if address is not None:
+                    addresses.append(address)
+            routes = [_parse_route(data, offset) for kind, data, offset in
+                      nl.dump(RTM_GETROUTE,
+                              RTMSG.pack(0, 0, 0, 0, 0, 0, 0, 0, 0))]
+        finally:
+            if own:
+                nl.close()
+        return cls(links, addresses, routes)
+
+    def link(self, name):
+        return self._by_name.get(name)
+
+    def link_by_index(self, index):
+        return self._by_index.get(index)
+
+    def addresses_of(self, name, family=None, scope=None):
+        link = self.link(name)
+        if link is None:
+            return []
+        return [a for a in self.addresses if a.index == link.index and
+                (family is None or a.family == family) and
+                (scope is None or a.scope == scope)]
+
+    def default_gateways(self, name, family=socket.AF_INET):
+        """Returns the gateways of the default routes through name in the
+        main table."""
+        link = self.link(name)
+        if link is None:
+            return []
+        return [r.gateway for r in self.routes if r.default and
+                r.family == family and r.oif == link.index and
+                r.table == RT_TABLE_MAIN and r.gateway]
+
+    def has_global_address(self):
+        for address in self.addresses:
+            if address.scope == RT_SCOPE_UNIVERSE:
+                return True
+        return False
+
+
+class NetworkState(object):
+    """Cached Snapshot, replaced when the kernel announces a change."""
+
+    def __init__(self, groups=ALL_GROUPS):
+        self.groups = groups
+        self._lock = threading.Lock()
+        self._events = None
+        self._snapshot = None
+
+    def _subscribe(self):
+        if self._events is None:
+            try:
+                self._events = NetlinkSocket(self.groups)
+            except socket.error, e:
+                logger.debug("No netlink notifications: %s" % e)
+                return False
+        return True
+
+    def snapshot(self):
+        self._lock.acquire()
+        try:
+            # without notifications every call takes a new snapshot
+            subscribed = self._subscribe()
+            if subscribed and self._events.pending():
+                self._snapshot = None
+            if self._snapshot is None or not subscribed:
+                self._snapshot = Snapshot.take()
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        self._lock.acquire()
+        try:
+            self._snapshot = None
+        finally:
+            self._lock.release()
+
+    def wait(self, timeout=None):
+        """Blocks until a change is announced or timeout seconds passed;
+        returns True on a change."""
+        if not self._subscribe():
+            return False
+        if self._events.pending(timeout):
+            self.invalidate()
+            return True
+        return False
+
+
+state = NetworkState()
+
+
+def snapshot():
+    return state.snapshot()
@@ -1,22 +1,26 @@
 
 from ovirtnode.ovirtfunctions import *
+from ovirtnode.spans import span
 import os
 
 def enable_snmpd(password):
     conf = "/etc/snmp/snmpd.conf"
-    system("service snmpd stop")
-    system("sed -c -ie '/^createUser root/d' %s" % conf)
-    f = open(conf, "a")
+    system(["service", "snmpd", "stop"])
+    lines = [l for l in read_file(conf).splitlines(True)
+             if not l.startswith("createUser root")]
+    f = open(conf, "w")
+    f.writelines(lines)
     # create user account
     f.write("createUser root SHA %s AES\n" % password)
     f.close()
-    system("service snmpd start")
+    system(["service", "snmpd", "start"])
     ovirt_store_config(conf)
 
 def disable_snmpd():
-    system("service snmpd stop")
+    system(["service", "snmpd", "stop"])
     remove_config("/etc/snmp/snmpd.conf")
 
+@span("snmp_auto")
 def snmp_auto():
     if OVIRT_VARS.has_key("OVIRT_SNMP_PASSWORD"):
         enable_snmpd(OVIRT_VARS["OVIRT_SNMP_PASSWORD"])
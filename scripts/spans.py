@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# spans.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Timing spans for the install and configuration phases.
+
+A span is used as a context manager or as a decorator:
+
+    with span("storage.wipe", disk=dev):
+        ...
+
+    @span("install.grub_install")
+    def grub_install(self):
+        ...
+
+When a span ends, one line is logged to ovirt.log:
+
+    SPAN {"name": ..., "start": ..., "duration": ..., "spawns": ...}
+
+The JSON object gives the name and parent of the span, its start, end
+and duration, the children spawned through ovirtnode.process, the time
+spent in them and the slowest one, and the outcome.  The outcome is
+"ok", "failed" when a decorated function returns False, or "error"
+when it raises.  ovirt-profile summarizes these lines.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+import json
+import ovirtnode.process as process
+
+logger = logging.getLogger("ovirtnode.spans")
+
+MARKER = "SPAN "
+
+_local = threading.local()
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _slowest_spawn(since):
+    slowest = None
+    for timestamp, command, returncode, duration in process.spawn_log():
+        if timestamp - duration < since:
+            continue
+        if slowest is None or duration > slowest[1]:
+            slowest = (command, duration)
+    return slowest
+
+
+class span(object):
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.outcome = None
+
+    def __call__(self, func):
+        name = self.name
+        attrs = self.attrs
+        def wrapper(*args, **kwargs):
+            s = span(name, **attrs)
+            s.__enter__()
+            try:
+                result = func(*args, **kwargs)
+            except:
+                s.__exit__(*sys.exc_info())
+                raise
+            if result is False:
+                s.outcome = "failed"
+            s.__exit__(None, None, None)
+            return result
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.__dict__.update(func.__dict__)
+        return wrapper
+
+    def __enter__(self):
+        stack = _stack()
+        self.parent = stack and stack[-1].name or None
+        self.depth = len(stack)
+        stack.append(self)
+        self.start = time.time()
+        self.spawns = process.spawn_count()
+        self.spawn_time = process.spawn_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = time.time()
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        record = {
+            "name": self.name,
+            "parent": self.parent,
+            "depth": self.depth,
+            "pid": os.getpid(),
+            "start": round(self.start, 3),
+            "end": round(end, 3),
+            "duration": round(end - self.start, 3),
+            "spawns": process.spawn_count() - self.spawns,
+            "child_time": round(process.spawn_time() - self.spawn_time, 3),
+        }
+        if exc_type is not None:
+            record["outcome"] = "error"
+            record["error"] = "%s: %s" % (exc_type.__name__, exc_value)
+        else:
+            record["outcome"] = self.outcome or "ok"
+        slowest = _slowest_spawn(self.start)
+        if slowest is not None:
+            record["slowest"] = [slowest[0], round(slowest[1], 3)]
+        if self.attrs:
+            record["attrs"] = self.attrs
+        try:
+            logger.info(MARKER + json.dumps(record, sort_keys=True))
+        except (TypeError, ValueError), e:
+            logger.debug("Unable to log span %s: %s" % (self.name, e))
+        return False
+
+
+def parse(line):
+    """Returns the record of a SPAN log line, or None."""
+    i = line.find(MARKER + "{")
+    if i < 0:
+        return None
+    try:
+        return json.loads(line[i + len(MARKER):])
+    except ValueError:
+        return None
@@ -18,19 +18,31 @@
 # also available at http://www.gnu.org/copyleft/gpl.html.
 
 from ovirtnode.ovirtfunctions import *
+import ovirtnode.process as process
+import ovirtnode.blockinventory as blockinventory
+import ovirtnode.partplan as partplan
+import ovirtnode.devwait as devwait
+import ovirtnode.diskwipe as diskwipe
+import ovirtnode.lvmplan as lvmplan
+import ovirtnode.alignment as alignment
+import ovirtnode.progress as progress
+from ovirtnode.spans import span
+from ovirtnode.workers import parallel_map, JobError
 import os
+import glob
 import time
 import re
 import subprocess
 from subprocess import PIPE, STDOUT
-import gudev
 import logging
 
+# drives partitioned at the same time for HostVG and AppVG
+DISK_WORKERS = 8
+
 class Storage:
     def __init__(self):
         logger = logging.getLogger(PRODUCT_SHORT)
         logger.propagate = False
-        OVIRT_VARS = parse_defaults()
         self.overcommit=0.5
         self.BOOT_SIZE=50
         self.ROOT_SIZE=256
@@ -48,6 +60,8 @@ class Storage:
         self.DATA_SIZE = -1
         # gpt or msdos partition table type
         self.LABEL_TYPE="gpt"
+        # partplan.Layout written to each drive, by translated drive
+        self.layouts = {}
         if OVIRT_VARS.has_key("OVIRT_INIT"):
             OVIRT_VARS["OVIRT_INIT"] = OVIRT_VARS["OVIRT_INIT"].strip(",")
             if "," in OVIRT_VARS["OVIRT_INIT"]:
@@ -65,9 +79,10 @@ class Storage:
                 logger.info(self.BOOTDRIVE)
                 logger.info(self.ROOTDRIVE)
                 self.BOOTDRIVE = translate_multipath_device(self.ROOTDRIVE)
-        mem_size_cmd = "awk '/MemTotal:/ { print $2 }' /proc/meminfo"
-        mem_size_mb = subprocess.Popen(mem_size_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        MEM_SIZE_MB = mem_size_mb.stdout.read()
+        MEM_SIZE_MB = 0
+        for line in read_file("/proc/meminfo").splitlines():
+            if line.startswith("MemTotal:"):
+                MEM_SIZE_MB = line.split()[1]
         MEM_SIZE_MB= int(MEM_SIZE_MB) / 1024
         # we multiply the overcommit coefficient by 10 then divide the
         # product by 10 to avoid decimals in the result
@@ -119,22 +134,26 @@ class Storage:
                 return True
 
     def get_drive_size(self, drive):
-        size_cmd = "sfdisk -s " + drive + " 2>null"
-        size = subprocess.Popen(size_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        size = size.stdout.read()
+        size = process.output(["sfdisk", "-s", drive])
         size = int(int(size) / 1024)
         return size
 
 
     def wipe_lvm_on_disk(self, dev):
+        if diskwipe.lvm_labels(dev) is False:
+            logger.debug("No LVM labels on %s" % dev)
+            return
         part_delim="p"
         if "/dev/sd" in dev:
             part_delim=""
-        vg_cmd = "pvs -o vg_uuid --noheadings \"%s\" \"%s%s\"[0-9]* 2>/dev/null|sort -u" % (dev, dev, part_delim)
-        vg_proc = subprocess.Popen(vg_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        for vg in vg_proc.stdout.read().split():
-            pvs_cmd="pvs -o pv_name,vg_uuid --noheadings | grep \"%s\" | egrep -v -q \"%s%s[0-9]+|%s \"" % (vg, dev, part_delim, dev)
-            if system(pvs_cmd):
+        parts = glob.glob("%s%s[0-9]*" % (dev, part_delim))
+        vg_proc = process.run(["pvs", "-o", "vg_uuid", "--noheadings", dev] + parts)
+        own_pv = re.compile("%s%s[0-9]+|%s " % (re.escape(dev), part_delim, re.escape(dev)))
+        for vg in sorted(set(vg_proc.stdout.split())):
+            pvs = process.run(["pvs", "-o", "pv_name,vg_uuid", "--noheadings"])
+            foreign_pvs = [pv for pv in pvs.stdout.splitlines()
+                           if vg in pv and not own_pv.search(pv)]
+            if foreign_pvs:
                 logger.error("The volume group \"%s\" spans multiple disks." % vg)
                 logger.error("This operation cannot complete.  Please manually cleanup the storage using standard disk tools.")
                 sys.exit(1)
@@ -142,43 +161,44 @@ class Storage:
         return
 
 
-    def reread_partitions(self, drive):
-        if "dev/mapper" in drive:
-            # kpartx -a -p p "$drive"
-            # XXX fails with spaces in device names (TBI)
-            # ioctl(3, DM_TABLE_LOAD, 0x966980) = -1 EINVAL (Invalid argument)
-            # create/reload failed on 0QEMU    QEMU HARDDISK   drive-scsi0-0-0p1
-            system("partprobe")
-            # partprobe fails on cdrom:
-            # Error: Invalid partition table - recursive partition on /dev/sr0.
-            system("service multipathd reload")
-
-        else:
-            system("blockdev --rereadpt " + drive + " &>>/dev/null")
+    # rereads the partition tables of drives one after the other and
+    # reloads the multipath maps once, with no drive being written
+    def reread_partitions(self, drives):
+        mapper = False
+        for drive in drives:
+            if "dev/mapper" in drive:
+                # kpartx -a -p p "$drive"
+                # XXX fails with spaces in device names (TBI)
+                # ioctl(3, DM_TABLE_LOAD, 0x966980) = -1 EINVAL (Invalid argument)
+                # create/reload failed on 0QEMU    QEMU HARDDISK   drive-scsi0-0-0p1
+                # only this drive, partprobe fails on cdrom:
+                # Error: Invalid partition table - recursive partition on /dev/sr0.
+                system(["partprobe", drive])
+                mapper = True
+            else:
+                system(["blockdev", "--rereadpt", drive])
+        if mapper:
+            system(["service", "multipathd", "reload"])
+        if drives and os.path.exists("/dev/cciss"):
+            # force reload some cciss devices will fail to mkfs
+            system(["multipath", "-r"])
+        labelindex.invalidate()
 
 
+    # kernel name of the device with major:minor id
     def get_sd_name(self, id):
-        device_sys_cmd = "grep -H \"^%s$\" /sys/block/*/dev | cut -d: -f1" % id
-        device_sys = subprocess.Popen(device_sys_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        device_sys_output = device_sys.stdout.read().strip()
-        if not device_sys_output is "":
-            device = os.path.basename(os.path.dirname(device_sys_output))
-            return device
+        device = blockinventory.current().get(id)
+        if device is not None:
+            return device.name
 
 
     # gets the dependent block devices for multipath devices
     def get_multipath_deps(self, mpath_device):
-        deplist=""
-        #get dependencies for multipath device
-        deps_cmd = "dmsetup deps -u mpath-%s | sed 's/^.*: //' \
-        | sed 's/, /:/g' | sed 's/[\(\)]//g'" % mpath_device
-        deps = subprocess.Popen(deps_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        deps_output = deps.stdout.read()
-        for dep in deps_output.split():
-            device=self.get_sd_name(dep)
-            if device is not None:
-                deplist = "%s %s" % (device, deplist)
-        return deplist
+        inventory = blockinventory.current()
+        mpath = inventory.by_dm_name(mpath_device)
+        if mpath is None:
+            return ""
+        return " ".join([d.name for d in inventory.slaves_of(mpath)])
 
         return (dev_names.sort(), self.disk_dict)
 
@@ -190,89 +210,17 @@ class Storage:
     # selected name, then return 0.
     # Sample output: /dev/sda
     def get_dev_name(self):
-        devices = []
-        # list separator
-        for d in os.listdir("/sys/block/"):
-            if re.match("^[hsv]+d", d):
-                devices.append("/dev/%s" % d)
-            byid_list_cmd = "find /dev/disk/by-id -mindepth 1 -not -name '*-part*' 2>/dev/null"
-            byid_list = subprocess.Popen(byid_list_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-            byid_list_output = byid_list.stdout.read()
-        for d in byid_list_output.split():
-            d = os.readlink(d)
-            d_basename = os.path.basename(d)
-            udev_cmd = "udevadm info --name=/dev/" + d_basename + " --query=property | grep -q ^ID_BUS: &>>/dev/null"
-            if os.system(udev_cmd):
-                devices.append("/dev/%s" % d_basename)
-        # FIXME: workaround for detecting cciss devices
-        if os.path.exists("/dev/cciss"):
-            for d in os.listdir("/dev/cciss"):
-                if not re.match("p[0-9]+\$", d):
-                     devices.append("/dev/cciss/%s" % d)
-
-        # include multipath devices
-        devs_to_remove=""
-        multipath_list_cmd = "dmsetup ls --target=multipath | cut -f1"
-        multipath_list = subprocess.Popen(multipath_list_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        multipath_list_output = multipath_list.stdout.read()
-
-        for d in multipath_list_output.split():
-            devices.append("/dev/mapper/%s" % d)
-            sd_devs=""
-            sd_devs = self.get_multipath_deps(d)
-
-            dm_dev_cmd = "multipath -ll \"%s\" | grep \"%s\" | sed -r 's/^.*(dm-[0-9]+ ).*$/\\1/'" % (d, d)
-            dm_dev = subprocess.Popen(dm_dev_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-            dm_dev_output = dm_dev.stdout.read()
-            devs_to_remove="%s %s %s" % (devs_to_remove, sd_devs, dm_dev_output)
-        # Remove /dev/sd* devices that are part of a multipath device
-        dev_list=[]
-        for d in devices:
-            if os.path.basename(d) not in devs_to_remove and not "/dev/dm-" in d:
-                 dev_list.append(d)
-
-        for dev in dev_list:
-            if dev_list.count(dev) > 1:
-                count = dev_list.count(dev)
-                while (count > 1):
-                    dev_list.remove(dev)
-                    count = count - 1
-        return dev_list
+        # multipath maps stand in for their paths, see
+        # blockinventory.Inventory.disks()
+        inventory = blockinventory.refresh()
+        return [disk.path for disk in inventory.disks()]
 
+    # Returns the install candidates and {path: BlockDevice} for them
     def get_udev_devices(self):
         self.disk_dict = {}
-        client = gudev.Client(['block'])
-        for device in client.query_by_subsystem("block"):
-            dev_name = device.get_property("DEVNAME")
-            dev_bus = device.get_property("ID_BUS")
-            dev_model = device.get_property("ID_MODEL")
-            dev_serial = device.get_property("ID_SERIAL")
-            dev_desc = device.get_property("ID_SCSI_COMPAT")
-            dev_size_cmd = "sfdisk -s %s 2>/dev/null" % dev_name
-            dev_size = subprocess.Popen(dev_size_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-            dev_size = dev_size.stdout.read()
-            size_failed = 0
-            if not device.get_property("ID_CDROM"):
-                try:
-                    dev_size = int(dev_size) / 1024 /1024
-                except:
-                   size_failed = 1
-            if not dev_desc:
-                if "/dev/vd" in dev_name:
-                    dev_desc = "virtio disk"
-                else:
-                    dev_desc = "unknown"
-            if not device.get_property("ID_CDROM") and not "/dev/dm-" in dev_name and not "/dev/loop" in dev_name and size_failed == 0:
-                dev_name = translate_multipath_device(dev_name)
-                if dev_bus == "usb":
-                    dev_bus = "USB Device          "
-                elif dev_bus == "ata" or dev_bus == "scsi" or dev_bus == "cciss" or "/dev/vd" in dev_name:
-                    dev_bus = "Local / FibreChannel"
-                else:
-                    dev_bus = "                    "
-
-                self.disk_dict[dev_name] = "%s,%s,%s,%s,%s,%s" % (dev_bus,dev_name,dev_size,dev_desc,dev_serial,dev_model)
         devs = self.get_dev_name()
+        for disk in blockinventory.current().disks():
+            self.disk_dict[disk.path] = disk
         return (sorted(devs), self.disk_dict)
 
     def check_partition_sizes(self):
@@ -319,120 +267,200 @@ class Storage:
                 logger.info("Required Space : " + drive_need_size + "MB")
                 return True
 
-    def create_hostvg(self):
-        logger.info("Creating LVM partition")
-        self.physical_vols = []
+    # waits up to timeout seconds for partition number of drive, and
+    # with layout until the kernel has its new extent rather than one
+    # left from the old table; returns its path or None
+    def find_partition(self, drive, number, layout=None, timeout=15):
+        deadline = time.time() + timeout
+        paths = partplan.partition_paths(drive, number)
+        while True:
+            path = devwait.wait_for_any(paths, max(deadline - time.time(), 0))
+            if path is None:
+                logger.error("Partition %d of %s is not available!" % (number, drive))
+                return None
+            if layout is None or self.has_new_extent(path, layout, number):
+                return path
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logger.error("Partition %d of %s still has its old extent" %
+                             (number, drive))
+                return None
+            # the next block uevent brings a new scan
+            if not blockinventory.state.wait(min(remaining, 1)):
+                blockinventory.refresh()
+
+    # True if the kernel has partition number of layout at path where
+    # layout put it; device-mapper partitions only report their size
+    def has_new_extent(self, path, layout, number):
+        part = [p for p in layout.partitions if p.number == number][0]
+        ss = layout.sector_size
+        device = blockinventory.current().get(path)
+        if device is None or device.size != (part.end - part.start + 1) * ss:
+            return False
+        return device.start is None or device.start == part.start * ss
+
+    def hostvg_drives(self):
+        drives = []
         for drv in self.HOSTVGDRIVE.strip(",").split(","):
             drv = translate_multipath_device(drv)
-            if drv != "":
-                if self.ROOTDRIVE == drv:
-                    self.reread_partitions(self.ROOTDRIVE)
-                    parted_cmd = "parted \"" + drv + "\" -s \"mkpart primary ext2 "+ str(self.RootBackup_end) +"M -1\""
-                    logger.debug(parted_cmd)
-                    system(parted_cmd)
-                    hostvgpart="4"
-                elif self.BOOTDRIVE == drv:
-                    parted_cmd = "parted \"" + drv + "\" -s \"mkpart primary ext2 " + str(self.boot_size_si) + " -1\""
-                    logger.debug(parted_cmd)
-                    system(parted_cmd)
-                    hostvgpart="2"
-                    self.ROOTDRIVE = self.BOOTDRIVE
-                elif self.ISCSIDRIVE == drv:
-                    parted_cmd = "parted \"" + drv + "\" -s \"mkpart primary ext2 512M -1\""
-                    logger.debug(parted_cmd)
-                    system(parted_cmd)
-                    hostvgpart="3"
-                else:
-                    system("parted \""+ drv +"\" -s \"mklabel "+self.LABEL_TYPE+"\"")
-                    parted_cmd = "parted \""+ drv + "\" -s \"mkpart primary ext2 1M -1 \""
-                    logger.debug(parted_cmd)
-                    system(parted_cmd)
-                    hostvgpart = "1"
-                logger.info("Toggling LVM on")
-                parted_cmd = "parted \"" + drv +  "\" -s \"set " + str(hostvgpart) + " lvm on\""
-                logger.debug(parted_cmd)
-                system(parted_cmd)
-                system("parted \"" + self.ROOTDRIVE + "\" -s \"print\"")
-                system("udevadm settle 2> /dev/null || udevsettle &>/dev/null")
-                self.reread_partitions(drv)
-                # sync GPT to the legacy MBR partitions
-                if OVIRT_VARS.has_key("OVIRT_INSTALL_ROOT") and OVIRT_VARS["OVIRT_INSTALL_ROOT"] == "y" :
-                    if self.LABEL_TYPE == "gpt":
-                        logger.info("Running gptsync to create legacy mbr")
-                        system("gptsync \"" + self.ROOTDRIVE + "\"")
-
-                partpv = drv + hostvgpart
-                if not os.path.exists(partpv):
-                    # e.g. /dev/cciss/c0d0p2
-                    partpv = drv + "p" + hostvgpart
-                self.physical_vols.append(partpv)
-        drv_count = 0
+            if drv != "" and drv not in drives:
+                drives.append(drv)
+        return drives
+
+    # a layout aligned to the I/O topology of drive
+    def new_layout(self, drive):
+        found = alignment.topology(drive)
+        return partplan.Layout(self.LABEL_TYPE, found.logical, found.grain,
+                               found.offset)
+
+    # adds HostVG to the layout when drive is one of the HostVG drives
+    def add_hostvg(self, drive, layout):
+        if translate_multipath_device(drive) in self.hostvg_drives():
+            layout.add("HostVG", kind="lvm")
+
+    # wipes drive, including the starts of the new partitions, and
+    # writes its whole partition table at once; returns True if it did
+    def write_table(self, drive, layout):
+        try:
+            size = diskwipe.device_size(drive)
+            layout.plan(size / layout.sector_size)
+        except (OSError, ValueError), e:
+            logger.error("Unable to partition %s: %s" % (drive, e))
+            return False
+        wipe_partitions(drive, [p.start * layout.sector_size
+                                for p in layout.partitions])
+        logger.info("Partitioning %s" % drive)
+        try:
+            layout.write(drive)
+        except (OSError, ValueError), e:
+            logger.error("Unable to partition %s: %s" % (drive, e))
+            return False
+        self.layouts[translate_multipath_device(drive)] = layout
+        for line in alignment.report(
+                drive, alignment.topology(drive),
+                [(p.number, p.name, p.start) for p in layout.partitions],
+                layout.sector_size):
+            logger.info(line)
+        return True
+
+    # returns {partition name: device} of the partitions of layout
+    # on drive once they are available, or None
+    def layout_partitions(self, drive, layout):
+        parts = {}
+        for part in layout.partitions:
+            parts[part.name] = self.find_partition(drive, part.number,
+                                                   layout)
+            if parts[part.name] is None:
+                return None
+        return parts
+
+    # writes the partition table of drive and rereads it; returns
+    # {partition name: device} or None
+    def write_layout(self, drive, layout):
+        if not self.write_table(drive, layout):
+            return None
+        self.reread_partitions([drive])
+        return self.layout_partitions(drive, layout)
+
+    def create_physical_volume(self, partpv, layout):
+        logger.info("Creating physical volume on " + partpv)
+        if not system(["dd", "if=/dev/zero", "of=" + partpv, "bs=1024k", "count=1"]):
+            raise RuntimeError("Failed to wipe lvm partition " + partpv)
+        if not system(["pvcreate", "-ff", "-y"] +
+                      alignment.pvcreate_options(layout.alignment) +
+                      [partpv]):
+            raise RuntimeError("Failed to pvcreate on " + partpv)
+        return partpv
+
+    # gives each of drives a partition named vg for a physical volume,
+    # unless it was planned together with the Root or Boot partitions,
+    # and creates the physical volumes; returns them or None after
+    # logging every failed drive.  The tables are written side by side,
+    # then reread one drive at a time, as rescans and map reloads must
+    # not race with another drive being written or pvcreated.
+    def prepare_drives(self, drives, vg):
+        new = []
+        for drv in drives:
+            layout = self.layouts.get(translate_multipath_device(drv))
+            if layout is None or layout.partition(vg) is None:
+                new.append(drv)
+        try:
+            parallel_map(lambda drv: self.write_pv_table(drv, vg), new,
+                         min(len(new), DISK_WORKERS))
+            self.reread_partitions(new)
+            return parallel_map(lambda drv: self.prepare_pv(drv, vg),
+                                drives, min(len(drives), DISK_WORKERS))
+        except JobError, e:
+            for drv, exc_info in e.errors:
+                logger.error("Preparing %s for %s failed: %s" %
+                             (drv, vg, exc_info[1]))
+            return None
+
+    def write_pv_table(self, drv, vg):
+        layout = self.new_layout(drv)
+        layout.add(vg, kind="lvm")
+        if not self.write_table(drv, layout):
+            raise RuntimeError("Unable to partition " + drv)
+
+    def prepare_pv(self, drv, vg):
+        layout = self.layouts[translate_multipath_device(drv)]
+        partpv = self.find_partition(drv, layout.partition(vg).number,
+                                     layout)
+        if partpv is None:
+            raise RuntimeError("No %s partition on %s" % (vg, drv))
+        return self.create_physical_volume(partpv, layout)
+
+    @span("storage.create_hostvg")
+    def create_hostvg(self):
+        progress.phase("storage.hostvg")
+        logger.info("Creating LVM partition")
+        drives = self.hostvg_drives()
+        self.physical_vols = self.prepare_drives(drives, "HostVG")
+        if self.physical_vols is None:
+            return False
         logger.debug(self.physical_vols)
-        for partpv in self.physical_vols:
-            logger.info("Creating physical volume on " + partpv)
-            for drv in self.HOSTVGDRIVE.strip(",").split(","):
-                self.reread_partitions(drv)
-            i = 0
-            while not os.path.exists(partpv):
-                logger.error(partpv + "is not available!")
-                i = i + i
-                time.sleep(1)
-                if i == 15:
-                    return False
-            if not system("dd if=/dev/zero of=\"" + partpv + "\" bs=1024k count=1"):
-                logger.error("Failed to wipe lvm partition")
-                return False
-            if not system("pvcreate -ff -y \"" + partpv + "\""):
-                logger.error("Failed to pvcreate on " + partpv)
-                return False
-            if drv_count < 1:
-                logger.info("Creating volume group on " + partpv)
-                if not system("vgcreate /dev/HostVG \"" + partpv + "\""):
-                    logger.error("Failed to vgcreate /dev/HostVG on " + partpv)
-                    return False
-            else:
-                logger.info("Extending volume group on " + partpv)
-                if not system("vgextend /dev/HostVG \"" + partpv + "\""):
-                    logger.error("Failed to vgextend /dev/HostVG on " + partpv)
-                    return False
-            drv_count = drv_count + 1
+        if self.BOOTDRIVE in drives and self.ROOTDRIVE not in drives:
+            self.ROOTDRIVE = self.BOOTDRIVE
+        # sync GPT to the legacy MBR partitions
+        if OVIRT_VARS.has_key("OVIRT_INSTALL_ROOT") and OVIRT_VARS["OVIRT_INSTALL_ROOT"] == "y" :
+            if self.LABEL_TYPE == "gpt":
+                logger.info("Running gptsync to create legacy mbr")
+                system(["gptsync", self.ROOTDRIVE])
+        vg = lvmplan.VolumeGroup("HostVG", self.physical_vols)
         if self.SWAP_SIZE > 0:
-            logger.info("Creating swap partition")
-            system("lvcreate --name Swap --size "+str(self.SWAP_SIZE) + "M /dev/HostVG")
-            system("mkswap -L \"SWAP\" /dev/HostVG/Swap")
-            os.system("echo \"/dev/HostVG/Swap swap swap defaults 0 0\" >> /etc/fstab")
-            if OVIRT_VARS.has_key("OVIRT_CRYPT_SWAP"):
-                os.system("echo \"SWAP /dev/HostVG/Swap /dev/mapper/ovirt-crypt-swap " + OVIRT_VARS["OVIRT_CRYPT_SWAP"] + "\" >> /etc/ovirt-crypttab")
+            vg.add("Swap", self.SWAP_SIZE, "swap", "SWAP", "swap")
         if self.CONFIG_SIZE > 0:
-            logger.info("Creating config partition")
-            system("lvcreate --name Config --size "+str(self.CONFIG_SIZE)+"M /dev/HostVG")
-            system("mke2fs -j -t ext4 /dev/HostVG/Config -L \"CONFIG\"")
-            system("tune2fs -c 0 -i 0 /dev/HostVG/Config")
+            vg.add("Config", self.CONFIG_SIZE, "ext4", "CONFIG")
         if self.LOGGING_SIZE > 0:
-            logger.info("Creating log partition")
-            system("lvcreate --name Logging --size "+str(self.LOGGING_SIZE)+"M /dev/HostVG")
-            system("mke2fs -j -t ext4 /dev/HostVG/Logging -L \"LOGGING\"")
-            system("tune2fs -c 0 -i 0 /dev/HostVG/Logging")
-            os.system("echo \"/dev/HostVG/Logging /var/log ext4 defaults,noatime 0 0\" >> /etc/fstab")
+            vg.add("Logging", self.LOGGING_SIZE, "ext4", "LOGGING",
+                   "/var/log", "defaults,noatime")
         use_data=1
         if self.DATA_SIZE == -1:
             logger.info("Creating data partition with remaining free space")
-            system("lvcreate --name Data -l 100%FREE /dev/HostVG")
+            vg.add("Data", None, "ext4", "DATA", "/data", "defaults,noatime")
             use_data=0
         elif self.DATA_SIZE > 0:
-            logger.info("Creating data partition")
-            system("lvcreate --name Data --size "+str(self.DATA_SIZE)+"M /dev/HostVG")
+            vg.add("Data", self.DATA_SIZE, "ext4", "DATA", "/data",
+                   "defaults,noatime")
             use_data=0
+        try:
+            lvmplan.create(vg, progress.advance)
+        except (RuntimeError, JobError), e:
+            logger.error("Failed to create /dev/HostVG on %s: %s" %
+                         (" ".join(self.physical_vols), e))
+            return False
+        labelindex.invalidate()
+        fstab = vg.fstab()
         if use_data == 0:
-            system("mke2fs -j -t ext4 /dev/HostVG/Data -L \"DATA\"")
-            system("tune2fs -c 0 -i 0 /dev/HostVG/Data")
-            os.system("echo \"/dev/HostVG/Data /data ext4 defaults,noatime 0 0\" >> /etc/fstab")
-            os.system("echo \"/data/images /var/lib/libvirt/images bind bind 0 0\" >> /etc/fstab")
-            os.system("echo \"/data/core /var/log/core bind bind 0 0\" >> /etc/fstab")
+            fstab.append("/data/images /var/lib/libvirt/images bind bind 0 0\n")
+            fstab.append("/data/core /var/log/core bind bind 0 0\n")
+        append_file("/etc/fstab", "".join(fstab))
+        if self.SWAP_SIZE > 0 and OVIRT_VARS.has_key("OVIRT_CRYPT_SWAP"):
+            append_file("/etc/ovirt-crypttab", "SWAP /dev/HostVG/Swap /dev/mapper/ovirt-crypt-swap " + OVIRT_VARS["OVIRT_CRYPT_SWAP"] + "\n")
 
         logger.info("Mounting config partition")
         mount_config()
-        if os.path.ismount("/config"):
+        if mounttab.is_mounted("/config"):
             ovirt_store_config("/etc/fstab")
         # remount /var/log from tmpfs to HostVG/Logging
         unmount_logging()
@@ -445,108 +473,72 @@ class Storage:
 
     def create_iscsiroot(self):
         logger.info("Partitioning iscsi root drive: " + self.ISCSIDRIVE)
-        wipe_partitions(self.ISCSIDRIVE)
-        self.reread_partitions(self.ISCSIDRIVE)
-        logger.info("Labeling Drive: " + self.ISCSIDRIVE)
-        parted_cmd = "parted \""+ self.ISCSIDRIVE +"\" -s \"mklabel "+ self.LABEL_TYPE+"\""
-        logger.debug(parted_cmd)
-        system(parted_cmd)
-        logger.debug("Creating Root and RootBackup Partitions")
-        parted_cmd = "parted \"" + self.ISCSIDRIVE + "\" -s \"mkpart primary ext2 1M 256M\""
-        logger.debug(parted_cmd)
-        system(parted_cmd)
-        parted_cmd = "parted \"" + self.ISCSIDRIVE + "\" -s \"mkpart primary ext2 256M 512M\""
-        logger.debug(parted_cmd)
-        system(parted_cmd)
-        # sleep to ensure filesystems are created before continuing
-        time.sleep(5)
-        # force reload some cciss devices will fail to mkfs
-        system("multipath -r")
-        self.reread_partitions(self.ISCSIDRIVE)
-        partroot = self.ISCSIDRIVE + "1"
-        partrootbackup = self.ISCSIDRIVE + "2"
-        if not os.path.exists(partroot):
-            partroot = self.ISCSIDRIVE + "p1"
-            partrootbackup= self.ISCSIDRIVE + "p2"
-        system("ln -snf \""+partroot+"\" /dev/disk/by-label/Root")
-        system("mke2fs \""+partroot+"\" -L Root")
-        system("tune2fs -c 0 -i 0 \""+partroot+"\"")
-        system("ln -snf \""+partrootbackup+"\" /dev/disk/by-label/RootBackup")
-        system("mke2fs \""+partrootbackup+"\" -L RootBackup")
-        system("tune2fs -c 0 -i 0 \""+partrootbackup+"\"")
+        layout = self.new_layout(self.ISCSIDRIVE)
+        layout.add("Root", 256)
+        layout.add("RootBackup", 512)
+        self.add_hostvg(self.ISCSIDRIVE, layout)
+        parts = self.write_layout(self.ISCSIDRIVE, layout)
+        if parts is None:
+            return False
+        partroot = parts["Root"]
+        partrootbackup = parts["RootBackup"]
+        system(["ln", "-snf", partroot, "/dev/disk/by-label/Root"])
+        system(["mke2fs", partroot, "-L", "Root"])
+        system(["tune2fs", "-c", "0", "-i", "0", partroot])
+        system(["ln", "-snf", partrootbackup, "/dev/disk/by-label/RootBackup"])
+        system(["mke2fs", partrootbackup, "-L", "RootBackup"])
+        system(["tune2fs", "-c", "0", "-i", "0", partrootbackup])
+        labelindex.invalidate()
         return True
 
+    @span("storage.create_appvg")
     def create_appvg(self):
+        progress.phase("storage.appvg")
         logger.info("Creating LVM partition(s) for AppVG")
-        physical_vols = []
         logger.debug("APPVGDRIVE: " + ' '.join(self.APPVGDRIVE))
         logger.debug("SWAP2_SIZE: " + str(self.SWAP2_SIZE))
         logger.debug("DATA2_SIZE: " + str(self.DATA2_SIZE))
-        for drv in self.APPVGDRIVE:
-            wipe_partitions(drv)
-            self.reread_partitions(drv)
-            logger.info("Labeling Drive: " + drv)
-            appvgpart = "1"
-            while True:
-                parted_cmd = "parted -s \"" + drv + "\" \"mklabel " + self.LABEL_TYPE + " mkpart primary ext2 2048s -1 set " + appvgpart + " lvm on print\""
-                system(parted_cmd)
-                self.reread_partitions(drv)
-                if os.path.exists(drv + appvgpart) or os.path.exists(drv + "p" + appvgpart):
-                    break
-
-            partpv = drv + appvgpart
-            if not os.path.exists(partpv):
-                # e.g. /dev/cciss/c0d0p2
-                partpv=drv + "p" + appvgpart
-            logger.info("Creating physical volume")
-            if not os.path.exists(partpv):
-                logger.error(partpv + " is not available!")
-                sys.exit(1)
-            dd_cmd = "dd if=/dev/zero of=\""+ partpv + "\" bs=1024k count=1"
-            logger.info(dd_cmd)
-            system(dd_cmd)
-            system("pvcreate -ff -y \"" + partpv + "\"")
-            physical_vols.append(partpv)
-
-        logger.info("Creating volume group AppVG")
-        is_first = True
-        for drv in physical_vols:
-            if is_first:
-                system("vgcreate AppVG \"" + drv + "\"")
-                is_first = False
-            else:
-                system("vgextend AppVG \"" + drv +"\"")
+        physical_vols = self.prepare_drives(self.APPVGDRIVE, "AppVG")
+        if physical_vols is None:
+            sys.exit(1)
 
+        vg = lvmplan.VolumeGroup("AppVG", physical_vols)
+        crypt_swap2 = OVIRT_VARS.has_key("OVIRT_CRYPT_SWAP2")
         if self.SWAP2_SIZE > 0:
-            logger.info("Creating swap2 partition")
-            lv_cmd = "lvcreate --name Swap2 --size \"" + str(self.SWAP2_SIZE) + "M\" /dev/AppVG"
-            logger.debug(lv_cmd)
-            system(lv_cmd)
-            if OVIRT_VARS.has_key("OVIRT_CRYPT_SWAP2"):
-                os.system("echo \"SWAP2 /dev/AppVG/Swap2 /dev/mapper/ovirt-crypt-swap2 " + OVIRT_VARS["OVIRT_CRYPT_SWAP2"] + "\" >> /etc/ovirt-crypttab")
+            if crypt_swap2:
+                # formatted when the encrypted swap is set up
+                vg.add("Swap2", self.SWAP2_SIZE)
             else:
-                system("mkswap -L \"SWAP2\" /dev/AppVG/Swap2")
-                os.system("echo \"/dev/AppVG/Swap2 swap swap defaults 0 0\" >> /etc/fstab")
+                vg.add("Swap2", self.SWAP2_SIZE, "swap", "SWAP2", "swap")
 
         use_data = "1"
         if self.DATA2_SIZE == -1:
             logger.info("Creating data2 partition with remaining free space")
-            system("lvcreate --name Data2 -l 100%FREE /dev/AppVG")
+            vg.add("Data2", None, "ext4", "DATA2", "/data2",
+                   "defaults,noatime")
             use_data = 0
         elif self.DATA2_SIZE > 0:
-            logger.info("Creating data2 partition")
-            system("lvcreate --name Data2 --size " + str(self.DATA2_SIZE) + "M /dev/AppVG")
+            vg.add("Data2", self.DATA2_SIZE, "ext4", "DATA2", "/data2",
+                   "defaults,noatime")
             use_data = 0
+        try:
+            lvmplan.create(vg, progress.advance)
+        except (RuntimeError, JobError), e:
+            logger.error("Failed to create AppVG on %s: %s" %
+                         (" ".join(physical_vols), e))
+            sys.exit(1)
+        labelindex.invalidate()
+        append_file("/etc/fstab", "".join(vg.fstab()))
+        if self.SWAP2_SIZE > 0 and crypt_swap2:
+            append_file("/etc/ovirt-crypttab", "SWAP2 /dev/AppVG/Swap2 /dev/mapper/ovirt-crypt-swap2 " + OVIRT_VARS["OVIRT_CRYPT_SWAP2"] + "\n")
 
         if use_data == 0:
-            system("mke2fs -j -t ext4 /dev/AppVG/Data2 -L \"DATA2\"")
-            system("tune2fs -c 0 -i 0 /dev/AppVG/Data2")
-            os.system("echo \"/dev/AppVG/Data2 /data2 ext4 defaults,noatime 0 0\" >> /etc/fstab")
             logger.info("Mounting data2 partition")
             mount_data2()
             logger.info("Completed AppVG!")
             return True
 
+    @span("storage.perform_partitioning")
     def perform_partitioning(self):
         if self.HOSTVGDRIVE is None and not is_iscsi_install():
             logger.error("\nNo storage device selected.")
@@ -566,6 +558,7 @@ class Storage:
         logger.info("Saving parameters")
         unmount_config("/etc/default/ovirt")
 
+        progress.phase("storage.prepare")
         logger.info("Removing old LVM partitions")
         # HostVG must not exist at this point
         # we wipe only foreign LVM here
@@ -575,48 +568,36 @@ class Storage:
         self.wipe_lvm_on_disk(self.ROOTDRIVE)
         logger.info("Wiping LVM on BOOTDRIVE %s" % self.BOOTDRIVE)
         self.wipe_lvm_on_disk(self.BOOTDRIVE)
-        self.boot_size_si = self.BOOT_SIZE * (1024 * 1024) / (1000 * 1000)
         if is_iscsi_install():
             # login to target and setup disk"
-            get_targets = "iscsiadm -m discovery -p %s:%s -t sendtargets" % (OVIRT_VARS["OVIRT_ISCSI_TARGET_HOST"],OVIRT_VARS["OVIRT_ISCSI_TARGET_PORT"])
+            portal = "%s:%s" % (OVIRT_VARS["OVIRT_ISCSI_TARGET_HOST"], OVIRT_VARS["OVIRT_ISCSI_TARGET_PORT"])
+            get_targets = ["iscsiadm", "-m", "discovery", "-p", portal, "-t", "sendtargets"]
             system(get_targets)
             before_login_drvs = self.get_dev_name()
             logger.debug(before_login_drvs)
-            login_cmd = "iscsiadm -m node -T %s -p %s:%s -l" % (OVIRT_VARS["OVIRT_ISCSI_TARGET_NAME"], OVIRT_VARS["OVIRT_ISCSI_TARGET_HOST"], OVIRT_VARS["OVIRT_ISCSI_TARGET_PORT"])
+            login_cmd = ["iscsiadm", "-m", "node", "-T", OVIRT_VARS["OVIRT_ISCSI_TARGET_NAME"], "-p", portal, "-l"]
             system(login_cmd)
-            system("multipath -r")
+            system(["multipath", "-r"])
             after_login_drvs = self.get_dev_name()
             logger.debug(after_login_drvs)
+            progress.phase("storage.root")
             logger.info("iSCSI enabled, partitioning boot drive: %s" % self.BOOTDRIVE)
-            wipe_partitions(self.BOOTDRIVE)
-            self.reread_partitions(self.BOOTDRIVE)
             logger.info("Creating boot partition")
-            parted_cmd="parted %s -s \"mklabel %s\"" % (self.BOOTDRIVE, self.LABEL_TYPE)
-            system(parted_cmd)
-            parted_cmd="parted \"%s\" -s \"mkpart primary ext2 1M 256M\"" % self.BOOTDRIVE
-            system(parted_cmd)
-            parted_cmd="parted \"%s\" -s \"mkpart primary ext2 256M 512M\"" % self.BOOTDRIVE
-            system(parted_cmd)
-            parted_cmd = "parted \""+self.BOOTDRIVE+"\" -s \"set 1 boot on\""
-            system(parted_cmd)
-            self.reread_partitions(self.BOOTDRIVE)
-            partboot= self.BOOTDRIVE + "1"
-            if not os.path.exists(partboot):
-                logger.debug("%s does not exist" % partboot)
-                partboot = self.BOOTDRIVE + "p1"
-            partbootbackup= self.BOOTDRIVE + "2"
-            if not os.path.exists(partbootbackup):
-                logger.debug("%s does not exist" % partbootbackup)
-                partbootbackup = self.BOOTDRIVE + "p2"
-            # sleep to ensure filesystems are created before continuing
-            system("udevadm settle")
-            time.sleep(10)
-            system("mke2fs \""+str(partboot)+"\" -L Boot")
-            system("tune2fs -c 0 -i 0 \""+str(partboot)+"\"")
-            system("ln -snf \""+partboot+"\" /dev/disk/by-label/Boot")
-            system("mke2fs \""+str(partbootbackup)+"\" -L BootBackup")
-            system("tune2fs -c 0 -i 0 \""+str(partbootbackup)+"\"")
-            system("ln -snf \""+partbootbackup+"\" /dev/disk/by-label/BootBackup")
+            layout = self.new_layout(self.BOOTDRIVE)
+            layout.add("Boot", 256, bootable=True)
+            layout.add("BootBackup", 512)
+            self.add_hostvg(self.BOOTDRIVE, layout)
+            parts = self.write_layout(self.BOOTDRIVE, layout)
+            if parts is None:
+                return False
+            partboot = parts["Boot"]
+            partbootbackup = parts["BootBackup"]
+            system(["mke2fs", str(partboot), "-L", "Boot"])
+            system(["tune2fs", "-c", "0", "-i", "0", str(partboot)])
+            system(["ln", "-snf", partboot, "/dev/disk/by-label/Boot"])
+            system(["mke2fs", str(partbootbackup), "-L", "BootBackup"])
+            system(["tune2fs", "-c", "0", "-i", "0", str(partbootbackup)])
+            system(["ln", "-snf", partbootbackup, "/dev/disk/by-label/BootBackup"])
             self.ISCSIDRIVE =  translate_multipath_device(OVIRT_VARS["OVIRT_ISCSI_INIT"])
             logger.debug(self.ISCSIDRIVE)
             if self.create_iscsiroot():
@@ -626,63 +607,32 @@ class Storage:
                     return True
 
         if OVIRT_VARS.has_key("OVIRT_ROOT_INSTALL") and OVIRT_VARS["OVIRT_ROOT_INSTALL"] == "y":
+            progress.phase("storage.root")
             logger.info("Partitioning root drive: " + self.ROOTDRIVE)
-            wipe_partitions(self.ROOTDRIVE)
-            self.reread_partitions(self.ROOTDRIVE)
-            logger.info("Labeling Drive: " + self.ROOTDRIVE)
-            parted_cmd = "parted \""+ self.ROOTDRIVE +"\" -s \"mklabel "+ self.LABEL_TYPE+"\""
-            logger.debug(parted_cmd)
-            system(parted_cmd)
             logger.debug("Creating Root and RootBackup Partitions")
-            # efi partition should at 0M
+            layout = self.new_layout(self.ROOTDRIVE)
             if is_efi_boot():
-                efi_start = 0
-                parted_cmd = "parted \"" + self.ROOTDRIVE + "\" -s \"mkpart EFI " + str(efi_start) + "M " + str(self.EFI_SIZE)+"M\""
-                logger.debug(parted_cmd)
-                system(parted_cmd)
+                layout.add("EFI", self.EFI_SIZE, kind="efi")
             else:
-                efi_start = 1
-                # create partition labeled bios_grub
-                parted_cmd = "parted \"" + self.ROOTDRIVE + "\" -s \"mkpart primary " + str(efi_start) + "M " + str(self.EFI_SIZE)+"M\""
-                logger.debug(parted_cmd)
-                system(parted_cmd)
-                parted_cmd = "parted \"" + self.ROOTDRIVE + "\" -s \"set 1 bios_grub on\""
-                logger.debug(parted_cmd)
-                system(parted_cmd)
-            parted_cmd = "parted \"" + self.ROOTDRIVE + "\" -s \"mkpart primary ext2 "+str(self.EFI_SIZE)+"M "+ str(self.Root_end)+"M\""
-            logger.debug(parted_cmd)
-            system(parted_cmd)
-            parted_cmd = "parted \""+self.ROOTDRIVE+"\" -s \"mkpart primary ext2 "+str(self.Root_end)+"M "+str(self.RootBackup_end)+"M\""
-            logger.debug(parted_cmd)
-            system(parted_cmd)
-            parted_cmd = "parted \""+self.ROOTDRIVE+"\" -s \"set 2 boot on\""
-            logger.debug(parted_cmd)
-            system(parted_cmd)
-            # sleep to ensure filesystems are created before continuing
-            time.sleep(5)
-            # force reload some cciss devices will fail to mkfs
-            system("multipath -r")
-            self.reread_partitions(self.ROOTDRIVE)
-            partefi = self.ROOTDRIVE + "1"
-            partroot = self.ROOTDRIVE + "2"
-            partrootbackup = self.ROOTDRIVE + "3"
-            if not os.path.exists(partroot):
-                partefi = self.ROOTDRIVE + "p1"
-                partroot = self.ROOTDRIVE + "p2"
-                partrootbackup= self.ROOTDRIVE + "p3"
+                layout.add("bios_grub", self.EFI_SIZE, kind="bios_grub")
+            layout.add("Root", self.Root_end, bootable=True)
+            layout.add("RootBackup", self.RootBackup_end)
+            self.add_hostvg(self.ROOTDRIVE, layout)
+            parts = self.write_layout(self.ROOTDRIVE, layout)
+            if parts is None:
+                return False
+            partefi = parts[layout.partitions[0].name]
+            partroot = parts["Root"]
+            partrootbackup = parts["RootBackup"]
             if is_efi_boot():
-                system("ln -snf \""+partefi+"\" /dev/disk/by-label/EFI")
-                system("mkfs.vfat \""+partefi+"\" -n EFI -F32")
-            system("ln -snf \""+partroot+"\" /dev/disk/by-label/Root")
-            system("mke2fs \""+partroot+"\" -L Root")
-            system("tune2fs -c 0 -i 0 \""+partroot+"\"")
-            system("ln -snf \""+partrootbackup+"\" /dev/disk/by-label/RootBackup")
-            system("mke2fs \""+partrootbackup+"\" -L RootBackup")
-            system("tune2fs -c 0 -i 0 \""+partrootbackup+"\"")
-        hostvg1=self.HOSTVGDRIVE.split(",")[0]
-        self.reread_partitions(self.ROOTDRIVE)
-        if self.ROOTDRIVE != hostvg1 :
-            system("parted \"" + hostvg1 +"\" -s \"mklabel " + self.LABEL_TYPE + "\"")
+                system(["ln", "-snf", partefi, "/dev/disk/by-label/EFI"])
+                system(["mkfs.vfat", partefi, "-n", "EFI", "-F32"])
+            system(["ln", "-snf", partroot, "/dev/disk/by-label/Root"])
+            system(["mke2fs", partroot, "-L", "Root"])
+            system(["tune2fs", "-c", "0", "-i", "0", partroot])
+            system(["ln", "-snf", partrootbackup, "/dev/disk/by-label/RootBackup"])
+            system(["mke2fs", partrootbackup, "-L", "RootBackup"])
+            system(["tune2fs", "-c", "0", "-i", "0", partrootbackup])
         if self.create_hostvg():
             if len(self.APPVGDRIVE) > 0:
                 self.create_appvg()
@@ -740,10 +690,7 @@ class Storage:
                 logger.info("Required Space : " + str(drive_need_size) + "MB")
 
 def wipe_fakeraid(device):
-    dmraid_cmd = "echo y | dmraid -rE $(readlink -f \"%s\")" % device
-    dmraid=subprocess.Popen(dmraid_cmd, stdout=PIPE, stderr=STDOUT, shell=True)
-    dmraid.communicate()
-    dmraid.poll()
+    dmraid = process.run(["dmraid", "-rE", os.path.realpath(device)], input="y\n")
     if dmraid.returncode == 0:
         return True
     else:
@@ -758,6 +705,7 @@ def handle_fakeraid(device):
     logger.error("then boot with the wipe-fakeraid option on the kernel commandline.")
     return False
 
+@span("storage_auto")
 def storage_auto():
     storage = Storage()
     if not OVIRT_VARS["OVIRT_INIT"] == "":
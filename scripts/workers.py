@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# workers.py - Copyright (C) 2012 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""Small thread pool for running independent blocking jobs side by side.
+
+The jobs this is meant for wait in the kernel or on child processes
+(mount(2), mkfs, dd), so threads overlap them well despite the GIL.
+"""
+
+import sys
+import threading
+import Queue
+
+DEFAULT_WORKERS = 4
+
+
+class JobError(Exception):
+    """Raised by parallel_map when jobs failed.
+
+    errors holds (item, exc_info) for every failed job.
+    """
+
+    def __init__(self, errors):
+        Exception.__init__(self, "%d job(s) failed, first: %s" %
+                           (len(errors), errors[0][1][1]))
+        self.errors = errors
+
+
+def parallel_map(func, items, workers=DEFAULT_WORKERS):
+    """Calls func on every item using up to workers threads.
+
+    Returns the results in the order of items.  All jobs are run even
+    if some fail; failures are raised afterwards as one JobError.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors = []
+    if workers <= 1 or len(items) <= 1:
+        for n, item in enumerate(items):
+            try:
+                results[n] = func(item)
+            except Exception:
+                errors.append((item, sys.exc_info()))
+    else:
+        jobs = Queue.Queue()
+        for n, item in enumerate(items):
+            jobs.put((n, item))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                try:
+                    n, item = jobs.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[n] = func(item)
+                except Exception:
+                    lock.acquire()
+                    try:
+                        errors.append((item, sys.exc_info()))
+                    finally:
+                        lock.release()
+
+        threads = []
+        for i in range(min(workers, len(items))):
+            t = threading.Thread(target=worker)
+            t.setDaemon(True)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+    if errors:
+        raise JobError(errors)
+    return results